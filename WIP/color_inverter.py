@@ -1,117 +1,314 @@
 import os
+import sys
+
+# Los módulos compartidos con PaletteSwapper están en la carpeta 'source'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "source"))
+from launcher import handle_info_options, lazy_import
+
+if __name__ == "__main__":
+    # Responder a --version / --help sin cargar Tk ni Pillow
+    handle_info_options('color_inverter')
+
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog, messagebox
 import tkinter as tk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image, ImageOps
+# Pillow se carga al procesar la primera imagen, no al arrancar
+Image = lazy_import('PIL.Image')
+ImageOps = lazy_import('PIL.ImageOps')
+
+from batch_plan import plan_invert, load_plan, execute_plan, show_plan_window
+from results import BatchReport, FileResult, STATUS_OK, STATUS_FAILED
+
+EXTENSIONES = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+# Diario que permite reanudar un lote interrumpido sin invertir dos veces
+NOMBRE_DIARIO = ".color_inverter_journal.txt"
+# Las imágenes se escriben primero aquí y luego se renombran sobre el original
+SUFIJO_TEMPORAL = ".invtmp"
+# Línea del diario escrita antes de crear el temporal de una imagen
+MARCA_INICIO = "inicio"
+
+# Tablas de consulta para Image.point: invierten los canales de color y
+# dejan intacto el canal alfa, todo en una sola pasada sobre la imagen.
+_INVERTIR = [255 - i for i in range(256)]
+_IDENTIDAD = list(range(256))
+TABLAS_INVERSION = {
+    "L": _INVERTIR,
+    "LA": _INVERTIR + _IDENTIDAD,
+    "RGB": _INVERTIR * 3,
+    "RGBA": _INVERTIR * 3 + _IDENTIDAD,
+}
+
+def invertir_paleta(img):
+    """
+    Invierte directamente las entradas de la paleta de una imagen indexada (P).
+    Los índices de los píxeles no cambian, así que el coste es O(256) en lugar
+    de O(píxeles) y la imagen conserva su paleta, su transparencia y su profundidad.
+    """
+    modo_paleta = img.palette.mode
+    canales = len(modo_paleta)
+    paleta = img.getpalette(modo_paleta)
+    # El canal alfa de las paletas RGBA (posición 3) se conserva
+    nueva = [v if i % canales == 3 else 255 - v for i, v in enumerate(paleta)]
+    img.putpalette(nueva, modo_paleta)
+    return img
+
+def invertir(img):
+    """
+    Devuelve la imagen invertida manteniendo su modo original siempre que
+    sea posible. Las imágenes indexadas se invierten a través de la paleta y
+    el resto con una única tabla de consulta que no toca el canal alfa.
+    """
+    if img.mode == 'P':
+        return invertir_paleta(img)
+    tabla = TABLAS_INVERSION.get(img.mode)
+    if tabla is not None:
+        return img.point(tabla)
+    # Convertir otros modos a RGB
+    return ImageOps.invert(img.convert("RGB"))
+
+class Diario:
+    """
+    Registro persistente de las imágenes ya invertidas dentro de una carpeta.
+    Cada línea guarda la ruta relativa junto con la fecha de modificación y el
+    tamaño del archivo escrito, de modo que una imagen solo cuenta como hecha
+    si el archivo actual coincide con lo registrado. Antes de escribir el
+    temporal de una imagen se anota su inicio, para saber qué temporales dejó
+    una ejecución interrumpida.
+    """
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        self.ruta = os.path.join(carpeta, NOMBRE_DIARIO)
+        self.entradas = {}
+        self.iniciadas = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.ruta):
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                for linea in f:
+                    partes = linea.rstrip("\n").split("\t")
+                    # Una línea cortada por una interrupción se ignora
+                    if len(partes) == 3 and partes[1].isdigit() and partes[2].isdigit():
+                        self.entradas[partes[0]] = (int(partes[1]), int(partes[2]))
+                    elif len(partes) == 2 and partes[1] == MARCA_INICIO:
+                        self.iniciadas.add(partes[0])
+        self._archivo = open(self.ruta, "a", encoding="utf-8")
+
+    def ya_invertida(self, ruta):
+        firma = self.entradas.get(os.path.relpath(ruta, self.carpeta))
+        if firma is None:
+            return False
+        try:
+            st = os.stat(ruta)
+        except OSError:
+            return False
+        return firma == (st.st_mtime_ns, st.st_size)
+
+    def sin_terminar(self):
+        """Rutas de las imágenes que una ejecución anterior empezó a escribir y no llegó a terminar."""
+        rutas = [os.path.join(self.carpeta, relativa) for relativa in sorted(self.iniciadas)]
+        return [ruta for ruta in rutas if not self.ya_invertida(ruta)]
+
+    def iniciar(self, ruta):
+        self._escribir(f"{os.path.relpath(ruta, self.carpeta)}\t{MARCA_INICIO}\n")
+
+    def registrar(self, ruta, st):
+        self._escribir(f"{os.path.relpath(ruta, self.carpeta)}\t{st.st_mtime_ns}\t{st.st_size}\n")
+
+    def _escribir(self, linea):
+        with self._lock:
+            self._archivo.write(linea)
+            self._archivo.flush()
+
+    def cerrar(self, completado):
+        """Cierra el diario y lo elimina si el lote terminó sin errores."""
+        self._archivo.close()
+        if completado:
+            os.remove(self.ruta)
 
-def invertir_imagen(ruta):
+def invertir_imagen(ruta, diario=None):
     """
-    Abre la imagen en 'ruta', la convierte si es necesario y 
-    devuelve True si se invirtió correctamente.
+    Abre la imagen en 'ruta', la invierte conservando su modo y devuelve True.
+    Los errores se propagan al llamador.
+    El resultado se guarda en un archivo temporal que después reemplaza al
+    original, así que una interrupción nunca deja imágenes a medio escribir.
     """
+    temporal = ruta + SUFIJO_TEMPORAL
+    if diario is not None:
+        diario.iniciar(ruta)
     try:
-        img = Image.open(ruta)
-        # Convertir a RGB si es indexada
-        if img.mode == 'P':
-            img = img.convert("RGB")
-        # Si tiene canal alfa, separamos alfa y trabajamos sobre RGB
-        if img.mode == 'RGBA':
-            r, g, b, a = img.split()
-            rgb_img = Image.merge("RGB", (r, g, b))
-            inverted = ImageOps.invert(rgb_img)
-            r2, g2, b2 = inverted.split()
-            img_invertida = Image.merge("RGBA", (r2, g2, b2, a))
-        elif img.mode in ['RGB', 'L']:
-            img_invertida = ImageOps.invert(img)
-        else:
-            # Convertir otros modos a RGB
-            img_invertida = ImageOps.invert(img.convert("RGB"))
-        img_invertida.save(ruta)
+        with Image.open(ruta) as img:
+            img_invertida = invertir(img)
+            img_invertida.save(temporal, format=img.format)
+        if diario is not None:
+            # os.replace conserva la fecha del temporal, que es la que se registra
+            diario.registrar(ruta, os.stat(temporal))
+        os.replace(temporal, ruta)
         return True
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+def invertir_con_resultado(ruta, diario=None):
+    """Invierte una imagen y devuelve su FileResult; un error nunca detiene el lote."""
+    inicio = time.perf_counter()
+    try:
+        leidos = os.path.getsize(ruta)
+        invertir_imagen(ruta, diario)
     except Exception as e:
-        print(f"Error procesando {ruta}: {e}")
-        return False
+        return FileResult.failure(ruta, ruta, e, time.perf_counter() - inicio)
+    return FileResult(ruta, ruta, seconds=time.perf_counter() - inicio,
+                      bytes_read=leidos, bytes_written=os.path.getsize(ruta))
 
-def procesar_carpeta(carpeta):
-    total = 0
-    procesadas = 0
-    errores = 0
+def procesar_carpeta(carpeta, informe, trabajadores=None):
+    """
+    Invierte en paralelo todas las imágenes de la carpeta y sus subcarpetas,
+    añadiendo el resultado de cada una al informe (BatchReport).
+    Las imágenes registradas en el diario de una ejecución interrumpida se
+    cuentan como procesadas y no se vuelven a invertir.
+    """
+    rutas = []
     for root_dir, _, files in os.walk(carpeta):
         for file in files:
-            ruta = os.path.join(root_dir, file)
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                total += 1
-                if invertir_imagen(ruta):
-                    procesadas += 1
-                else:
-                    errores += 1
-    return total, procesadas, errores
-
-def procesar_archivo_o_carpeta(ruta):
-    if os.path.isdir(ruta):
-        return procesar_carpeta(ruta)
-    else:
-        if ruta.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-            total = 1
-            procesadas = 1 if invertir_imagen(ruta) else 0
-            errores = 0 if procesadas == 1 else 1
-            return total, procesadas, errores
-    return 0, 0, 0
+            if file.lower().endswith(EXTENSIONES):
+                rutas.append(os.path.join(root_dir, file))
 
-def drop(event):
-    files = root.tk.splitlist(event.data)
-    total_global = 0
-    procesadas_global = 0
-    errores_global = 0
-    for f in files:
-        ruta = f.strip()
-        if os.path.exists(ruta):
-            total, procesadas, errores = procesar_archivo_o_carpeta(ruta)
-            total_global += total
-            procesadas_global += procesadas
-            errores_global += errores
+    diario = Diario(carpeta)
+    # Solo se borran los temporales que el diario sabe que dejó una ejecución
+    # interrumpida (el original sigue intacto); los demás no son nuestros
+    for ruta in diario.sin_terminar():
+        temporal = ruta + SUFIJO_TEMPORAL
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    pendientes = []
+    for ruta in rutas:
+        if diario.ya_invertida(ruta):
+            informe.add(FileResult(ruta, ruta))
         else:
-            print(f"La ruta no existe: {ruta}")
-    if total_global == 0:
+            pendientes.append(ruta)
+    errores = 0
+    try:
+        with ThreadPoolExecutor(max_workers=trabajadores) as pool:
+            for resultado in pool.map(lambda ruta: invertir_con_resultado(ruta, diario), pendientes):
+                informe.add(resultado)
+                errores += resultado.status != STATUS_OK
+    finally:
+        diario.cerrar(completado=errores == 0)
+
+def procesar_rutas(rutas):
+    """Invierte los archivos y carpetas indicados y devuelve el BatchReport del lote."""
+    informe = BatchReport('invert')
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            procesar_carpeta(ruta, informe)
+        elif not os.path.exists(ruta):
+            informe.add(FileResult.failure(ruta, ruta, FileNotFoundError(f"La ruta no existe: {ruta}")))
+        elif ruta.lower().endswith(EXTENSIONES):
+            informe.add(invertir_con_resultado(ruta))
+    informe.finish()
+    return informe
+
+def mostrar_resultado(informe):
+    if not informe.results:
         messagebox.showinfo("Proceso completado", "No se encontraron imágenes para procesar.")
-    else:
-        mensaje = f"Se procesaron {procesadas_global} de {total_global} imágenes."
-        if errores_global:
-            mensaje += f"\nHubo {errores_global} errores (revisa la consola para más detalles)."
-        messagebox.showinfo("Proceso completado", mensaje)
+        return
+    procesadas = len(informe.by_status(STATUS_OK))
+    mensaje = f"Se procesaron {procesadas} de {len(informe.results)} imágenes."
+    if informe.by_status(STATUS_FAILED):
+        # Un único resumen al final, con el informe completo en JSON para reintentar los fallos
+        mensaje += f"\n\n{informe.summary(max_errors=10)}"
+        try:
+            informe.save(informe.default_filename())
+            mensaje += f"\n\nInforme completo: {informe.default_filename()}"
+        except OSError as e:
+            mensaje += f"\n\nNo se pudo guardar el informe: {e}"
+    messagebox.showinfo("Proceso completado", mensaje)
+
+def ejecutar_plan(plan):
+    """Invierte exactamente las imágenes listadas en un plan guardado."""
+    informe = BatchReport('invert')
+    # Las imágenes modificadas desde que se hizo el plan no se tocan
+    execute_plan(plan, lambda ruta, salida: invertir_imagen(ruta), workers=os.cpu_count(), report=informe)
+    return informe
+
+def ejecutar_en_segundo_plano(tarea, *args):
+    """
+    Ejecuta la tarea en un hilo aparte para no bloquear la ventana.
+    El resultado se recoge desde el hilo de Tk consultando una cola.
+    """
+    resultados = queue.Queue()
+    hilo = threading.Thread(target=lambda: resultados.put(tarea(*args)), daemon=True)
+    hilo.start()
+    boton.config(state="disabled")
+
+    def comprobar():
+        try:
+            informe = resultados.get_nowait()
+        except queue.Empty:
+            root.after(100, comprobar)
+            return
+        boton.config(state="normal")
+        mostrar_resultado(informe)
+
+    root.after(100, comprobar)
+
+def drop(event):
+    files = root.tk.splitlist(event.data)
+    ejecutar_en_segundo_plano(procesar_rutas, [f.strip() for f in files])
 
 def seleccionar_carpeta():
     carpeta = filedialog.askdirectory(title="Selecciona la carpeta con imágenes")
     if carpeta:
-        total, procesadas, errores = procesar_carpeta(carpeta)
-        if total == 0:
-            messagebox.showinfo("Proceso completado", "No se encontraron imágenes para procesar.")
-        else:
-            mensaje = f"Se procesaron {procesadas} de {total} imágenes."
-            if errores:
-                mensaje += f"\nHubo {errores} errores (revisa la consola para más detalles)."
-            messagebox.showinfo("Proceso completado", mensaje)
-
-# Configuración de la ventana principal usando TkinterDnD para drag and drop
-root = TkinterDnD.Tk()
-root.title("Inversor de Colores - Drag and Drop")
-root.geometry("500x300")
-
-# Etiqueta con instrucciones y fondo destacado
-instrucciones = (
-    "Arrastra y suelta aquí archivos o carpetas con imágenes\n"
-    "para invertir sus colores.\n\n"
-    "O haz clic en 'Seleccionar carpeta' para elegir manualmente."
-)
-label = tk.Label(root, text=instrucciones, wraplength=480, justify="center", bg="lightgreen", relief="raised", bd=2)
-label.pack(pady=20, padx=20, fill="both", expand=True)
-
-# Registrar la etiqueta como destino de drop
-label.drop_target_register(DND_FILES)
-label.dnd_bind('<<Drop>>', drop)
-
-# Botón para seleccionar carpeta manualmente
-boton = tk.Button(root, text="Seleccionar carpeta", command=seleccionar_carpeta)
-boton.pack(pady=10)
-
-root.mainloop()
+        ejecutar_en_segundo_plano(procesar_rutas, [carpeta])
+
+def simular_carpeta():
+    carpeta = filedialog.askdirectory(title="Selecciona la carpeta con imágenes")
+    if carpeta:
+        show_plan_window(root, plan_invert([carpeta]))
+
+def ejecutar_plan_guardado():
+    ruta = filedialog.askopenfilename(title="Selecciona un plan", filetypes=[("Planes", "*.json")])
+    if not ruta:
+        return
+    try:
+        plan = load_plan(ruta, 'invert')
+    except Exception as e:
+        messagebox.showerror("Error", f"No se pudo cargar el plan: {e}")
+        return
+    ejecutar_en_segundo_plano(ejecutar_plan, plan)
+
+def main():
+    global root, boton
+    # Configuración de la ventana principal usando TkinterDnD para drag and drop
+    root = TkinterDnD.Tk()
+    root.title("Inversor de Colores - Drag and Drop")
+    root.geometry("500x380")
+
+    # Etiqueta con instrucciones y fondo destacado
+    instrucciones = (
+        "Arrastra y suelta aquí archivos o carpetas con imágenes\n"
+        "para invertir sus colores.\n\n"
+        "O haz clic en 'Seleccionar carpeta' para elegir manualmente."
+    )
+    label = tk.Label(root, text=instrucciones, wraplength=480, justify="center", bg="lightgreen", relief="raised", bd=2)
+    label.pack(pady=20, padx=20, fill="both", expand=True)
+
+    # Registrar la etiqueta como destino de drop
+    label.drop_target_register(DND_FILES)
+    label.dnd_bind('<<Drop>>', drop)
+
+    # Botón para seleccionar carpeta manualmente
+    boton = tk.Button(root, text="Seleccionar carpeta", command=seleccionar_carpeta)
+    boton.pack(pady=10)
+
+    # Simulación previa y ejecución de planes guardados
+    tk.Button(root, text="Simular carpeta (sin cambios)", command=simular_carpeta).pack(pady=(0, 5))
+    tk.Button(root, text="Ejecutar plan guardado...", command=ejecutar_plan_guardado).pack(pady=(0, 10))
+
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,43 @@
 #!/usr/bin/env python3
 import os
+import sys
+
+# Los módulos compartidos con PaletteSwapper están en la carpeta 'source'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "source"))
+from launcher import handle_info_options
+
+if __name__ == "__main__":
+    # Responder a --version / --help sin cargar Tk ni Pillow
+    handle_info_options('convert_to_index')
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinterdnd2 import DND_FILES, TkinterDnD
-from PIL import Image
 from datetime import datetime
 
+from batch_plan import plan_convert_to_index, load_plan, save_plan, plan_retry, execute_plan_pipelined, overwritten_outputs, show_plan_window
+from index_engine import load_index_palette, convert_image_data, convert_image_bytes
+from atlas import AtlasWriter, check_fits
+from results import BatchReport, STATUS_FAILED
+from pipeline import write_file
+from reproducible import deterministic, HashRecorder, hashes_path
+from dither import DITHER_NONE, DITHER_FLOYD_STEINBERG, DITHER_BAYER_4, DITHER_BAYER_8
+
 class ConvertToIndexApp(TkinterDnD.Tk):
     def __init__(self):
         super().__init__()
         self.title("Convertir Imágenes a Modo Indexado")
-        self.geometry("600x650")
+        self.geometry("600x820")
         
         # Variables de configuración
         self.folder_path = tk.StringVar()
         self.palette_path = tk.StringVar()
         self.prefix = tk.StringVar()
         self.suffix = tk.StringVar()
+        self.dither_var = tk.StringVar(value=DITHER_FLOYD_STEINBERG)
+        self.reserve_transparency_var = tk.BooleanVar(value=False)
+        self.atlas_var = tk.BooleanVar(value=False)
+        self.deterministic_var = tk.BooleanVar(value=False)
         
         # Opciones de log
         self.save_log_var = tk.BooleanVar(value=True)
@@ -59,6 +80,26 @@ class ConvertToIndexApp(TkinterDnD.Tk):
         suffix_entry = ttk.Entry(options_frame, textvariable=self.suffix, width=20)
         suffix_entry.grid(row=0, column=3, padx=5, pady=5, sticky="w")
         
+        # Opciones de conversión
+        conversion_frame = ttk.LabelFrame(self, text="Opciones de Conversión")
+        conversion_frame.pack(fill="x", padx=10, pady=5)
+        dither_label = ttk.Label(conversion_frame, text="Tramado:")
+        dither_label.grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        no_dither_rb = ttk.Radiobutton(conversion_frame, text="Sin tramado (color perceptual más cercano)", variable=self.dither_var, value=DITHER_NONE)
+        no_dither_rb.grid(row=0, column=1, padx=5, pady=5, sticky="w")
+        floyd_rb = ttk.Radiobutton(conversion_frame, text="Floyd-Steinberg", variable=self.dither_var, value=DITHER_FLOYD_STEINBERG)
+        floyd_rb.grid(row=0, column=2, padx=5, pady=5, sticky="w")
+        bayer4_rb = ttk.Radiobutton(conversion_frame, text="Ordenado (Bayer 4x4)", variable=self.dither_var, value=DITHER_BAYER_4)
+        bayer4_rb.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        bayer8_rb = ttk.Radiobutton(conversion_frame, text="Ordenado (Bayer 8x8)", variable=self.dither_var, value=DITHER_BAYER_8)
+        bayer8_rb.grid(row=1, column=2, padx=5, pady=5, sticky="w")
+        reserve_chk = ttk.Checkbutton(conversion_frame, text="Reservar un índice de transparencia si la paleta no tiene", variable=self.reserve_transparency_var)
+        reserve_chk.grid(row=2, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+        atlas_chk = ttk.Checkbutton(conversion_frame, text="Empaquetar en atlas (hojas PNG + manifiesto JSON)", variable=self.atlas_var)
+        atlas_chk.grid(row=3, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+        deterministic_chk = ttk.Checkbutton(conversion_frame, text="Salida reproducible (sin metadatos variables, log sin fecha, hashes de salida)", variable=self.deterministic_var)
+        deterministic_chk.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+        
         # Opciones para el manejo del log
         log_frame = ttk.LabelFrame(self, text="Opciones de Log")
         log_frame.pack(fill="x", padx=10, pady=5)
@@ -78,8 +119,14 @@ class ConvertToIndexApp(TkinterDnD.Tk):
         hex_rb.grid(row=2, column=2, padx=5, pady=5, sticky="w")
         
         # Botón para iniciar la conversión
-        convert_btn = ttk.Button(self, text="Convertir Imágenes", command=self.start_conversion)
-        convert_btn.pack(pady=10)
+        buttons_frame = ttk.Frame(self)
+        buttons_frame.pack(pady=10)
+        convert_btn = ttk.Button(buttons_frame, text="Convertir Imágenes", command=self.start_conversion)
+        convert_btn.pack(side="left", padx=5)
+        dry_run_btn = ttk.Button(buttons_frame, text="Simular (sin cambios)", command=self.dry_run)
+        dry_run_btn.pack(side="left", padx=5)
+        run_plan_btn = ttk.Button(buttons_frame, text="Ejecutar plan guardado...", command=self.run_saved_plan)
+        run_plan_btn.pack(side="left", padx=5)
         
         # Área de texto para mostrar el estado y log en la UI
         self.status_text = tk.Text(self, height=12)
@@ -141,110 +188,166 @@ class ConvertToIndexApp(TkinterDnD.Tk):
         except Exception:
             return path
     
-    def start_conversion(self):
+    def get_plan(self):
+        """Valida el formulario y devuelve el plan de conversión, o None si no es válido."""
         folder = self.folder_path.get()
         palette_file = self.palette_path.get()
-        prefix = self.prefix.get()
-        suffix = self.suffix.get()
         
         if not folder or not os.path.isdir(folder):
             messagebox.showerror("Error", "Selecciona una carpeta válida de imágenes.")
-            return
+            return None
         if not palette_file or not os.path.isfile(palette_file):
             messagebox.showerror("Error", "Selecciona un archivo de paleta válido.")
+            return None
+        
+        return plan_convert_to_index(folder, palette_file, self.prefix.get(), self.suffix.get(),
+                                     self.dither_var.get(), self.reserve_transparency_var.get(),
+                                     self.atlas_var.get(), self.deterministic_var.get())
+    
+    def dry_run(self):
+        plan = self.get_plan()
+        if plan:
+            show_plan_window(self, plan)
+    
+    def start_conversion(self):
+        plan = self.get_plan()
+        if plan:
+            self.run_conversion(plan)
+    
+    def run_saved_plan(self):
+        plan_file = filedialog.askopenfilename(filetypes=[("Planes", "*.json")])
+        if not plan_file:
             return
+        try:
+            plan = load_plan(plan_file, 'convert_to_index')
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo cargar el plan: {e}")
+            return
+        overwritten = overwritten_outputs(plan)
+        if overwritten and not messagebox.askyesno("Confirmación", f"Se sobrescribirán {len(overwritten)} archivos. ¿Continuar?"):
+            return
+        self.folder_path.set(plan['params']['folder'])
+        self.run_conversion(plan)
+    
+    def run_conversion(self, plan):
+        palette_file = plan['params']['palette']
         
-        # Crear un nuevo archivo de log con fecha y hora actual
-        self.error_log_filename = f"conversion_errors_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        reproducible = plan['params'].get('deterministic', False)
+        if reproducible:
+            # Nombre fijo y sin fechas para que dos ejecuciones den el mismo log
+            self.error_log_filename = "conversion_errors.txt"
+            if self.save_log_var.get():
+                open(self.error_log_filename, "w", encoding="utf-8").close()
+        else:
+            # Crear un nuevo archivo de log con fecha y hora actual
+            self.error_log_filename = f"conversion_errors_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
         
         try:
-            palette_img = Image.open(palette_file).convert("P")
+            palette = load_index_palette(palette_file)
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo cargar la paleta: {e}")
             return
         
-        # Obtener el índice de transparencia de la paleta (si lo tiene)
-        trans_idx = palette_img.info.get('transparency')
-        if trans_idx is None:
+        # Reservar un índice de transparencia o avisar si la paleta no tiene
+        if palette.trans_idx is None and plan['params'].get('reserve_transparency'):
+            if palette.reserve_transparency_slot() is not None:
+                self.log(f"La paleta no tiene índice de transparencia; se ha reservado el índice {palette.trans_idx}.")
+            else:
+                self.log("La paleta está completa y no tiene entradas repetidas; no se pudo reservar un índice de transparencia.")
+        if palette.trans_idx is None:
             self.log("Advertencia: La paleta no tiene índice de transparencia. La transparencia no se conservará.")
         
-        # Preparar el conjunto de colores permitidos a partir de la paleta
-        palette_list = palette_img.getpalette()
-        allowed_colors = set()
-        for i in range(0, len(palette_list), 3):
-            allowed_colors.add((palette_list[i], palette_list[i+1], palette_list[i+2]))
-        
-        allowed_ext = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
-        
         # Variables para agrupar información
-        total_files = 0
+        total_files = len(plan['entries']) + len(plan['skipped'])
         converted_files = 0
-        already_indexed = []
+        # Las imágenes PNG indexadas ya se descartan en el plan leyendo solo su cabecera
+        already_indexed = [self.format_log_path(item['source']) for item in plan['skipped']]
         semitransparent_files = []
         unknown_colors_details = []   # Lista de tuplas: (ruta_formateada, [lista de colores])
         unknown_colors_aggregated = {}  # Dict: color -> cantidad de imágenes en las que aparece
+        nearest_colors = {}  # Dict: color -> (índice, color de la paleta, ΔE)
         conversion_errors = []
+        report = BatchReport('convert_to_index')
+        dither = plan['params'].get('dither', DITHER_FLOYD_STEINBERG)
+        # En modo atlas las imágenes convertidas se empaquetan en hojas en lugar de escribirse una a una
+        atlas = AtlasWriter(plan['params']['folder']) if plan['params'].get('atlas') else None
+        
+        def convert_for_atlas(data, file_path):
+            quant_img, info = convert_image_data(data, palette, dither)
+            # Una imagen mayor que la hoja cuenta como error de ese archivo
+            info['image'] = check_fits(quant_img)
+            return None, info
         
-        # Recorrer de forma recursiva la carpeta
-        for root, dirs, files in os.walk(folder):
-            for file in files:
-                if file.lower().endswith(allowed_ext):
-                    total_files += 1
-                    file_path = os.path.join(root, file)
-                    formatted_path = self.format_log_path(file_path)
-                    
-                    try:
-                        with Image.open(file_path) as img:
-                            # Si la imagen ya está en modo indexado, agrupar y omitir conversión
-                            if img.mode == "P":
-                                already_indexed.append(formatted_path)
-                                continue
-                            
-                            # Convertir a RGBA para analizar transparencia y colores
-                            rgba_img = img.convert("RGBA")
-                            data = list(rgba_img.getdata())
-                            
-                            semitransparent_flag = False
-                            unknown_colors = set()
-                            
-                            for pixel in data:
-                                r, g, b, a = pixel
-                                if a not in (0, 255):
-                                    semitransparent_flag = True
-                                if a == 255 and (r, g, b) not in allowed_colors:
-                                    unknown_colors.add((r, g, b))
-                            
-                            if semitransparent_flag:
-                                semitransparent_files.append(formatted_path)
-                            
-                            if unknown_colors:
-                                unknown_colors_sorted = sorted(unknown_colors)
-                                unknown_colors_details.append((formatted_path, unknown_colors_sorted))
-                                for color in unknown_colors_sorted:
-                                    unknown_colors_aggregated[color] = unknown_colors_aggregated.get(color, 0) + 1
-                            
-                            # Proceder a la conversión
-                            rgb_img = rgba_img.convert("RGB")
-                            quant_img = rgb_img.quantize(palette=palette_img, dither=Image.FLOYDSTEINBERG)
-                            
-                            if trans_idx is not None:
-                                quant_data = list(quant_img.getdata())
-                                new_data = [trans_idx if data[i][3] == 0 else quant_data[i] for i in range(len(data))]
-                                quant_img.putdata(new_data)
-                                quant_img.info["transparency"] = trans_idx
-                            
-                            name, _ = os.path.splitext(file)
-                            new_name = f"{prefix}{name}{suffix}.png"
-                            new_path = os.path.join(root, new_name)
-                            quant_img.save(new_path)
-                            self.log(f"Convertido: {self.format_log_path(new_path)}")
-                            converted_files += 1
-                    except Exception as e:
-                        err_msg = f"Error al convertir {formatted_path}: {e}"
-                        conversion_errors.append(err_msg)
-                        self.log(err_msg)
-                        if self.save_log_var.get():
-                            self.write_error_log(err_msg)
+        def on_result(file_path, new_path, info, error):
+            # Se ejecuta en el hilo de la interfaz a medida que termina cada archivo
+            nonlocal converted_files
+            formatted_path = self.format_log_path(file_path)
+            if error is not None:
+                err_msg = f"Error al convertir {formatted_path}: {error}"
+                conversion_errors.append(err_msg)
+                self.log(err_msg)
+                # En modo reproducible los errores se escriben ordenados al final
+                if self.save_log_var.get() and not reproducible:
+                    self.write_error_log(err_msg)
+                return
+            
+            # Si la imagen ya está en modo indexado, agrupar y omitir conversión
+            if info['indexed']:
+                already_indexed.append(formatted_path)
+                return
+            
+            if info['semitransparent']:
+                semitransparent_files.append(formatted_path)
+            
+            unknown_colors_sorted = info['unknown_colors']
+            if unknown_colors_sorted:
+                unknown_colors_details.append((formatted_path, unknown_colors_sorted))
+                for color in unknown_colors_sorted:
+                    unknown_colors_aggregated[color] = unknown_colors_aggregated.get(color, 0) + 1
+                nearest_colors.update(info['nearest'])
+            
+            if atlas is not None:
+                # Clave relativa a la carpeta: a/x.png y b/x.png no se pisan
+                atlas.add(atlas.sprite_name(new_path), info['image'])
+            self.log(f"Convertido: {self.format_log_path(new_path)}")
+            converted_files += 1
+        
+        transform = convert_for_atlas if atlas is not None else (lambda data, file_path: convert_image_bytes(data, palette, dither))
+        recorder = None
+        if reproducible and atlas is None:
+            transform = deterministic(transform)
+            recorder = HashRecorder(hashes_path(plan))
+        
+        # Convertir exactamente los archivos del plan: lectura anticipada,
+        # conversión en paralelo y escritura diferida
+        processed, changed, stats = execute_plan_pipelined(
+            plan,
+            transform,
+            on_result,
+            report=report,
+            write_output=recorder.write if recorder is not None else write_file,
+        )
+        if recorder is not None:
+            try:
+                self.log(f"Hashes de salida guardados: {self.format_log_path(recorder.close())}")
+            except OSError as e:
+                messagebox.showerror("Error", f"No se pudieron guardar los hashes de salida: {e}")
+        if atlas is not None:
+            try:
+                self.log(f"Atlas guardado: {self.format_log_path(atlas.close())}")
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo guardar el atlas: {e}")
+        for file_path in changed:
+            self.log(f"Omitido (modificado desde el plan): {self.format_log_path(file_path)}")
+        self.log(f"Uso de cada etapa: {stats.summary()}")
+        
+        # Los archivos terminan en cualquier orden; el log los lista ordenados
+        already_indexed.sort()
+        semitransparent_files.sort()
+        unknown_colors_details.sort()
+        if reproducible and self.save_log_var.get():
+            for err_msg in sorted(conversion_errors):
+                self.write_aggregated_log(err_msg)
         
         # Construir el bloque agrupado para el log
         aggregated_msg = ""
@@ -270,6 +373,16 @@ class ConvertToIndexApp(TkinterDnD.Tk):
                     color_str = str(color)
                 aggregated_msg += f"{color_str}: {count}\n"
             aggregated_msg += "\n"
+            aggregated_msg += "Color más cercano de la paleta para cada color desconocido (índice, color, ΔE OKLab):\n"
+            for color, (index, palette_color, delta_e) in sorted(nearest_colors.items()):
+                if self.color_format_var.get() == "hex":
+                    color_str = f"{color[0]:02X}{color[1]:02X}{color[2]:02X}"
+                    palette_color_str = f"{palette_color[0]:02X}{palette_color[1]:02X}{palette_color[2]:02X}"
+                else:
+                    color_str = str(color)
+                    palette_color_str = str(palette_color)
+                aggregated_msg += f"{color_str} -> {index} {palette_color_str} ΔE={delta_e:.4f}\n"
+            aggregated_msg += "\n"
         
         # En el resumen, "Total de colores desconocidos encontrados" es el número de colores únicos
         summary_msg = (
@@ -291,8 +404,26 @@ class ConvertToIndexApp(TkinterDnD.Tk):
             final_msg += "\nSe produjeron errores en algunos archivos. Revisa el log para más detalles."
         self.log(final_msg)
         final_msg += f"\n\nLog de errores: {self.error_log_filename}" if self.save_log_var.get() else ""
-        messagebox.showinfo("Conversión Completa", final_msg)
+        if not report.by_status(STATUS_FAILED):
+            messagebox.showinfo("Conversión Completa", final_msg)
+            return
+        
+        # Informe legible por máquina con los archivos fallidos, para reintentarlos todos a la vez
+        report_path = os.path.join(plan['params']['folder'], report.default_filename())
+        try:
+            report.save(report_path)
+            final_msg += f"\nInforme de resultados (JSON): {report_path}"
+        except OSError as e:
+            final_msg += f"\nNo se pudo guardar el informe de resultados: {e}"
+        final_msg += f"\n\n{len(report.failed_sources())} archivos fallaron. ¿Guardar un plan para reintentarlos?"
+        if messagebox.askyesno("Conversión Completa", final_msg):
+            plan_file = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Planes", "*.json")])
+            if plan_file:
+                save_plan(plan_retry(plan, report.failed_sources()), plan_file)
 
-if __name__ == "__main__":
+def main():
     app = ConvertToIndexApp()
     app.mainloop()
+
+if __name__ == "__main__":
+    main()
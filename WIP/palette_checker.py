@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 import os
+import sys
+
+# Los módulos compartidos con PaletteSwapper están en la carpeta 'source'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "source"))
+from launcher import handle_info_options, lazy_import
+
+if __name__ == "__main__":
+    # Answer --version / --help without loading Tk or Pillow
+    handle_info_options('palette_checker')
+
 import json
+import time
 import datetime
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image
+# Pillow is loaded by the first image operation, not at launch
+Image = lazy_import('PIL.Image')
+
+from results import BatchReport, FileResult, STATUS_FAILED, STATUS_SKIPPED
 
 CONFIG_FILE = "palettechecker_config.txt"
 
@@ -33,47 +47,47 @@ def save_config(config):
 def get_image_files(directory):
     """Return a list of PNG image file paths in the given directory."""
     supported_ext = ('.png', '.PNG')
-    return [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(supported_ext)]
+    # Sorted so the logs list the images in the same order on every system
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith(supported_ext)]
 
 def confirm_overwrite(filepath):
     """Ask the user if they want to overwrite an existing file."""
     return messagebox.askyesno("Overwrite File?", f"The file\n{filepath}\nalready exists. Overwrite?")
 
-def convert_image_to_rgb(image_path, output_dir, prefix, suffix):
-    """Convert the image to RGB mode if needed and save it in the output directory."""
-    try:
-        img = Image.open(image_path)
-    except Exception as e:
-        messagebox.showerror("Error", f"Error opening image {image_path}:\n{e}")
-        return
+def converted_path(image_path, output_dir, prefix, suffix):
+    """Return the path where convert_image_to_rgb saves the image."""
+    name, ext = os.path.splitext(os.path.basename(image_path))
+    return os.path.join(output_dir, f"{prefix}{name}{suffix}{ext}")
 
-    if img.mode == "P":
-        img = img.convert("RGB")
-    
-    base_name = os.path.basename(image_path)
-    name, ext = os.path.splitext(base_name)
-    output_filename = f"{prefix}{name}{suffix}{ext}"
-    output_path = os.path.join(output_dir, output_filename)
-    
-    if os.path.exists(output_path):
-        if not confirm_overwrite(output_path):
-            return
+def convert_image_to_rgb(image_path, output_dir, prefix, suffix, overwrite=True):
+    """
+    Convert the image to RGB mode if needed and save it in the output directory.
+    Existing outputs are skipped unless 'overwrite', so a batch never stops to ask.
+    Returns a FileResult; errors are recorded in it instead of being shown.
+    """
+    output_path = converted_path(image_path, output_dir, prefix, suffix)
+    start = time.perf_counter()
+
+    if not overwrite and os.path.exists(output_path):
+        return FileResult(image_path, output_path, STATUS_SKIPPED, error="output already exists, not overwritten")
 
     try:
-        img.save(output_path)
+        with Image.open(image_path) as img:
+            if img.mode == "P":
+                img = img.convert("RGB")
+            img.save(output_path)
     except Exception as e:
-        messagebox.showerror("Error", f"Error saving image {output_path}:\n{e}")
+        return FileResult.failure(image_path, output_path, e, time.perf_counter() - start)
+    return FileResult(image_path, output_path, seconds=time.perf_counter() - start,
+                      bytes_read=os.path.getsize(image_path), bytes_written=os.path.getsize(output_path))
 
 def extract_colors(image_path):
     """
     Return a set of colors from the image (works for RGB or RGBA images).
     Discards any pixel that is fully transparent (alpha == 0).
+    Errors are raised to the caller.
     """
-    try:
-        img = Image.open(image_path)
-    except Exception as e:
-        messagebox.showerror("Error", f"Error opening image {image_path}:\n{e}")
-        return set()
+    img = Image.open(image_path)
 
     if img.mode == "P":
         img = img.convert("RGBA")
@@ -158,12 +172,14 @@ def export_palette_gif(palette_img, output_dir, add_datetime_suffix):
     except Exception as e:
         messagebox.showerror("Error", f"Error saving palette GIF:\n{e}")
 
-def generate_log(common_colors, image_colors, output_dir):
+def generate_log(common_colors, image_colors, output_dir, add_datetime_suffix=True):
     """
-    Generate a log file with:
+    Generate a log file (palette_log.txt, with the date and time in its name
+    if add_datetime_suffix) with:
       - Common Colors (present in all images)
       - Unique Colors by Image (colors appearing only in one image)
       - Almost Common Colors (colors that appear in more than one image, with count and listing of images)
+    Returns the path of the log, or None if it could not be written.
     """
     color_frequency = {}
     color_images = {}
@@ -183,8 +199,10 @@ def generate_log(common_colors, image_colors, output_dir):
         if color_frequency[color] > 1 and color_frequency[color] < num_images
     }
     
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_filename = f"palette_log_{timestamp}.txt"
+    log_filename = "palette_log.txt"
+    if add_datetime_suffix:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_filename = f"palette_log_{timestamp}.txt"
     log_path = os.path.join(output_dir, log_filename)
     
     try:
@@ -201,14 +219,16 @@ def generate_log(common_colors, image_colors, output_dir):
                         log_file.write(f"{color}\n")
             
             log_file.write("\nAlmost Common Colors:\n")
-            for color, (freq, _) in almost_common.items():
+            for color, (freq, _) in sorted(almost_common.items()):
                 log_file.write(f"{color}: appears in {freq} images\n")
             
             log_file.write("\nAlmost Common Colors Summary:\n")
-            for color, (freq, images) in almost_common.items():
+            for color, (freq, images) in sorted(almost_common.items()):
                 log_file.write(f"{color}: appears in {freq} images ({', '.join(images)})\n")
     except Exception as e:
         messagebox.showerror("Error", f"Error writing log file:\n{e}")
+        return None
+    return log_path
 
 # --- Main Application Class ---
 
@@ -361,9 +381,16 @@ class PaletteCheckerApp(tk.Tk):
             messagebox.showinfo("Info", "No PNG images found in the input directory.")
             return
         
+        # Asked once for the whole batch; declined files are recorded as skipped
+        existing = [path for path in image_files if os.path.exists(converted_path(path, output_dir, prefix, suffix))]
+        overwrite = not existing or messagebox.askyesno(
+            "Overwrite Files?", f"{len(existing)} of the {len(image_files)} output files already exist. Overwrite them?")
+
+        report = BatchReport('palette_checker_convert')
         for image_path in image_files:
-            convert_image_to_rgb(image_path, output_dir, prefix, suffix)
-        messagebox.showinfo("Success", "Conversion complete.")
+            report.add(convert_image_to_rgb(image_path, output_dir, prefix, suffix, overwrite))
+        report.finish()
+        self.show_report("Conversion complete.", report, output_dir)
     
     def handle_check_colors(self):
         input_dir = self.input_dir_entry.get().strip()
@@ -389,10 +416,20 @@ class PaletteCheckerApp(tk.Tk):
             return
         
         image_colors = {}
+        report = BatchReport('palette_checker_check')
         for image_path in image_files:
-            colors = extract_colors(image_path)
+            start = time.perf_counter()
+            try:
+                colors = extract_colors(image_path)
+            except Exception as e:
+                # Unreadable images are left out of the color analysis
+                report.add(FileResult.failure(image_path, None, e, time.perf_counter() - start))
+                continue
+            report.add(FileResult(image_path, seconds=time.perf_counter() - start,
+                                  bytes_read=os.path.getsize(image_path)))
             image_name = os.path.basename(image_path)
             image_colors[image_name] = colors
+        report.finish()
         
         common_colors = set.intersection(*image_colors.values()) if image_colors else set()
         
@@ -412,7 +449,7 @@ class PaletteCheckerApp(tk.Tk):
         if self.include_unique_var.get():
             palette_rows.append(sorted(unique_set))
         
-        generate_log(common_colors, image_colors, output_dir)
+        log_path = generate_log(common_colors, image_colors, output_dir, self.datetime_suffix_var.get())
         
         palette_img = None
         if self.export_png_var.get() or self.export_gif_var.get():
@@ -421,17 +458,31 @@ class PaletteCheckerApp(tk.Tk):
         if palette_img and self.export_gif_var.get():
             export_palette_gif(palette_img, output_dir, self.datetime_suffix_var.get())
         
-        log_files = sorted([f for f in os.listdir(output_dir) if f.startswith("palette_log_") and f.endswith(".txt")])
-        if log_files and self.display_log_var.get():
-            latest_log = os.path.join(output_dir, log_files[-1])
+        if log_path and self.display_log_var.get():
             try:
-                with open(latest_log, "r") as log_file:
+                with open(log_path, "r") as log_file:
                     log_content = log_file.read()
                 self.show_log_window(log_content)
             except Exception as e:
                 messagebox.showerror("Error", f"Error reading log file:\n{e}")
         
-        messagebox.showinfo("Success", "Color check complete.")
+        self.show_report("Color check complete.", report, output_dir)
+    
+    def show_report(self, message, report, output_dir):
+        """Show a single summary at the end of a batch, saving the full report if some files failed."""
+        skipped = report.by_status(STATUS_SKIPPED)
+        if skipped:
+            message += f"\n{len(skipped)} existing files were not overwritten."
+        if not report.by_status(STATUS_FAILED):
+            messagebox.showinfo("Success", message)
+            return
+        report_path = os.path.join(output_dir, report.default_filename())
+        try:
+            report.save(report_path)
+            saved = f"Full report: {report_path}"
+        except OSError as e:
+            saved = f"The report could not be saved: {e}"
+        messagebox.showwarning("Finished with errors", f"{message}\n\n{report.summary(max_errors=10)}\n\n{saved}")
     
     def show_log_window(self, log_content):
         """Open a separate window to display the log."""
@@ -465,6 +516,9 @@ class PaletteCheckerApp(tk.Tk):
 
 # --- Main Execution ---
 
-if __name__ == "__main__":
+def main():
     app = PaletteCheckerApp()
     app.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,61 @@
 import os
+import sys
+
+# Los módulos compartidos con PaletteSwapper están en la carpeta 'source'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "source"))
+from launcher import handle_info_options, lazy_import
+
+if __name__ == "__main__":
+    # Responder a --version / --help sin cargar Tk ni Pillow
+    handle_info_options('semitransparency_checker')
+
+import time
 import datetime
 from tkinter import filedialog, messagebox, BooleanVar, Checkbutton
 import tkinter as tk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image
+# Pillow se carga al procesar la primera imagen, no al arrancar
+Image = lazy_import('PIL.Image')
+
+from results import BatchReport, FileResult, STATUS_FAILED
 
 def tiene_semitransparencia(ruta):
     """
     Abre la imagen en 'ruta', la convierte a RGBA y revisa
     si el canal alfa contiene algún valor distinto de 0 y 255.
     Retorna True si se encuentra semitransparencia, False en caso contrario.
+    Los errores al abrir la imagen se propagan al llamador.
     """
-    try:
-        img = Image.open(ruta).convert("RGBA")
-        alpha = img.split()[-1]  # Obtiene el canal alfa
-        # Itera por cada valor alfa; si alguno no es 0 ni 255, hay semitransparencia
-        for a in alpha.getdata():
-            if a not in (0, 255):
-                return True
-        return False
-    except Exception as e:
-        print(f"Error comprobando {ruta}: {e}")
-        return False
+    img = Image.open(ruta).convert("RGBA")
+    alpha = img.split()[-1]  # Obtiene el canal alfa
+    # Itera por cada valor alfa; si alguno no es 0 ni 255, hay semitransparencia
+    for a in alpha.getdata():
+        if a not in (0, 255):
+            return True
+    return False
 
-def procesar_archivo(ruta):
+def procesar_archivo(ruta, informe=None):
     """
-    Procesa un único archivo de imagen.
+    Procesa un único archivo de imagen y, si se indica, añade su resultado
+    al informe (BatchReport).
     Retorna una tupla: (total_imagenes, con_semitransparencia, sin_semitransparencia, errores)
     """
     if not ruta.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
         return 0, 0, 0, 0
+    inicio = time.perf_counter()
     try:
-        total = 1
-        if tiene_semitransparencia(ruta):
-            return total, 1, 0, 0
-        else:
-            return total, 0, 1, 0
+        semitransparente = tiene_semitransparencia(ruta)
     except Exception as e:
-        print(f"Error procesando {ruta}: {e}")
+        if informe is not None:
+            informe.add(FileResult.failure(ruta, None, e, time.perf_counter() - inicio))
         return 1, 0, 0, 1
+    if informe is not None:
+        informe.add(FileResult(ruta, seconds=time.perf_counter() - inicio, bytes_read=os.path.getsize(ruta)))
+    if semitransparente:
+        return 1, 1, 0, 0
+    return 1, 0, 1, 0
 
-def procesar_carpeta(carpeta, recursive=True):
+def procesar_carpeta(carpeta, recursive=True, informe=None):
     """
     Recorre la carpeta (y opcionalmente sus subdirectorios) y procesa
     cada imagen encontrada. Retorna:
@@ -56,7 +71,7 @@ def procesar_carpeta(carpeta, recursive=True):
             for file in files:
                 ruta = os.path.join(root_dir, file)
                 if ruta.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                    t, s, ns, err = procesar_archivo(ruta)
+                    t, s, ns, err = procesar_archivo(ruta, informe)
                     total += t
                     semitransparent += s
                     non_semitransparent += ns
@@ -67,7 +82,7 @@ def procesar_carpeta(carpeta, recursive=True):
         for file in os.listdir(carpeta):
             ruta = os.path.join(carpeta, file)
             if os.path.isfile(ruta) and ruta.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                t, s, ns, err = procesar_archivo(ruta)
+                t, s, ns, err = procesar_archivo(ruta, informe)
                 total += t
                 semitransparent += s
                 non_semitransparent += ns
@@ -76,16 +91,16 @@ def procesar_carpeta(carpeta, recursive=True):
                     semitransparent_files.append(os.path.abspath(ruta))
     return total, semitransparent, non_semitransparent, errores, semitransparent_files
 
-def procesar_archivo_o_carpeta(ruta, recursive=True):
+def procesar_archivo_o_carpeta(ruta, recursive=True, informe=None):
     """
     Determina si 'ruta' es un archivo o una carpeta y la procesa
     en consecuencia.
     """
     if os.path.isdir(ruta):
-        return procesar_carpeta(ruta, recursive)
+        return procesar_carpeta(ruta, recursive, informe)
     else:
         if ruta.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-            t, s, ns, err = procesar_archivo(ruta)
+            t, s, ns, err = procesar_archivo(ruta, informe)
             st_files = [os.path.abspath(ruta)] if s == 1 else []
             return t, s, ns, err, st_files
     return 0, 0, 0, 0, []
@@ -105,6 +120,18 @@ def generar_log(semitransparent_files):
         return filename
     return None
 
+def resumen_errores(informe):
+    """Texto con el resumen de errores del lote; guarda el informe completo en JSON."""
+    if not informe.by_status(STATUS_FAILED):
+        return ""
+    texto = f"\n{informe.summary(max_errors=10)}\n"
+    try:
+        informe.save(informe.default_filename())
+        texto += f"Informe completo: {informe.default_filename()}\n"
+    except OSError as e:
+        texto += f"No se pudo guardar el informe: {e}\n"
+    return texto
+
 def drop(event):
     """
     Función invocada al arrastrar y soltar archivos o carpetas.
@@ -117,22 +144,26 @@ def drop(event):
     errors_global = 0
     global semitransparent_files_global
     semitransparent_files_global = []
+    informe = BatchReport('semitransparency')
     for f in files:
         ruta = f.strip()
         if os.path.exists(ruta):
-            t, s, ns, err, st_files = procesar_archivo_o_carpeta(ruta, recursive=recursive_var.get())
+            t, s, ns, err, st_files = procesar_archivo_o_carpeta(ruta, recursive=recursive_var.get(), informe=informe)
             total_global += t
             semitransparent_global += s
             non_semitransparent_global += ns
             errors_global += err
             semitransparent_files_global.extend(st_files)
         else:
-            print(f"La ruta no existe: {ruta}")
+            informe.add(FileResult.failure(ruta, None, FileNotFoundError(f"La ruta no existe: {ruta}")))
+            errors_global += 1
+    informe.finish()
     mensaje = f"Total imágenes procesadas: {total_global}\n"
     mensaje += f"Imágenes con semitransparencia: {semitransparent_global}\n"
     mensaje += f"Imágenes sin semitransparencia: {non_semitransparent_global}\n"
     if errors_global:
         mensaje += f"Errores: {errors_global}\n"
+        mensaje += resumen_errores(informe)
     if semitransparent_global > 0:
         log_filename = generar_log(semitransparent_files_global)
         mensaje += f"\nSe ha generado un log: {log_filename}"
@@ -144,7 +175,9 @@ def seleccionar_carpeta():
     """
     carpeta = filedialog.askdirectory(title="Selecciona la carpeta con imágenes")
     if carpeta:
-        t, s, ns, err, st_files = procesar_carpeta(carpeta, recursive=recursive_var.get())
+        informe = BatchReport('semitransparency')
+        t, s, ns, err, st_files = procesar_carpeta(carpeta, recursive=recursive_var.get(), informe=informe)
+        informe.finish()
         global semitransparent_files_global
         semitransparent_files_global = st_files
         mensaje = f"Total imágenes procesadas: {t}\n"
@@ -152,40 +185,46 @@ def seleccionar_carpeta():
         mensaje += f"Imágenes sin semitransparencia: {ns}\n"
         if err:
             mensaje += f"Errores: {err}\n"
+            mensaje += resumen_errores(informe)
         if s > 0:
             log_filename = generar_log(semitransparent_files_global)
             mensaje += f"\nSe ha generado un log: {log_filename}"
         messagebox.showinfo("Resultado", mensaje)
 
-# Configuración de la ventana principal con TkinterDnD2
-root = TkinterDnD.Tk()
-root.title("Chequeador de Semitransparencia")
-root.geometry("500x350")
-
-# Variable para la opción recursiva (marcada por defecto)
-recursive_var = BooleanVar(value=True)
-
-# Etiqueta con instrucciones y fondo destacado (color verde claro)
-instrucciones = (
-    "Arrastra y suelta aquí archivos o carpetas con imágenes\n"
-    "para comprobar si tienen semitransparencia (canal alfa con valores distintos de 0 y 255).\n\n"
-    "O haz clic en 'Seleccionar carpeta' para elegir manualmente.\n\n"
-    "La opción 'Procesar recursivamente subdirectorios' está marcada por defecto."
-)
-label = tk.Label(root, text=instrucciones, wraplength=480, justify="center", 
-                 bg="lightgreen", relief="raised", bd=2)
-label.pack(pady=10, padx=10, fill="both", expand=True)
-
-# Registrar la etiqueta como destino de drop
-label.drop_target_register(DND_FILES)
-label.dnd_bind('<<Drop>>', drop)
-
-# Checkbutton para activar o desactivar la búsqueda recursiva
-chk_recursive = Checkbutton(root, text="Procesar recursivamente subdirectorios", variable=recursive_var)
-chk_recursive.pack(pady=5)
-
-# Botón para seleccionar carpeta manualmente
-boton = tk.Button(root, text="Seleccionar carpeta", command=seleccionar_carpeta)
-boton.pack(pady=10)
-
-root.mainloop()
+def main():
+    global root, recursive_var
+    # Configuración de la ventana principal con TkinterDnD2
+    root = TkinterDnD.Tk()
+    root.title("Chequeador de Semitransparencia")
+    root.geometry("500x350")
+
+    # Variable para la opción recursiva (marcada por defecto)
+    recursive_var = BooleanVar(value=True)
+
+    # Etiqueta con instrucciones y fondo destacado (color verde claro)
+    instrucciones = (
+        "Arrastra y suelta aquí archivos o carpetas con imágenes\n"
+        "para comprobar si tienen semitransparencia (canal alfa con valores distintos de 0 y 255).\n\n"
+        "O haz clic en 'Seleccionar carpeta' para elegir manualmente.\n\n"
+        "La opción 'Procesar recursivamente subdirectorios' está marcada por defecto."
+    )
+    label = tk.Label(root, text=instrucciones, wraplength=480, justify="center", 
+                     bg="lightgreen", relief="raised", bd=2)
+    label.pack(pady=10, padx=10, fill="both", expand=True)
+
+    # Registrar la etiqueta como destino de drop
+    label.drop_target_register(DND_FILES)
+    label.dnd_bind('<<Drop>>', drop)
+
+    # Checkbutton para activar o desactivar la búsqueda recursiva
+    chk_recursive = Checkbutton(root, text="Procesar recursivamente subdirectorios", variable=recursive_var)
+    chk_recursive.pack(pady=5)
+
+    # Botón para seleccionar carpeta manualmente
+    boton = tk.Button(root, text="Seleccionar carpeta", command=seleccionar_carpeta)
+    boton.pack(pady=10)
+
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import json
+from launcher import lazy_import
+Image = lazy_import('PIL.Image')
+
+# Atlas output: instead of writing one tiny PNG per sprite, the outputs of a
+# batch are packed into a few large sheets plus a JSON manifest describing
+# each sprite's rectangle. This avoids most of the per-file open/close and
+# filesystem metadata cost. Sprites are placed with a streaming shelf packer,
+# so only the sprites of the sheet being filled are kept in memory.
+
+DEFAULT_SHEET_SIZE = 2048
+
+def check_fits(image, sheet_size=DEFAULT_SHEET_SIZE):
+    """
+    Raise ValueError if 'image' is larger than a sheet. Call it in the
+    transform of a batch, so an oversize sprite is a per-file failure
+    instead of an error while the results are collected.
+    """
+    if image is not None and (image.width > sheet_size or image.height > sheet_size):
+        raise ValueError(f"A {image.width}x{image.height} sprite does not fit in a {sheet_size}x{sheet_size} atlas sheet.")
+    return image
+
+class ShelfPacker:
+    """Places rectangles left to right on shelves, opening a new shelf when a row is full."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.x = 0
+        self.shelf_y = 0
+        self.shelf_height = 0
+
+    def place(self, width, height):
+        """Return the (x, y) position for a width x height rectangle, or None if the sheet is full."""
+        if width > self.width or height > self.height:
+            raise ValueError(f"A {width}x{height} sprite does not fit in a {self.width}x{self.height} sheet.")
+        if self.x + width > self.width:
+            self.shelf_y += self.shelf_height
+            self.x = 0
+            self.shelf_height = 0
+        if self.shelf_y + height > self.height:
+            return None
+        position = (self.x, self.shelf_y)
+        self.x += width
+        self.shelf_height = max(self.shelf_height, height)
+        return position
+
+    def used_height(self):
+        return self.shelf_y + self.shelf_height
+
+class AtlasWriter:
+    """
+    Collects sprites and writes them as atlas sheets in 'output_directory'.
+    A sheet stays indexed when all of its sprites share one palette and
+    transparency index; otherwise it is written as RGBA.
+    """
+
+    def __init__(self, output_directory, name="atlas", sheet_size=DEFAULT_SHEET_SIZE):
+        self.output_directory = output_directory
+        self.name = name
+        self.sheet_size = sheet_size
+        self.sheets = []
+        self.sprites = {}
+        self._start_sheet()
+
+    def _start_sheet(self):
+        self.packer = ShelfPacker(self.sheet_size, self.sheet_size)
+        self.pending = []
+
+    def sheet_filename(self, number):
+        return f"{self.name}_{number}.png"
+
+    def sprite_name(self, output_path):
+        """Manifest key of a sprite: its planned output path relative to the atlas directory."""
+        return os.path.relpath(output_path, self.output_directory).replace(os.sep, '/')
+
+    def add(self, sprite_name, image):
+        position = self.packer.place(image.width, image.height)
+        if position is None:
+            self._flush()
+            position = self.packer.place(image.width, image.height)
+        self.pending.append((sprite_name, image, position))
+
+    def _flush(self):
+        if not self.pending:
+            return
+        number = len(self.sheets)
+        width = max(x + image.width for _, image, (x, y) in self.pending)
+        height = self.packer.used_height()
+        first = self.pending[0][1]
+        indexed = all(
+            image.mode == 'P' and image.getpalette() == first.getpalette()
+            and image.info.get('transparency') == first.info.get('transparency')
+            for _, image, _ in self.pending
+        ) and isinstance(first.info.get('transparency', 0), int)
+
+        if indexed:
+            transparency = first.info.get('transparency')
+            sheet = Image.new('P', (width, height), transparency or 0)
+            sheet.putpalette(first.getpalette())
+        else:
+            sheet = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for sprite_name, image, (x, y) in self.pending:
+            sheet.paste(image if indexed else image.convert('RGBA'), (x, y))
+            self.sprites[sprite_name] = {'sheet': number, 'x': x, 'y': y, 'w': image.width, 'h': image.height}
+
+        filename = self.sheet_filename(number)
+        if indexed and transparency is not None:
+            sheet.save(os.path.join(self.output_directory, filename), transparency=transparency)
+        else:
+            sheet.save(os.path.join(self.output_directory, filename))
+        self.sheets.append({'file': filename, 'width': width, 'height': height})
+        self._start_sheet()
+
+    def close(self):
+        """Write the last sheet and the manifest; returns the manifest path."""
+        self._flush()
+        manifest_path = os.path.join(self.output_directory, f"{self.name}.json")
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({'sheets': self.sheets, 'sprites': self.sprites}, f, indent=1)
+        return manifest_path
@@ -0,0 +1,66 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from PIL import Image
+
+from swap_engine import swap_palette_bytes, swap_palette_image
+from atlas import AtlasWriter
+
+# Compares per-file output with atlas output for a batch of small sprites.
+# Generates N random indexed 32x32 sprites in a temporary directory, swaps
+# their palette with both modes and prints the wall time of each.
+#
+# Usage: python atlas_benchmark.py [--count 5000] [--size 32]
+
+def make_sprites(directory, count, size):
+    rng = random.Random(0)
+    palette = [rng.randrange(256) for _ in range(768)]
+    paths = []
+    for number in range(count):
+        sprite = Image.frombytes('P', (size, size), bytes(rng.randrange(16) for _ in range(size * size)))
+        sprite.putpalette(palette)
+        path = os.path.join(directory, f"sprite_{number:05d}.png")
+        sprite.save(path, transparency=0)
+        paths.append(path)
+    return paths
+
+def per_file(paths, output_directory, palette):
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        output = swap_palette_bytes(data, palette)
+        with open(os.path.join(output_directory, os.path.basename(path)), 'wb') as f:
+            f.write(output)
+
+def atlas(paths, output_directory, palette):
+    writer = AtlasWriter(output_directory)
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        writer.add(os.path.basename(path), swap_palette_image(data, palette))
+    writer.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time per-file output against atlas output.")
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=32)
+    args = parser.parse_args(argv)
+    palette = list(range(256)) * 3
+    with tempfile.TemporaryDirectory() as directory:
+        sources = os.path.join(directory, 'sources')
+        os.mkdir(sources)
+        paths = make_sprites(sources, args.count, args.size)
+        for name, run in (('per-file', per_file), ('atlas', atlas)):
+            output_directory = os.path.join(directory, name)
+            os.mkdir(output_directory)
+            start = time.perf_counter()
+            run(paths, output_directory, palette)
+            seconds = time.perf_counter() - start
+            files = len(os.listdir(output_directory))
+            print(f"{name:>8}: {seconds:.2f} s, {args.count / seconds:.0f} sprites/s, {files} files written")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import io
+import os
+import sys
+import argparse
+
+from PIL import Image
+
+from batch_plan import IMAGE_EXTENSIONS
+from pipeline import run_pipeline
+from conformance import PaletteConformance, load_palettes, DEFAULT_MAX_MISSING
+
+# Combined asset audit. semitransparency_checker, palette_checker and the
+# unknown-colour analysis of convert_to_index each decode every image again;
+# here every file is decoded once and all three results come from the same
+# RGBA image: the alpha histogram classifies transparency, and the list of
+# unique colours gives both the colour census and the palettes the image fits
+# (see conformance.py). Nothing is done per pixel in Python.
+#
+# Usage: python audit.py IMAGE_DIR [--palette PALETTE_OR_DIR ...] [--max-missing N]
+#                        [--output REPORT.txt] [--no-recursive]
+
+ALPHA_OPAQUE = "opaque"
+ALPHA_BINARY = "binary"
+ALPHA_SEMITRANSPARENT = "semitransparent"
+
+def audit_image(image, conformance, max_missing=DEFAULT_MAX_MISSING):
+    """
+    Audit one image against the palettes of a PaletteConformance.
+    Returns a dict with 'alpha' (ALPHA_OPAQUE, ALPHA_BINARY or
+    ALPHA_SEMITRANSPARENT), 'colors' (set of the visible (r, g, b, a) colours),
+    'fits' (names of the palettes holding every opaque colour) and
+    'near_misses' ({palette name: sorted opaque colours missing from it}).
+    """
+    rgba = image.convert('RGBA')
+    histogram = rgba.getchannel('A').histogram()
+    if any(histogram[1:255]):
+        alpha = ALPHA_SEMITRANSPARENT
+    elif histogram[0]:
+        alpha = ALPHA_BINARY
+    else:
+        alpha = ALPHA_OPAQUE
+
+    colors = {color for _, color in rgba.getcolors(rgba.width * rgba.height) if color[3] > 0}
+    fits, near_misses = conformance.classify({color[:3] for color in colors if color[3] == 255}, max_missing)
+    return {
+        'alpha': alpha,
+        'colors': colors,
+        'fits': fits,
+        'near_misses': near_misses,
+    }
+
+def audit_bytes(data, conformance, max_missing=DEFAULT_MAX_MISSING):
+    """Pipeline variant of audit_image taking the bytes of an image file."""
+    with Image.open(io.BytesIO(data)) as image:
+        return audit_image(image, conformance, max_missing)
+
+def list_image_files(directory, recursive=True):
+    """Return the sorted paths of the images in 'directory'."""
+    if recursive:
+        paths = [os.path.join(root, name) for root, _, files in os.walk(directory) for name in files]
+    else:
+        paths = [entry.path for entry in os.scandir(directory) if entry.is_file()]
+    return sorted(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+
+def audit_directory(directory, palette_paths=(), recursive=True, max_missing=DEFAULT_MAX_MISSING,
+                    on_result=None, **pipeline_options):
+    """
+    Audit every image of 'directory' against the palettes in 'palette_paths'
+    (files, or directories of palettes). Returns (results, errors,
+    palette_names): results maps each path to its audit_image dict and errors
+    maps the paths that could not be read to the error. on_result(path,
+    result, error) is called as each file finishes.
+    """
+    conformance = PaletteConformance(load_palettes(palette_paths))
+    results = {}
+    errors = {}
+
+    def collect(source, output, info, error):
+        if error is not None:
+            errors[source] = error
+        else:
+            results[source] = info
+        if on_result:
+            on_result(source, info, error)
+
+    paths = list_image_files(directory, recursive)
+    run_pipeline([(path, None) for path in paths], lambda data, source: (None, audit_bytes(data, conformance, max_missing)),
+                 collect, **pipeline_options)
+    return results, errors, conformance.names
+
+def color_census(image_colors):
+    """
+    Classify the colours of several images as palette_checker does.
+    image_colors maps image names to colour sets. Returns (common, almost,
+    unique): the colours present in every image, {colour: [images]} for the
+    colours in more than one image but not all, and {image: colours} for the
+    colours present in only that image.
+    """
+    color_images = {}
+    for image_name, colors in image_colors.items():
+        for color in colors:
+            color_images.setdefault(color, []).append(image_name)
+    num_images = len(image_colors)
+    common = {color for color, images in color_images.items() if len(images) == num_images}
+    almost = {color: images for color, images in color_images.items() if 1 < len(images) < num_images}
+    unique = {image: set() for image in image_colors}
+    for color, images in color_images.items():
+        if len(images) == 1:
+            unique[images[0]].add(color)
+    return common, almost, unique
+
+def format_audit_report(results, errors, palette_names, base_directory=None):
+    """Build the combined text report of an audit."""
+    def name(path):
+        return os.path.relpath(path, base_directory) if base_directory else path
+
+    paths = sorted(results)
+    lines = [f"Images audited: {len(paths)}"]
+    if errors:
+        lines.append(f"Errors: {len(errors)}")
+    for alpha in (ALPHA_OPAQUE, ALPHA_BINARY, ALPHA_SEMITRANSPARENT):
+        lines.append(f"{alpha.capitalize()}: {sum(results[path]['alpha'] == alpha for path in paths)}")
+
+    semitransparent = [name(path) for path in paths if results[path]['alpha'] == ALPHA_SEMITRANSPARENT]
+    if semitransparent:
+        lines.append("\nImages with semitransparent pixels:")
+        lines.extend(semitransparent)
+
+    if palette_names:
+        lines.append("\nPalette conformance:")
+        for palette_name in palette_names:
+            conforming = sum(palette_name in results[path]['fits'] for path in paths)
+            lines.append(f"{palette_name}: {conforming} of {len(paths)} images conform")
+        lines.append("\nFitting palettes and near misses by image:")
+        for path in paths:
+            result = results[path]
+            lines.append(f"{name(path)} | fits: {', '.join(result['fits']) or 'none'}")
+            for palette_name, colors in result['near_misses'].items():
+                lines.append(f"    {palette_name} | {len(colors)} missing colors | {colors}")
+
+    common, almost, unique = color_census({name(path): results[path]['colors'] for path in paths})
+    lines.append(f"\nColor census: {len(common)} common, {len(almost)} almost common, "
+                 f"{sum(len(colors) for colors in unique.values())} unique")
+    lines.append("\nCommon Colors:")
+    lines.extend(str(color) for color in sorted(common))
+    lines.append("\nUnique Colors by Image:")
+    for image_name, colors in unique.items():
+        if colors:
+            lines.append(f"\nImage: {image_name}")
+            lines.extend(str(color) for color in sorted(colors))
+    lines.append("\nAlmost Common Colors:")
+    for color, images in sorted(almost.items()):
+        lines.append(f"{color}: appears in {len(images)} images ({', '.join(images)})")
+
+    if errors:
+        lines.append("\nErrors:")
+        lines.extend(f"{name(path)}: {error}" for path, error in sorted(errors.items()))
+    return "\n".join(lines) + "\n"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check transparency, colours and palette conformance in one pass.")
+    parser.add_argument('directory', help="directory with the images to audit")
+    parser.add_argument('--palette', action='append', default=[],
+                        help="palette, or directory of palettes, to check against (repeatable)")
+    parser.add_argument('--max-missing', type=int, default=DEFAULT_MAX_MISSING,
+                        help="report palettes missing up to this many colours of an image as near misses")
+    parser.add_argument('--output', help="write the report to this file instead of the console")
+    parser.add_argument('--no-recursive', action='store_true', help="do not audit subdirectories")
+    args = parser.parse_args(argv)
+
+    results, errors, palette_names = audit_directory(args.directory, args.palette, not args.no_recursive, args.max_missing)
+    report = format_audit_report(results, errors, palette_names, args.directory)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report, end="")
+    # A non-zero exit status lets scheduled validation jobs flag failures
+    failed = errors or any(
+        result['alpha'] == ALPHA_SEMITRANSPARENT or (palette_names and not result['fits'])
+        for result in results.values()
+    )
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
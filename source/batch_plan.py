@@ -0,0 +1,320 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from png_header import load_directory_index
+from swap_engine import output_filename, list_png_files
+from pipeline import run_pipeline
+from results import FileResult, STATUS_OK, STATUS_SKIPPED
+
+# Dry-run planning shared by the batch tools (palette swapper, convert_to_index
+# and color_inverter). A plan lists every file a run will read and write,
+# which outputs already exist, and an estimated runtime. Plans are plain JSON
+# so they can be saved, reviewed and executed later exactly as planned.
+
+PLAN_VERSION = 1
+THROUGHPUT_FILE = "batch_throughput.txt"
+# Used until a tool has recorded its own throughput (bytes read + written per second)
+DEFAULT_BYTES_PER_SECOND = 8 * 1024 * 1024
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+# --- Throughput Records ---
+
+def load_throughput():
+    """Load the recorded throughput per tool from THROUGHPUT_FILE if it exists."""
+    if os.path.exists(THROUGHPUT_FILE):
+        try:
+            with open(THROUGHPUT_FILE, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    return {}
+
+def record_throughput(tool, bytes_processed, seconds):
+    """Store the throughput measured for 'tool' so later plans can use it."""
+    if bytes_processed <= 0 or seconds <= 0:
+        return
+    records = load_throughput()
+    records[tool] = bytes_processed / seconds
+    try:
+        with open(THROUGHPUT_FILE, "w") as f:
+            json.dump(records, f)
+    except Exception as e:
+        print("Error saving throughput:", e)
+
+def estimate_seconds(tool, total_bytes):
+    """Estimate how long 'tool' needs to read and write 'total_bytes'."""
+    rate = load_throughput().get(tool, DEFAULT_BYTES_PER_SECOND)
+    return total_bytes / rate
+
+# --- Planning ---
+
+def _entry(source, output):
+    st = os.stat(source)
+    return {
+        'source': source,
+        'output': output,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'overwrite': os.path.exists(output),
+    }
+
+def _finish_plan(tool, params, entries, skipped):
+    bytes_read = sum(entry['size'] for entry in entries)
+    # Outputs are about as large as their sources for all of these tools
+    bytes_written = bytes_read
+    return {
+        'version': PLAN_VERSION,
+        'tool': tool,
+        'params': params,
+        'entries': entries,
+        'skipped': skipped,
+        'bytes_read': bytes_read,
+        'bytes_written': bytes_written,
+        'estimated_seconds': estimate_seconds(tool, bytes_read + bytes_written),
+    }
+
+def plan_swap(directory, palette_path, prefix, suffix, output_directory, remap=False, atlas=False, dedup=None,
+              deterministic=False):
+    """
+    Plan a palette swap of the indexed PNG files in 'directory'. With 'remap'
+    the pixel indices are translated to the new palette instead of
+    recolouring the palette entries in place. With 'atlas' the outputs are
+    packed into atlas sheets named after their planned output files. 'dedup'
+    is the dedup mode for identical outputs, or None to write them all. With
+    'deterministic' the outputs are byte-stable and their hashes recorded.
+    """
+    entries = []
+    skipped = []
+    indexed = set(load_directory_index(directory).query(mode='P'))
+    for filename in list_png_files(directory):
+        image_path = os.path.join(directory, filename)
+        if filename not in indexed:
+            skipped.append({'source': image_path, 'reason': 'not indexed'})
+            continue
+        output_path = os.path.join(output_directory, output_filename(filename, prefix, suffix))
+        entries.append(_entry(image_path, output_path))
+    params = {
+        'directory': directory,
+        'palette': palette_path,
+        'prefix': prefix,
+        'suffix': suffix,
+        'output_directory': output_directory,
+        'remap': remap,
+        'atlas': atlas,
+        'dedup': dedup,
+        'deterministic': deterministic,
+    }
+    return _finish_plan('swap', params, entries, skipped)
+
+def plan_convert_to_index(folder, palette_path, prefix, suffix, dither="floyd-steinberg",
+                          reserve_transparency=False, atlas=False, deterministic=False):
+    """Plan an indexed conversion of every image below 'folder'."""
+    entries = []
+    skipped = []
+    for root, dirs, files in os.walk(folder):
+        indexed = set(load_directory_index(root).query(mode='P'))
+        for file in files:
+            if not file.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            file_path = os.path.join(root, file)
+            if file in indexed:
+                skipped.append({'source': file_path, 'reason': 'already indexed'})
+                continue
+            name, _ = os.path.splitext(file)
+            entries.append(_entry(file_path, os.path.join(root, f"{prefix}{name}{suffix}.png")))
+    params = {
+        'folder': folder,
+        'palette': palette_path,
+        'prefix': prefix,
+        'suffix': suffix,
+        'dither': dither,
+        'reserve_transparency': reserve_transparency,
+        'atlas': atlas,
+        'deterministic': deterministic,
+    }
+    return _finish_plan('convert_to_index', params, entries, skipped)
+
+def plan_invert(paths):
+    """Plan an in-place colour inversion of the given files and folders."""
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for file in files:
+                    if file.lower().endswith(IMAGE_EXTENSIONS):
+                        file_path = os.path.join(root, file)
+                        entries.append(_entry(file_path, file_path))
+        elif os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+            entries.append(_entry(path, path))
+    return _finish_plan('invert', {'paths': list(paths)}, entries, [])
+
+# --- Saving and Executing Plans ---
+
+def save_plan(plan, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=1)
+
+def load_plan(path, tool):
+    """Load a saved plan, raising ValueError if it was made for another tool."""
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION or plan.get('tool') != tool:
+        raise ValueError(f"The file is not a {tool} plan.")
+    return plan
+
+def overwritten_outputs(plan):
+    return [entry['output'] for entry in plan['entries'] if entry['overwrite']]
+
+def _unchanged(entry):
+    """Return True if the source of a plan entry is still as it was when planned."""
+    try:
+        st = os.stat(entry['source'])
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime_ns) == (entry['size'], entry['mtime_ns'])
+
+def plan_retry(plan, sources):
+    """
+    Return a copy of 'plan' limited to the entries of 'sources' (e.g. the
+    failed sources of a BatchReport), re-reading their current size and date.
+    """
+    # Sources may be spelled differently from the plan (e.g. normalized separators)
+    wanted = {os.path.normcase(os.path.abspath(source)) for source in sources}
+    entries = [_entry(entry['source'], entry['output']) for entry in plan['entries']
+               if os.path.normcase(os.path.abspath(entry['source'])) in wanted and os.path.exists(entry['source'])]
+    return _finish_plan(plan['tool'], plan['params'], entries, [])
+
+def _skip_changed(entries, report):
+    """Split off the entries whose source changed since planned, recording them as skipped."""
+    unchanged = []
+    changed = []
+    for entry in entries:
+        if _unchanged(entry):
+            unchanged.append(entry)
+        else:
+            changed.append(entry['source'])
+            if report is not None:
+                report.add(FileResult(entry['source'], entry['output'], STATUS_SKIPPED,
+                                      error="changed since the plan was made"))
+    return unchanged, changed
+
+def execute_plan(plan, action, workers=1, report=None):
+    """
+    Run action(source, output) for every planned entry, using up to 'workers'
+    threads. Sources that changed since the plan was made are not processed.
+    An action fails by raising or by returning False; failures never stop the
+    batch and are recorded in 'report' (a BatchReport) if given.
+    Returns (processed, changed) lists of source paths.
+    """
+    def run_entry(entry):
+        source = entry['source']
+        start = time.perf_counter()
+        try:
+            if not action(source, entry['output']):
+                raise RuntimeError("the file could not be processed")
+        except Exception as e:
+            return FileResult.failure(source, entry['output'], e, time.perf_counter() - start, entry['size'])
+        written = os.path.getsize(entry['output']) if os.path.exists(entry['output']) else 0
+        return FileResult(source, entry['output'], seconds=time.perf_counter() - start,
+                          bytes_read=entry['size'], bytes_written=written)
+
+    entries, changed = _skip_changed(plan['entries'], report)
+    processed = []
+    bytes_processed = 0
+    start = time.perf_counter()
+    # A single worker runs on the calling thread so actions may update a GUI
+    pool = ThreadPoolExecutor(max_workers=workers) if workers != 1 else None
+    results = pool.map(run_entry, entries) if pool else map(run_entry, entries)
+    try:
+        for result in results:
+            if report is not None:
+                report.add(result)
+            if result.status == STATUS_OK:
+                processed.append(result.source)
+                bytes_processed += result.bytes_read + result.bytes_written
+    finally:
+        if pool:
+            pool.shutdown()
+    record_throughput(plan['tool'], bytes_processed, time.perf_counter() - start)
+    if report is not None:
+        report.finish()
+    return processed, changed
+
+def execute_plan_pipelined(plan, transform, on_result=None, report=None, **pipeline_options):
+    """
+    Run the planned entries through the staged read/transform/write pipeline.
+    transform(data, source) returns (output_bytes, info) as in run_pipeline;
+    on_result(source, output, info, error) is called on the calling thread.
+    Every file is recorded in 'report' (a BatchReport) if given.
+    Returns (processed, changed, stats).
+    """
+    entries, changed = _skip_changed(plan['entries'], report)
+    sizes = {entry['source']: entry['size'] for entry in entries}
+    written = {}
+
+    def counting_transform(data, source):
+        output_bytes, info = transform(data, source)
+        if output_bytes is not None:
+            # Outputs with several files (e.g. variants) give one bytes object per file
+            written[source] = (sum(len(data) for data in output_bytes)
+                               if isinstance(output_bytes, (list, tuple)) else len(output_bytes))
+        return output_bytes, info
+
+    processed = []
+
+    def collect(source, output, info, error):
+        if error is None and source in written:
+            processed.append(source)
+        if on_result:
+            on_result(source, output, info, error)
+
+    stats = run_pipeline([(entry['source'], entry['output']) for entry in entries],
+                         counting_transform, collect, report=report, **pipeline_options)
+    bytes_processed = sum(sizes[source] + written[source] for source in processed)
+    record_throughput(plan['tool'], bytes_processed, stats.wall_seconds)
+    if report is not None:
+        report.finish()
+    return processed, changed, stats
+
+def format_size(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{num_bytes} B"
+        num_bytes /= 1024
+
+def format_plan_summary(plan):
+    """Return a human-readable description of a plan."""
+    overwritten = overwritten_outputs(plan)
+    lines = [
+        f"Files to process: {len(plan['entries'])}",
+        f"Files skipped: {len(plan['skipped'])}",
+        f"Bytes to read: {format_size(plan['bytes_read'])}",
+        f"Bytes to write (estimated): {format_size(plan['bytes_written'])}",
+        f"Estimated time: {plan['estimated_seconds']:.1f} s",
+        f"Existing files that will be overwritten: {len(overwritten)}",
+    ]
+    lines.extend(f"  {path}" for path in overwritten)
+    return "\n".join(lines)
+
+def show_plan_window(parent, plan):
+    """Open a window describing 'plan' with a button to save it as JSON."""
+    import tkinter as tk
+    from tkinter import filedialog
+
+    def save():
+        path = filedialog.asksaveasfilename(parent=window, defaultextension=".json",
+                                            filetypes=[("Plan files", "*.json")])
+        if path:
+            save_plan(plan, path)
+
+    window = tk.Toplevel(parent)
+    window.title("Dry Run")
+    text_widget = tk.Text(window, wrap="none", width=80, height=20)
+    text_widget.insert(tk.END, format_plan_summary(plan))
+    text_widget.configure(state="disabled")
+    text_widget.pack(fill="both", expand=True, padx=5, pady=5)
+    tk.Button(window, text="Save Plan...", command=save).pack(pady=5)
+    return window
@@ -0,0 +1,274 @@
+import io
+import os
+import hashlib
+import sys
+import time
+import sqlite3
+import argparse
+
+from PIL import Image
+
+from audit import list_image_files
+from pipeline import run_pipeline
+from histogram_file import pack_color, unpack_color, image_color_counts
+from color_sketch import parse_color
+from swap_engine import load_palette
+from png_header import index_cache_directory
+
+# Persistent reverse lookup of colours: for every image below a root
+# directory, the visible colours it uses with their pixel counts and, for
+# indexed images, the palette entries its pixels use. It answers "which
+# sprites use this colour / palette entry" without decoding anything, e.g.
+# to find every image affected by an art direction change. The index is an
+# SQLite database kept with the PNG header indexes, out of the asset
+# folders; like the PNG header index, each image is validated against its
+# size and modification time, so an update only decodes new or changed
+# images and forgets removed ones.
+#
+# Usage: python color_index.py update ROOT [--top-level]
+#        python color_index.py query ROOT [--color R,G,B[,A] ...] [--entry N ...] [--update]
+#        python color_index.py affected ROOT OLD_PALETTE.png NEW_PALETTE.png [--top-level]
+
+INDEX_VERSION = 1
+# Changes are committed every so many images, so an interrupted update keeps its progress
+COMMIT_INTERVAL = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+CREATE TABLE IF NOT EXISTS images (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL,
+                                   size INTEGER, mtime_ns INTEGER, mode TEXT);
+CREATE TABLE IF NOT EXISTS colors (color INTEGER, image INTEGER, pixels INTEGER,
+                                   PRIMARY KEY (color, image)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entries (entry INTEGER, image INTEGER, pixels INTEGER,
+                                    PRIMARY KEY (entry, image)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS colors_by_image ON colors (image);
+CREATE INDEX IF NOT EXISTS entries_by_image ON entries (image);
+"""
+
+def image_census(image):
+    """
+    Return (mode, colours, entries) of an image: {packed RGBA: pixels} of its
+    visible colours and, for indexed images, {palette entry: pixels}.
+    """
+    colors = {pack_color(color): count for color, count in image_color_counts(image).items()}
+    entries = {}
+    if image.mode == 'P':
+        entries = {entry: count for entry, count in enumerate(image.histogram()) if count}
+    return image.mode, colors, entries
+
+def color_index_path(root):
+    """Database file of the colour index of 'root'."""
+    key = os.path.normcase(os.path.abspath(root))
+    return os.path.join(index_cache_directory(), "colors_" + hashlib.sha1(key.encode('utf-8')).hexdigest() + ".db")
+
+class ColorIndex:
+    """Reverse colour index of the images below 'root'. Call close() when done."""
+
+    def __init__(self, root, path=None):
+        self.root = root
+        self.path = path or color_index_path(root)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        version = None
+        try:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            version = row[0] if row else None
+        except sqlite3.DatabaseError:
+            pass
+        if version != INDEX_VERSION:
+            # Missing, older or unreadable indexes are rebuilt from scratch
+            self.connection.close()
+            os.remove(self.path)
+            self.connection = sqlite3.connect(self.path)
+            self.connection.executescript(_SCHEMA)
+            self.connection.execute("INSERT INTO meta VALUES ('version', ?)", (INDEX_VERSION,))
+            self.connection.commit()
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def _absolute(self, name):
+        return os.path.normpath(os.path.join(self.root, name))
+
+    def update(self, on_error=None, recursive=True, **pipeline_options):
+        """
+        Decode the new and changed images and forget the removed ones; without
+        'recursive' only the images directly in the root are looked at.
+        on_error(path, error) is called for unreadable images, which are
+        indexed without colours until they change. Returns (new, changed, removed).
+        """
+        known = {path: (image_id, size, mtime_ns) for image_id, path, size, mtime_ns
+                 in self.connection.execute("SELECT id, path, size, mtime_ns FROM images")}
+        stale = []
+        current = set()
+        for path in list_image_files(self.root, recursive):
+            name = self._relative(path)
+            current.add(name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            record = known.get(name)
+            if record is None or record[1:] != (st.st_size, st.st_mtime_ns):
+                stale.append((path, (st.st_size, st.st_mtime_ns)))
+        removed = [known[name][0] for name in set(known) - current if recursive or '/' not in name]
+        counts = {'new': 0, 'changed': 0}
+
+        def transform(data, source):
+            with Image.open(io.BytesIO(data)) as image:
+                return None, image_census(image)
+
+        stats = dict(stale)
+        pending = 0
+
+        def collect(source, output, info, error):
+            nonlocal pending
+            name = self._relative(source)
+            if error is not None and on_error:
+                on_error(source, error)
+            mode, colors, entries = info if error is None else (None, {}, {})
+            size, mtime_ns = stats[source]
+            record = known.get(name)
+            if record is None:
+                counts['new'] += 1
+                image_id = self.connection.execute("INSERT INTO images (path, size, mtime_ns, mode) VALUES (?, ?, ?, ?)",
+                                                   (name, size, mtime_ns, mode)).lastrowid
+            else:
+                counts['changed'] += 1
+                image_id = record[0]
+                self._forget(image_id)
+                self.connection.execute("UPDATE images SET size = ?, mtime_ns = ?, mode = ? WHERE id = ?",
+                                        (size, mtime_ns, mode, image_id))
+            self.connection.executemany("INSERT INTO colors VALUES (?, ?, ?)",
+                                        ((color, image_id, count) for color, count in colors.items()))
+            self.connection.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                                        ((entry, image_id, count) for entry, count in entries.items()))
+            pending += 1
+            if pending >= COMMIT_INTERVAL:
+                self.connection.commit()
+                pending = 0
+
+        run_pipeline([(path, None) for path, _ in stale], transform, collect, **pipeline_options)
+        for image_id in removed:
+            self._forget(image_id)
+            self.connection.execute("DELETE FROM images WHERE id = ?", (image_id,))
+        self.connection.commit()
+        return counts['new'], counts['changed'], len(removed)
+
+    def _forget(self, image_id):
+        self.connection.execute("DELETE FROM colors WHERE image = ?", (image_id,))
+        self.connection.execute("DELETE FROM entries WHERE image = ?", (image_id,))
+
+    def _lookup(self, table, column, keys):
+        placeholders = ", ".join("?" * len(keys))
+        rows = self.connection.execute(
+            f"SELECT images.path, SUM({table}.pixels) FROM {table} JOIN images ON images.id = {table}.image "
+            f"WHERE {table}.{column} IN ({placeholders}) GROUP BY images.path", list(keys))
+        return sorted(((self._absolute(name), pixels) for name, pixels in rows), key=lambda item: (-item[1], item[0]))
+
+    def images_with_colors(self, colors):
+        """Return [(path, pixels)] of the images using any of the (r, g, b, a) colours, most pixels first."""
+        return self._lookup('colors', 'color', [pack_color(color) for color in colors]) if colors else []
+
+    def images_with_entries(self, entries):
+        """Return [(path, pixels)] of the indexed images using any of the palette entries, most pixels first."""
+        return self._lookup('entries', 'entry', list(entries)) if entries else []
+
+    def colors_of(self, path):
+        """Return {(r, g, b, a): pixels} of an indexed image, or None if it is not in the index."""
+        row = self.connection.execute("SELECT id FROM images WHERE path = ?", (self._relative(path),)).fetchone()
+        if row is None:
+            return None
+        return {unpack_color(color): pixels for color, pixels
+                in self.connection.execute("SELECT color, pixels FROM colors WHERE image = ?", row)}
+
+    def close(self):
+        self.connection.close()
+
+def load_color_index(root, on_error=None, recursive=True):
+    """Return a ColorIndex for 'root', up to date for its whole tree or (without 'recursive') its top level."""
+    index = ColorIndex(root)
+    index.update(on_error, recursive)
+    return index
+
+def changed_entries(old_palette, new_palette):
+    """Palette entries whose colour differs between two flat RGB palettes (or that only one of them has)."""
+    entries = max(len(old_palette), len(new_palette)) // 3
+    return [entry for entry in range(entries)
+            if old_palette[entry * 3:entry * 3 + 3] != new_palette[entry * 3:entry * 3 + 3]]
+
+def affected_sources(root, old_palette_path, new_palette_path, on_error=None, recursive=True):
+    """
+    Paths of the indexed images below 'root' (only directly in it without
+    'recursive') whose pixels use a palette entry that differs between the
+    two palettes, i.e. the only sprites whose swapped copies look different
+    with the new palette.
+    """
+    entries = changed_entries(load_palette(old_palette_path), load_palette(new_palette_path))
+    index = load_color_index(root, on_error, recursive)
+    try:
+        paths = [path for path, _ in index.images_with_entries(entries)]
+    finally:
+        index.close()
+    if not recursive:
+        paths = [path for path in paths if '/' not in index._relative(path)]
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the images that use given colours or palette entries.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    update = commands.add_parser('update', help="index the new and changed images below ROOT")
+    update.add_argument('root')
+    update.add_argument('--top-level', action='store_true', help="only index the images directly in ROOT")
+    query = commands.add_parser('query', help="list the images using any of the given colours or palette entries")
+    query.add_argument('root')
+    query.add_argument('--color', action='append', default=[], help="R,G,B[,A] or #RRGGBB[AA] (repeatable)")
+    query.add_argument('--entry', type=int, action='append', default=[], help="palette entry (repeatable)")
+    query.add_argument('--update', action='store_true', help="update the index before the query")
+    affected = commands.add_parser('affected', help="list the indexed images using entries changed between two palettes")
+    affected.add_argument('root')
+    affected.add_argument('old_palette')
+    affected.add_argument('new_palette')
+    affected.add_argument('--top-level', action='store_true', help="only look at the images directly in ROOT")
+    args = parser.parse_args(argv)
+
+    def print_error(path, error):
+        print(f"Error reading {path}: {error}", file=sys.stderr)
+
+    if args.command == 'affected':
+        try:
+            paths = affected_sources(args.root, args.old_palette, args.new_palette, print_error, not args.top_level)
+        except (OSError, ValueError) as e:
+            print(f"Invalid palette: {e}", file=sys.stderr)
+            return 2
+        for path in paths:
+            print(path)
+        return 0
+
+    index = ColorIndex(args.root)
+    try:
+        if args.command == 'update' or args.update:
+            start = time.perf_counter()
+            new, changed, removed = index.update(print_error, not getattr(args, 'top_level', False))
+            print(f"{new} new, {changed} changed, {removed} removed images indexed in "
+                  f"{time.perf_counter() - start:.2f} s", file=sys.stderr)
+        if args.command == 'query':
+            if not args.color and not args.entry:
+                parser.error("give at least one --color or --entry")
+            try:
+                colors = [parse_color(text) for text in args.color]
+            except ValueError as e:
+                parser.error(str(e))
+            start = time.perf_counter()
+            found = {}
+            for path, pixels in index.images_with_colors(colors) + index.images_with_entries(args.entry):
+                found[path] = max(found.get(path, 0), pixels)
+            for path, pixels in sorted(found.items(), key=lambda item: (-item[1], item[0])):
+                print(f"{pixels}\t{path}")
+            print(f"{len(found)} images found in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+    finally:
+        index.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+from launcher import lazy_import
+Image = lazy_import('PIL.Image')
+ImageMath = lazy_import('PIL.ImageMath')
+
+# Perceptual nearest-colour matching against a fixed palette. Colours are
+# compared in OKLab, where Euclidean distance follows perceived difference
+# far better than RGB distance, and the palette is stored in a KD-tree.
+# Images are matched by their unique colours, so the cost grows with the
+# number of distinct colours rather than the number of pixels.
+
+def _linear(channel):
+    c = channel / 255
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+def srgb_to_oklab(color):
+    """Convert an (r, g, b) tuple with 0-255 channels to OKLab (L, a, b)."""
+    r, g, b = (_linear(c) for c in color[:3])
+    l = (0.4122214708 * r + 0.5363325363 * g + 0.0514459929 * b) ** (1 / 3)
+    m = (0.2119034982 * r + 0.6806995451 * g + 0.1073969566 * b) ** (1 / 3)
+    s = (0.0883024619 * r + 0.2817188376 * g + 0.6299787005 * b) ** (1 / 3)
+    return (
+        0.2104542553 * l + 0.7936177850 * m - 0.0040720468 * s,
+        1.9779984951 * l - 2.4285922050 * m + 0.4505937099 * s,
+        0.0259040371 * l + 0.7827717662 * m - 0.8086757660 * s,
+    )
+
+# --- KD-Tree ---
+
+class _Node:
+    __slots__ = ('point', 'index', 'axis', 'left', 'right')
+
+    def __init__(self, point, index, axis, left, right):
+        self.point = point
+        self.index = index
+        self.axis = axis
+        self.left = left
+        self.right = right
+
+def _build_tree(items, depth=0):
+    """Build a KD-tree from (point, index) pairs."""
+    if not items:
+        return None
+    axis = depth % 3
+    items = sorted(items, key=lambda item: item[0][axis])
+    median = len(items) // 2
+    point, index = items[median]
+    return _Node(point, index, axis,
+                 _build_tree(items[:median], depth + 1),
+                 _build_tree(items[median + 1:], depth + 1))
+
+def _nearest(node, target, best):
+    """best is [squared_distance, index]; updated in place."""
+    if node is None:
+        return
+    d = sum((p - t) ** 2 for p, t in zip(node.point, target))
+    # Ties go to the lowest palette index, like Pillow's own quantizer
+    if d < best[0] or (d == best[0] and node.index < best[1]):
+        best[0] = d
+        best[1] = node.index
+    diff = target[node.axis] - node.point[node.axis]
+    near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+    _nearest(near, target, best)
+    if diff * diff <= best[0]:
+        _nearest(far, target, best)
+
+class KDTree:
+    """KD-tree over 3D points (such as OKLab colours) answering nearest-point queries."""
+
+    def __init__(self, points):
+        self.root = _build_tree([(point, index) for index, point in enumerate(points)])
+
+    def nearest(self, point):
+        """Return (index, squared_distance) of the point nearest to 'point'."""
+        best = [float('inf'), -1]
+        _nearest(self.root, point, best)
+        return best[1], best[0]
+
+class PaletteMatcher:
+    """Finds the perceptually nearest palette entry of RGB colours, caching every answer."""
+
+    def __init__(self, palette, excluded=()):
+        """palette is a flat [r, g, b, ...] list; 'excluded' indices are never chosen."""
+        self.palette = palette
+        self.colors = [tuple(palette[i:i + 3]) for i in range(0, len(palette) - 2, 3)]
+        items = []
+        seen = set()
+        for index, color in enumerate(self.colors):
+            # Duplicated entries can never win, keep only the first one
+            if index in excluded or color in seen:
+                continue
+            seen.add(color)
+            items.append((srgb_to_oklab(color), index))
+        self.tree = _build_tree(items)
+        self.cache = {}
+        self.grid = {}
+
+    def match(self, color):
+        """Return (palette_index, delta_e) for an (r, g, b) colour, delta_e being the OKLab distance."""
+        color = tuple(color[:3])
+        result = self.cache.get(color)
+        if result is None:
+            best = [float('inf'), -1]
+            _nearest(self.tree, srgb_to_oklab(color), best)
+            result = (best[1], best[0] ** 0.5)
+            self.cache[color] = result
+        return result
+
+    def map_image(self, rgb_img):
+        """
+        Map an RGB image to the palette without dithering and return a P image.
+        Each unique colour is matched once; the per-pixel work is a lookup table.
+        """
+        colors = rgb_img.getcolors(rgb_img.width * rgb_img.height)
+        if len(colors) <= 256:
+            # An exact adaptive quantization gives every unique colour its own
+            # index, which then only needs a 256-entry table to reach the palette
+            exact = rgb_img.quantize(colors=256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+            exact_palette = exact.getpalette()
+            used = [index for _, index in exact.getcolors(256)]
+            image_colors = {color for _, color in colors}
+            if len(used) == len(colors) and all(tuple(exact_palette[i * 3:i * 3 + 3]) in image_colors for i in used):
+                table = list(range(256))
+                for i in used:
+                    table[i] = self.match(exact_palette[i * 3:i * 3 + 3])[0]
+                mapped = exact.point(table)
+                mapped.putpalette(self.palette)
+                return mapped
+
+        # More colours: green and blue form a 16-bit key that a 65536-entry
+        # table maps to palette indices, so every per-pixel step runs inside
+        # Pillow. Red levels whose keys never need different indices share a
+        # table; each further table is pasted only where red has its levels
+        r, g, b = rgb_img.split()
+        keys = ImageMath.lambda_eval(lambda bands: bands['g'] * 256 + bands['b'], g=g, b=b)
+        by_red = {}
+        for _, color in colors:
+            by_red.setdefault(color[0], {})[color[1] * 256 + color[2]] = self.match(color)[0]
+        groups = []
+        for red, entries in sorted(by_red.items()):
+            for levels, table in groups:
+                if all(table.get(key, index) == index for key, index in entries.items()):
+                    levels.add(red)
+                    table.update(entries)
+                    break
+            else:
+                groups.append(({red}, entries))
+        indices = None
+        for levels, entries in groups:
+            table = [0] * 65536
+            for key, index in entries.items():
+                table[key] = index
+            layer = keys.point(table, 'L')
+            if indices is None:
+                # Pixels of other levels get overwritten by their own group
+                indices = layer
+            else:
+                indices.paste(layer, mask=r.point([255 if value in levels else 0 for value in range(256)]))
+        mapped = Image.frombytes('P', rgb_img.size, indices.tobytes())
+        mapped.putpalette(self.palette)
+        return mapped
+
+    def map_image_grid(self, rgb_img):
+        """
+        Map an RGB image to the palette through a 5-6-5 bit colour grid.
+        Each pixel becomes a 16-bit grid key and a 65536-entry table turns keys
+        into palette indices, all inside Pillow; only the grid cells present in
+        the image are matched. Slightly less precise than map_image, which
+        suits dithered images whose colours already carry added noise.
+        """
+        r, g, b = rgb_img.split()
+        keys = ImageMath.lambda_eval(
+            lambda bands: (bands['r'] >> 3) * 2048 + (bands['g'] >> 2) * 32 + (bands['b'] >> 3),
+            r=r, g=g, b=b)
+        table = [0] * 65536
+        for _, key in keys.getcolors(65536):
+            index = self.grid.get(key)
+            if index is None:
+                # Match the centre of the grid cell
+                center = (((key >> 11) << 3) | 4, (((key >> 5) & 63) << 2) | 2, ((key & 31) << 3) | 4)
+                index = self.grid[key] = self.match(center)[0]
+            table[key] = index
+        mapped = Image.frombytes('P', rgb_img.size, keys.point(table, 'L').tobytes())
+        mapped.putpalette(self.palette)
+        return mapped
@@ -0,0 +1,523 @@
+import io
+import os
+import sys
+import json
+import math
+import struct
+import argparse
+from array import array
+from functools import lru_cache
+
+from PIL import Image
+
+from audit import list_image_files
+from pipeline import run_pipeline
+from histogram_file import pack_color, unpack_color, image_color_counts, _little_endian
+
+# Approximate colour statistics for very large repositories. An exact census
+# (palette_checker, histogram_file) keeps every colour of every image; here
+# each image is still decoded and counted on its own, but what is kept for
+# the whole run has a fixed size chosen up front:
+#   - HyperLogLog sketches estimate the distinct colours of the repository
+#     and of each group of directories (e.g. each top-level folder),
+#   - two count-min sketches estimate, for any colour, the pixels of that
+#     colour and the number of images using it,
+#   - a small table follows the colours used by the most images.
+# Every estimate is reported with its error bound. Sketches built with the
+# same sizes are merged by taking register maxima and adding counters, so
+# shards of a repository can be built on different machines and merged in
+# any grouping. Flagged groups can then be checked exactly with
+# histogram_file.py or the Palette Checker.
+#
+# File layout (little-endian):
+#   magic b'PSSK', version u16
+#   precision u8, group precision u8, depth u8, width u32, top size u16
+#   image count u64, pixel count u64, error count u64
+#   registers u8[2 ** precision]
+#   pixel counters u64[depth * width], image counters u64[depth * width]
+#   distinct colours per image, u64[33] (images with bit_length(colours) == i)
+#   top candidate count u16, packed RGBA u32[candidates]
+#   group count u32, then for each group: name length u16, UTF-8 name,
+#     images u64, pixels u64, most colours in one image u32,
+#     registers u8[2 ** group precision]
+#
+# Usage: python color_sketch.py build IMAGE_DIR OUT.sketch [--root DIR] [--group-depth 1]
+#            [--memory 1024] [--precision 14] [--depth 4] [--top 32]
+#        python color_sketch.py merge OUT.sketch IN.sketch [IN.sketch ...]
+#        python color_sketch.py report IN.sketch [IN.sketch ...] [--json OUT.json]
+#            [--flag-colors N] [--color R,G,B,A ...]
+
+MAGIC = b'PSSK'
+VERSION = 1
+_HEADER = struct.Struct('<4sH')
+_SIZES = struct.Struct('<BBBIH')
+_TOTALS = struct.Struct('<QQQ')
+_GROUP = struct.Struct('<QQI')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+
+DEFAULT_PRECISION = 14
+DEFAULT_GROUP_PRECISION = 10
+DEFAULT_DEPTH = 4
+DEFAULT_MEMORY_KB = 1024
+DEFAULT_TOP = 32
+DEFAULT_GROUP_DEPTH = 1
+# Two standard errors: about 95% of the HyperLogLog estimates fall within
+CONFIDENCE_SIGMAS = 2
+DISTINCT_BUCKETS = 33
+_MASK64 = (1 << 64) - 1
+
+@lru_cache(maxsize=65536)
+def color_hash(packed):
+    """64-bit hash of a packed RGBA colour (the splitmix64 finalizer)."""
+    h = (packed + 0x9E3779B97F4A7C15) & _MASK64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return h ^ (h >> 31)
+
+class HyperLogLog:
+    """Estimates the number of distinct 64-bit hashes added, in 2 ** precision bytes."""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError("The HyperLogLog precision must be between 4 and 18.")
+        self.precision = precision
+        self.registers = bytearray(1 << precision) if registers is None else bytearray(registers)
+        self._rest_bits = 64 - precision
+
+    def add(self, h):
+        index = h >> self._rest_bits
+        rank = self._rest_bits - (h & ((1 << self._rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, other):
+        """Merge 'other' into this sketch in place."""
+        if other.precision != self.precision:
+            raise ValueError("HyperLogLog sketches of different precision cannot be merged.")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return m * math.log(m / zeros)
+        return raw
+
+    def relative_error(self):
+        """Standard error of the estimate, as a fraction of it."""
+        return 1.04 / math.sqrt(len(self.registers))
+
+class CountMinSketch:
+    """
+    Estimates how often each key was added, in depth * width counters. An
+    estimate is never below the true count, and with probability
+    1 - exp(-depth) it exceeds it by at most e / width of the total added.
+    """
+
+    def __init__(self, width, depth=DEFAULT_DEPTH, counters=None):
+        self.width = width
+        self.depth = depth
+        self.counters = array('Q', bytes(8 * width * depth)) if counters is None else counters
+        self.total = sum(self.counters[:width])
+
+    def indices(self, h):
+        low, high = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [row * self.width + (low + row * high) % self.width for row in range(self.depth)]
+
+    def add(self, indices, count=1):
+        counters = self.counters
+        for index in indices:
+            counters[index] += count
+        self.total += count
+
+    def estimate(self, indices):
+        return min(self.counters[index] for index in indices)
+
+    def update(self, other):
+        """Merge 'other' into this sketch in place."""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Count-min sketches of different sizes cannot be merged.")
+        self.counters = array('Q', map(sum, zip(self.counters, other.counters)))
+        self.total += other.total
+
+    def error_bound(self):
+        """(overestimate bound, probability of exceeding it) of any estimate."""
+        return math.e / self.width * self.total, math.exp(-self.depth)
+
+def width_for_memory(memory_kb, depth=DEFAULT_DEPTH):
+    """Largest power-of-two count-min width that fits both tables in 'memory_kb'."""
+    width = 1
+    while 2 * depth * (width * 2) * 8 <= memory_kb * 1024:
+        width *= 2
+    return width
+
+class SketchGroup:
+    """Statistics of one group of directories."""
+
+    def __init__(self, precision, registers=None):
+        self.images = 0
+        self.pixels = 0
+        self.max_colors = 0
+        self.distinct = HyperLogLog(precision, registers)
+
+    def update(self, other):
+        self.images += other.images
+        self.pixels += other.pixels
+        self.max_colors = max(self.max_colors, other.max_colors)
+        self.distinct.update(other.distinct)
+
+class ColorSketch:
+    """Fixed-size approximate colour statistics of a set of images."""
+
+    def __init__(self, precision=DEFAULT_PRECISION, width=None, depth=DEFAULT_DEPTH,
+                 group_precision=DEFAULT_GROUP_PRECISION, top=DEFAULT_TOP):
+        width = width or width_for_memory(DEFAULT_MEMORY_KB, depth)
+        self.images = 0
+        self.pixels = 0
+        self.errors = 0
+        self.distinct = HyperLogLog(precision)
+        self.pixel_counts = CountMinSketch(width, depth)
+        self.image_counts = CountMinSketch(width, depth)
+        self.distinct_per_image = array('Q', bytes(8 * DISTINCT_BUCKETS))
+        self.group_precision = group_precision
+        self.groups = {}
+        self.top_size = top
+        # packed colour -> estimated images using it, for the most used colours
+        self.top = {}
+        self._top_threshold = 0
+
+    def add_image(self, group, counts):
+        """Add an image of 'group' given as {packed RGBA: pixel count}."""
+        entry = self.groups.get(group)
+        if entry is None:
+            entry = self.groups[group] = SketchGroup(self.group_precision)
+        pixels = sum(counts.values())
+        self.images += 1
+        self.pixels += pixels
+        self.distinct_per_image[len(counts).bit_length()] += 1
+        entry.images += 1
+        entry.pixels += pixels
+        entry.max_colors = max(entry.max_colors, len(counts))
+        for packed, count in counts.items():
+            h = color_hash(packed)
+            self.distinct.add(h)
+            entry.distinct.add(h)
+            indices = self.pixel_counts.indices(h)
+            self.pixel_counts.add(indices, count)
+            self.image_counts.add(indices)
+            self._offer(packed, self.image_counts.estimate(indices))
+
+    def _offer(self, packed, estimate):
+        if packed in self.top:
+            self.top[packed] = estimate
+        elif len(self.top) < self.top_size:
+            self.top[packed] = estimate
+            self._top_threshold = min(self.top.values())
+        elif estimate > self._top_threshold:
+            del self.top[min(self.top, key=self.top.get)]
+            self.top[packed] = estimate
+            self._top_threshold = min(self.top.values())
+
+    def update(self, other):
+        """
+        Merge 'other' into this sketch in place; both must have been built
+        with the same sizes. Groups with the same name are combined.
+        """
+        if (other.distinct.precision, other.group_precision) != (self.distinct.precision, self.group_precision):
+            raise ValueError("Sketches built with different precisions cannot be merged.")
+        self.images += other.images
+        self.pixels += other.pixels
+        self.errors += other.errors
+        self.distinct.update(other.distinct)
+        self.pixel_counts.update(other.pixel_counts)
+        self.image_counts.update(other.image_counts)
+        self.distinct_per_image = array('Q', map(sum, zip(self.distinct_per_image, other.distinct_per_image)))
+        for name, group in other.groups.items():
+            if name in self.groups:
+                self.groups[name].update(group)
+            else:
+                self.groups[name] = group
+        # The candidates of both are re-ranked with the merged counters
+        candidates = set(self.top) | set(other.top)
+        self.top = {}
+        self._top_threshold = 0
+        for packed in sorted(candidates):
+            self._offer(packed, self.image_counts.estimate(self.image_counts.indices(color_hash(packed))))
+
+    def query(self, color):
+        """Return (estimated pixels, estimated images) of an (r, g, b, a) colour."""
+        indices = self.pixel_counts.indices(color_hash(pack_color(color)))
+        return self.pixel_counts.estimate(indices), self.image_counts.estimate(indices)
+
+    def top_colors(self):
+        """The most used colours found, as [(colour, estimated images)], most used first."""
+        return [(unpack_color(packed), count)
+                for packed, count in sorted(self.top.items(), key=lambda item: (-item[1], item[0]))]
+
+    def memory_bytes(self):
+        """Size of the sketch counters: fixed, plus 2 ** group precision bytes per group."""
+        return (len(self.distinct.registers) + 8 * (len(self.pixel_counts.counters) + len(self.image_counts.counters))
+                + (len(self.groups) << self.group_precision))
+
+    def to_bytes(self):
+        output = io.BytesIO()
+        output.write(_HEADER.pack(MAGIC, VERSION))
+        output.write(_SIZES.pack(self.distinct.precision, self.group_precision, self.pixel_counts.depth,
+                                 self.pixel_counts.width, self.top_size))
+        output.write(_TOTALS.pack(self.images, self.pixels, self.errors))
+        output.write(bytes(self.distinct.registers))
+        for values in (self.pixel_counts.counters, self.image_counts.counters, self.distinct_per_image):
+            output.write(_little_endian(array('Q', values)).tobytes())
+        output.write(_U16.pack(len(self.top)))
+        output.write(_little_endian(array('I', sorted(self.top))).tobytes())
+        output.write(_U32.pack(len(self.groups)))
+        for name, group in sorted(self.groups.items()):
+            encoded = name.encode('utf-8')
+            output.write(_U16.pack(len(encoded)))
+            output.write(encoded)
+            output.write(_GROUP.pack(group.images, group.pixels, group.max_colors))
+            output.write(bytes(group.distinct.registers))
+        return output.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a colour sketch file, or an unsupported version.")
+        offset = _HEADER.size
+        precision, group_precision, depth, width, top = _SIZES.unpack_from(data, offset)
+        offset += _SIZES.size
+        sketch = cls(precision, width, depth, group_precision, top)
+        sketch.images, sketch.pixels, sketch.errors = _TOTALS.unpack_from(data, offset)
+        offset += _TOTALS.size
+
+        def read(size):
+            nonlocal offset
+            chunk = data[offset:offset + size]
+            offset += size
+            return chunk
+
+        def read_array(typecode, count):
+            values = array(typecode)
+            values.frombytes(read(values.itemsize * count))
+            return _little_endian(values)
+
+        sketch.distinct = HyperLogLog(precision, read(1 << precision))
+        sketch.pixel_counts = CountMinSketch(width, depth, read_array('Q', width * depth))
+        sketch.image_counts = CountMinSketch(width, depth, read_array('Q', width * depth))
+        sketch.distinct_per_image = read_array('Q', DISTINCT_BUCKETS)
+        (num_top,) = _U16.unpack(read(_U16.size))
+        for packed in read_array('I', num_top):
+            sketch._offer(packed, sketch.image_counts.estimate(sketch.image_counts.indices(color_hash(packed))))
+        (num_groups,) = _U32.unpack(read(_U32.size))
+        for _ in range(num_groups):
+            (length,) = _U16.unpack(read(_U16.size))
+            name = read(length).decode('utf-8')
+            images, pixels, max_colors = _GROUP.unpack(read(_GROUP.size))
+            group = sketch.groups[name] = SketchGroup(group_precision, read(1 << group_precision))
+            group.images, group.pixels, group.max_colors = images, pixels, max_colors
+        return sketch
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+def group_name(path, root, depth=DEFAULT_GROUP_DEPTH):
+    """The first 'depth' directories of 'path' below 'root', or '.' for files directly in it."""
+    parts = os.path.relpath(os.path.dirname(path), root).replace(os.sep, '/').split('/')
+    parts = [part for part in parts if part != '.'][:depth]
+    return '/'.join(parts) or '.'
+
+def build_sketch(directory, root=None, group_depth=DEFAULT_GROUP_DEPTH, on_error=None, **sketch_options):
+    """
+    Build the sketch of every image below 'directory', grouping images by
+    their first 'group_depth' directories relative to 'root' (defaults to
+    'directory'). Each image is decoded and counted on the pipeline's worker
+    threads and only its colour counts reach the sketch, so memory does not
+    grow with the number of images. on_error(path, error) is called for
+    unreadable images. Returns the ColorSketch.
+    """
+    root = root or directory
+    sketch = ColorSketch(**sketch_options)
+
+    def transform(data, source):
+        with Image.open(io.BytesIO(data)) as image:
+            counts = image_color_counts(image)
+        return None, {pack_color(color): count for color, count in counts.items()}
+
+    def collect(source, output, info, error):
+        if error is not None:
+            sketch.errors += 1
+            if on_error:
+                on_error(source, error)
+        else:
+            sketch.add_image(group_name(source, root, group_depth), info)
+
+    run_pipeline([(path, None) for path in list_image_files(directory)], transform, collect)
+    return sketch
+
+def merge_sketches(sketches):
+    """Merge any number of sketches built with the same sizes."""
+    merged = None
+    for sketch in sketches:
+        if merged is None:
+            merged = sketch
+        else:
+            merged.update(sketch)
+    if merged is None:
+        raise ValueError("No sketches to merge.")
+    return merged
+
+def distinct_estimate(hll):
+    """(estimate, bound) of a HyperLogLog, where the true value is within estimate ± bound about 95% of the time."""
+    estimate = hll.estimate()
+    return estimate, CONFIDENCE_SIGMAS * hll.relative_error() * estimate
+
+def flagged_groups(sketch, max_colors):
+    """Names of the groups whose estimated distinct colours exceed 'max_colors'."""
+    return sorted(name for name, group in sketch.groups.items() if group.distinct.estimate() > max_colors)
+
+def sketch_summary(sketch, colors=(), max_colors=None):
+    """Return the statistics of a sketch as a JSON-serializable dict, for dashboards."""
+    distinct, distinct_bound = distinct_estimate(sketch.distinct)
+    pixel_bound, probability = sketch.pixel_counts.error_bound()
+    image_bound, _ = sketch.image_counts.error_bound()
+    groups = {}
+    for name, group in sorted(sketch.groups.items()):
+        estimate, bound = distinct_estimate(group.distinct)
+        groups[name] = {'images': group.images, 'pixels': group.pixels, 'max_colors_per_image': group.max_colors,
+                        'distinct_colors': round(estimate), 'distinct_colors_bound': round(bound)}
+    summary = {
+        'images': sketch.images,
+        'pixels': sketch.pixels,
+        'errors': sketch.errors,
+        'memory_bytes': sketch.memory_bytes(),
+        'distinct_colors': round(distinct),
+        'distinct_colors_bound': round(distinct_bound),
+        # Count-min estimates are never too low and exceed the true count by more than the bound with this probability
+        'count_bounds': {'pixels': math.ceil(pixel_bound), 'images': math.ceil(image_bound),
+                         'failure_probability': probability},
+        'colors_per_image': {f"{1 << (i - 1) if i else 0}-{(1 << i) - 1}": count
+                             for i, count in enumerate(sketch.distinct_per_image) if count},
+        'top_colors': [{'color': list(color), 'images': count} for color, count in sketch.top_colors()],
+        'groups': groups,
+    }
+    if colors:
+        summary['colors'] = [{'color': list(color), 'pixels': pixels, 'images': images}
+                             for color in colors for pixels, images in [sketch.query(color)]]
+    if max_colors is not None:
+        summary['flagged_groups'] = flagged_groups(sketch, max_colors)
+    return summary
+
+def format_sketch_report(summary):
+    """Return a text report of a sketch_summary."""
+    count_bounds = summary['count_bounds']
+    confidence = f"{1 - count_bounds['failure_probability']:.0%}"
+    lines = [
+        f"Images: {summary['images']} ({summary['pixels']} visible pixels, {summary['errors']} unreadable)",
+        f"Distinct colours: {summary['distinct_colors']} ± {summary['distinct_colors_bound']} (about 95%)",
+        f"Colour counts overestimate by at most {count_bounds['pixels']} pixels and "
+        f"{count_bounds['images']} images ({confidence} of the time); they are never too low",
+        f"Sketch memory: {summary['memory_bytes']} bytes",
+        "\nColours per image:",
+    ]
+    lines.extend(f"{bucket}: {count} images" for bucket, count in summary['colors_per_image'].items())
+    lines.append("\nMost used colours:")
+    lines.extend(f"{tuple(entry['color'])}: about {entry['images']} images" for entry in summary['top_colors'])
+    if 'colors' in summary:
+        lines.append("\nQueried colours:")
+        lines.extend(f"{tuple(entry['color'])}: at most {entry['pixels']} pixels in at most {entry['images']} images"
+                     for entry in summary['colors'])
+    lines.append("\nGroups:")
+    for name, group in summary['groups'].items():
+        lines.append(f"{name}: {group['images']} images, {group['distinct_colors']} ± "
+                     f"{group['distinct_colors_bound']} distinct colours, up to {group['max_colors_per_image']} per image")
+    if summary.get('flagged_groups'):
+        lines.append("\nFlagged groups (check them exactly with histogram_file.py or the Palette Checker):")
+        lines.extend(summary['flagged_groups'])
+    return "\n".join(lines) + "\n"
+
+def parse_color(text):
+    """Parse 'R,G,B[,A]' or '#RRGGBB[AA]' into an (r, g, b, a) tuple."""
+    if text.startswith('#'):
+        digits = text[1:]
+        if len(digits) not in (6, 8):
+            raise ValueError(f"Invalid colour: {text}")
+        values = [int(digits[i:i + 2], 16) for i in range(0, len(digits), 2)]
+    else:
+        values = [int(value) for value in text.split(',')]
+    if len(values) == 3:
+        values.append(255)
+    if len(values) != 4 or not all(0 <= value <= 255 for value in values):
+        raise ValueError(f"Invalid colour: {text}")
+    return tuple(values)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build, merge and report approximate colour statistics of large image sets.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build the sketch of a directory of images")
+    build.add_argument('directory')
+    build.add_argument('output')
+    build.add_argument('--root', help="group images relative to this directory (defaults to DIRECTORY)")
+    build.add_argument('--group-depth', type=int, default=DEFAULT_GROUP_DEPTH,
+                       help="group images by this many directory levels below the root")
+    build.add_argument('--memory', type=int, default=DEFAULT_MEMORY_KB,
+                       help="KiB for the colour count tables; shards to be merged need the same value")
+    build.add_argument('--precision', type=int, default=DEFAULT_PRECISION,
+                       help="HyperLogLog precision of the totals (2 ** P bytes)")
+    build.add_argument('--group-precision', type=int, default=DEFAULT_GROUP_PRECISION,
+                       help="HyperLogLog precision of each group")
+    build.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help="rows of the colour count tables")
+    build.add_argument('--top', type=int, default=DEFAULT_TOP, help="most used colours to follow")
+    merge = commands.add_parser('merge', help="merge sketch files into one")
+    merge.add_argument('output')
+    merge.add_argument('inputs', nargs='+')
+    report = commands.add_parser('report', help="report the statistics of one or more sketch files")
+    report.add_argument('inputs', nargs='+')
+    report.add_argument('--json', help="also write the statistics as JSON to this file")
+    report.add_argument('--flag-colors', type=int, help="flag groups with more distinct colours than this")
+    report.add_argument('--color', action='append', default=[], help="estimate the use of this colour (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        def print_error(path, error):
+            print(f"Error reading {path}: {error}", file=sys.stderr)
+        try:
+            sketch = build_sketch(args.directory, args.root, args.group_depth, print_error,
+                                  precision=args.precision, width=width_for_memory(args.memory, args.depth),
+                                  depth=args.depth, group_precision=args.group_precision, top=args.top)
+        except ValueError as e:
+            parser.error(str(e))
+        sketch.save(args.output)
+        return 1 if sketch.errors else 0
+
+    try:
+        sketch = merge_sketches(ColorSketch.load(path) for path in args.inputs)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Cannot read the sketches: {e}", file=sys.stderr)
+        return 2
+    if args.command == 'merge':
+        sketch.save(args.output)
+        return 0
+    try:
+        colors = [parse_color(text) for text in args.color]
+    except ValueError as e:
+        parser.error(str(e))
+    summary = sketch_summary(sketch, colors, args.flag_colors)
+    print(format_sketch_report(summary), end="")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1)
+    return 1 if summary.get('flagged_groups') else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
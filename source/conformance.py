@@ -0,0 +1,114 @@
+import os
+
+from PIL import Image
+
+# Conformance of images against many candidate palettes at once. Instead of
+# testing every colour against one palette set after another, a membership
+# table is built once: each 24-bit colour key maps to a bitset with one bit
+# per palette that contains it. The colours of an image then only need one
+# lookup each; colours missing from the same palettes share a bitset, so the
+# per-palette work grows with the number of distinct bitsets, not colours.
+
+# Palettes missing at most this many colours of an image are near misses
+DEFAULT_MAX_MISSING = 3
+
+def color_key(color):
+    """24-bit key of an (r, g, b) colour."""
+    return (color[0] << 16) | (color[1] << 8) | color[2]
+
+def load_palette_colors(path):
+    """
+    Return the set of (r, g, b) colours of a palette file: the palette entries
+    of an indexed image, or the visible pixels of any other image (such as the
+    palettes exported by palette_checker).
+    """
+    with Image.open(path) as image:
+        if image.mode == 'P':
+            palette = image.getpalette()
+            return {tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)}
+        rgba = image.convert('RGBA')
+    return {(r, g, b) for _, (r, g, b, a) in rgba.getcolors(rgba.width * rgba.height) if a > 0}
+
+def load_palettes(paths):
+    """
+    Load palette files, and every PNG or GIF of the directories among 'paths',
+    as {name: colour set}. Palettes are named by file name, or by their path
+    when several palettes share a file name.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(('.png', '.gif')))
+        else:
+            files.append(path)
+    files = list(dict.fromkeys(os.path.normpath(path) for path in files))
+    basenames = [os.path.basename(path) for path in files]
+    return {(name if basenames.count(name) == 1 else path): load_palette_colors(path)
+            for path, name in zip(files, basenames)}
+
+class PaletteConformance:
+    """Classifies colour sets against a fixed list of palettes using per-colour bitsets."""
+
+    def __init__(self, palettes):
+        """palettes maps palette names to sets of (r, g, b) colours."""
+        self.names = list(palettes)
+        self.all_bits = (1 << len(self.names)) - 1
+        self.membership = {}
+        for bit, colors in enumerate(palettes.values()):
+            for color in colors:
+                key = color_key(color)
+                self.membership[key] = self.membership.get(key, 0) | (1 << bit)
+
+    def missing_groups(self, colors):
+        """Group 'colors' by the bitset of the palettes missing them: {bitset: [colours]}."""
+        groups = {}
+        for color in colors:
+            missing = self.all_bits & ~self.membership.get(color_key(color), 0)
+            if missing:
+                groups.setdefault(missing, []).append(color)
+        return groups
+
+    def missing_colors(self, colors):
+        """Return {palette name: sorted colours of 'colors' missing from it} for every palette."""
+        missing = {name: [] for name in self.names}
+        for bits, group in self.missing_groups(colors).items():
+            for bit in _bits(bits):
+                missing[self.names[bit]].extend(group)
+        return {name: sorted(group) for name, group in missing.items()}
+
+    def classify(self, colors, max_missing=DEFAULT_MAX_MISSING):
+        """
+        Return (fits, near_misses) for a set of (r, g, b) colours: the names of
+        the palettes containing all of them, and {name: sorted missing colours}
+        for the palettes missing at most 'max_missing'. When nothing fits or
+        comes close, the palettes missing the fewest colours are the near misses.
+        """
+        groups = self.missing_groups(colors)
+        counts = [0] * len(self.names)
+        failing = 0
+        for bits, group in groups.items():
+            failing |= bits
+            for bit in _bits(bits):
+                counts[bit] += len(group)
+        fits = [name for bit, name in enumerate(self.names) if not failing >> bit & 1]
+
+        failing_counts = [count for count in counts if count]
+        if not failing_counts:
+            return fits, {}
+        limit = max_missing
+        if not fits and min(failing_counts) > max_missing:
+            limit = min(failing_counts)
+        near_bits = [bit for bit, count in enumerate(counts) if 0 < count <= limit]
+        near_misses = {}
+        for bit in near_bits:
+            near_misses[self.names[bit]] = sorted(
+                color for bits, group in groups.items() if bits >> bit & 1 for color in group)
+        return fits, near_misses
+
+def _bits(bits):
+    """Yield the positions of the set bits of an integer."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from pipeline import write_file
+from batch_plan import format_size
+
+# Deduplication of batch outputs. Many swapped sprites are byte-identical
+# (shared frames, blank tiles); instead of writing every copy, the first one
+# is written and the later ones become a hard link or symbolic link to it,
+# or are only listed in a JSON manifest. Outputs are recognised by a hash of
+# their bytes. The table of known hashes is bounded: past 'max_entries' the
+# least recently seen outputs are forgotten, so a duplicate of a forgotten
+# output is simply written again. It is never linked to the wrong file.
+
+DEDUP_HARDLINK = "hardlink"
+DEDUP_SYMLINK = "symlink"
+DEDUP_MANIFEST = "manifest"
+DEDUP_MODES = (DEDUP_HARDLINK, DEDUP_SYMLINK, DEDUP_MANIFEST)
+
+DEFAULT_MAX_ENTRIES = 65536
+MANIFEST_FILENAME = "dedup_manifest.json"
+MANIFEST_VERSION = 1
+
+def _replace_with_link(link, original, mode):
+    """Atomically replace 'link' (which may exist) with a link to 'original'."""
+    temporary = f"{link}.dedup.tmp"
+    if os.path.lexists(temporary):
+        os.remove(temporary)
+    if mode == DEDUP_HARDLINK:
+        os.link(original, temporary)
+    else:
+        os.symlink(os.path.relpath(original, os.path.dirname(os.path.abspath(link))), temporary)
+    os.replace(temporary, link)
+
+class OutputDeduplicator:
+    """
+    Writes batch outputs, turning repeated contents into links or manifest
+    entries. write() is safe to call from several writer threads; call
+    close() at the end to write the manifest (manifest mode only).
+    """
+
+    def __init__(self, mode=DEDUP_HARDLINK, manifest_path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown deduplication mode: {mode}")
+        if mode == DEDUP_MANIFEST and not manifest_path:
+            raise ValueError("The manifest mode needs a manifest path.")
+        self.mode = mode
+        self.manifest_path = manifest_path
+        self.max_entries = max_entries
+        # digest -> path of the first output with that content, least recently seen first
+        self._seen = OrderedDict()
+        # digest -> Event set once the first output with that content is written
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.duplicates = {}
+        self.files_written = 0
+        self.bytes_written = 0
+        self.bytes_saved = 0
+        # Links the filesystem refused (e.g. no symlink permission), written as copies instead
+        self.link_failures = 0
+
+    def write(self, output, data):
+        """Write one output, or link it to an identical earlier one. Returns the bytes written."""
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        while True:
+            with self._lock:
+                original = self._seen.get(digest)
+                if original is not None:
+                    self._seen.move_to_end(digest)
+                    break
+                waiting = self._pending.get(digest)
+                if waiting is None:
+                    self._pending[digest] = threading.Event()
+                    break
+            # Another thread is writing the same content: link to it once written
+            waiting.wait()
+
+        if original is None:
+            return self._write_original(digest, output, data)
+        if self.mode == DEDUP_MANIFEST:
+            if os.path.lexists(output):
+                # A stale copy from an earlier run would contradict the manifest
+                os.remove(output)
+        else:
+            try:
+                _replace_with_link(output, original, self.mode)
+            except OSError:
+                with self._lock:
+                    self.link_failures += 1
+                return self._count_written(write_file(output, data))
+        with self._lock:
+            self.duplicates[output] = original
+            self.bytes_saved += len(data)
+        return 0
+
+    def _write_original(self, digest, output, data):
+        try:
+            written = write_file(output, data)
+        except BaseException:
+            with self._lock:
+                self._pending.pop(digest).set()
+            raise
+        with self._lock:
+            self._seen[digest] = output
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            self._pending.pop(digest).set()
+        return self._count_written(written)
+
+    def _count_written(self, written):
+        with self._lock:
+            self.files_written += 1
+            self.bytes_written += written
+        return written
+
+    def close(self):
+        """Write the manifest in manifest mode; returns its path, or None."""
+        if self.mode != DEDUP_MANIFEST:
+            return None
+        base = os.path.dirname(os.path.abspath(self.manifest_path))
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'duplicates': {os.path.relpath(output, base).replace(os.sep, '/'):
+                           os.path.relpath(original, base).replace(os.sep, '/')
+                           for output, original in sorted(self.duplicates.items())},
+        }
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        return self.manifest_path
+
+    def summary(self):
+        action = {DEDUP_HARDLINK: "hard-linked", DEDUP_SYMLINK: "symlinked",
+                  DEDUP_MANIFEST: "listed in the manifest"}[self.mode]
+        text = (f"{len(self.duplicates)} duplicate outputs {action}, "
+                f"{format_size(self.bytes_saved)} not written")
+        if self.link_failures:
+            text += f" ({self.link_failures} links failed and were written as copies)"
+        return text
+
+def load_manifest(path):
+    """Return {duplicate output: original output} of a manifest, as absolute paths."""
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("The file is not a deduplication manifest.")
+    base = os.path.dirname(os.path.abspath(path))
+    return {os.path.join(base, output): os.path.join(base, original)
+            for output, original in manifest['duplicates'].items()}
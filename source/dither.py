@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from launcher import lazy_import
+Image = lazy_import('PIL.Image')
+ImageChops = lazy_import('PIL.ImageChops')
+
+# Pluggable dithering stage for the indexed conversion. Every ditherer takes
+# an RGB image and an IndexPalette and returns a P image using that palette.
+# Ordered (Bayer) dithering has no dependency between pixels, so it is done
+# with whole-image Pillow operations and large images are split into tiles
+# processed in parallel.
+
+DITHER_NONE = "none"
+DITHER_FLOYD_STEINBERG = "floyd-steinberg"
+DITHER_BAYER_4 = "bayer4"
+DITHER_BAYER_8 = "bayer8"
+
+# Spread of the Bayer threshold offsets, in 0-255 channel units
+ORDERED_SPREAD = 48
+# Images with more pixels than this are dithered in parallel tiles
+TILE_MIN_PIXELS = 1 << 20
+
+def bayer_matrix(size):
+    """Return the size x size Bayer threshold matrix (size a power of two)."""
+    matrix = [[0]]
+    while len(matrix) < size:
+        n = len(matrix)
+        matrix = [
+            [4 * matrix[y % n][x % n] + (0, 2, 3, 1)[(y // n) * 2 + (x // n)] for x in range(2 * n)]
+            for y in range(2 * n)
+        ]
+    return matrix
+
+def _threshold_pattern(size, width, height, spread):
+    """An L image tiling the Bayer offsets over width x height, centred on 128."""
+    matrix = bayer_matrix(size)
+    cells = size * size
+    tile = Image.new("L", (size, size))
+    tile.putdata([
+        128 + round(((matrix[y][x] + 0.5) / cells - 0.5) * spread)
+        for y in range(size) for x in range(size)
+    ])
+    # Tile along one row first, then repeat the row, so only O(w + h) pastes are needed
+    row = Image.new("L", (width, size))
+    for x in range(0, width, size):
+        row.paste(tile, (x, 0))
+    pattern = Image.new("L", (width, height))
+    for y in range(0, height, size):
+        pattern.paste(row, (0, y))
+    return pattern
+
+def _ordered_tile(rgb_img, palette, size, spread):
+    pattern = _threshold_pattern(size, rgb_img.width, rgb_img.height, spread)
+    offsets = Image.merge("RGB", (pattern, pattern, pattern))
+    # (pixel + offset) - 128, clipped to 0-255
+    dithered = ImageChops.add(rgb_img, offsets, 1.0, -128)
+    return palette.matcher.map_image_grid(dithered)
+
+def ordered_dither(rgb_img, palette, size, spread=ORDERED_SPREAD, workers=None):
+    """Bayer-dither an RGB image to the palette, tiling big images across threads."""
+    width, height = rgb_img.size
+    if width * height < TILE_MIN_PIXELS:
+        return _ordered_tile(rgb_img, palette, size, spread)
+    # Tile heights are multiples of the matrix size so the pattern stays continuous
+    tile_height = max(size, (TILE_MIN_PIXELS // width) // size * size)
+    boxes = [(0, y, width, min(y + tile_height, height)) for y in range(0, height, tile_height)]
+    output = Image.new("P", rgb_img.size)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tiles = pool.map(lambda box: _ordered_tile(rgb_img.crop(box), palette, size, spread), boxes)
+        for box, tile in zip(boxes, tiles):
+            output.paste(tile, box[:2])
+    output.putpalette(palette.palette)
+    return output
+
+def no_dither(rgb_img, palette):
+    return palette.matcher.map_image(rgb_img)
+
+def floyd_steinberg(rgb_img, palette):
+    trans_idx = palette.trans_idx
+    entries = len(palette.palette) // 3
+    if trans_idx is None or entries < 2:
+        return rgb_img.quantize(palette=palette.image, dither=Image.FLOYDSTEINBERG)
+    # Pillow quantizes against every entry, so the transparent one is given the
+    # colour of another entry and its pixels are moved there afterwards:
+    # opaque pixels never become transparent, whatever colour that entry had
+    substitute = 1 if trans_idx == 0 else 0
+    colors = list(palette.palette)
+    colors[trans_idx * 3:trans_idx * 3 + 3] = colors[substitute * 3:substitute * 3 + 3]
+    target = Image.new('P', (1, 1))
+    target.putpalette(colors)
+    quant_img = rgb_img.quantize(palette=target, dither=Image.FLOYDSTEINBERG)
+    lut = list(range(256))
+    lut[trans_idx] = substitute
+    quant_img = quant_img.point(lut)
+    quant_img.putpalette(palette.palette)
+    return quant_img
+
+DITHERERS = {
+    DITHER_NONE: no_dither,
+    DITHER_FLOYD_STEINBERG: floyd_steinberg,
+    DITHER_BAYER_4: lambda rgb_img, palette: ordered_dither(rgb_img, palette, 4),
+    DITHER_BAYER_8: lambda rgb_img, palette: ordered_dither(rgb_img, palette, 8),
+}
+
+def dither_image(rgb_img, palette, mode):
+    """Convert an RGB image to the palette with the ditherer registered as 'mode'."""
+    return DITHERERS[mode](rgb_img, palette)
@@ -0,0 +1,264 @@
+import io
+import os
+import sys
+import struct
+import argparse
+from array import array
+
+from PIL import Image
+
+from audit import list_image_files
+from pipeline import run_pipeline
+
+# Compact binary colour histograms for sharded colour audits. Each shard
+# (e.g. one directory, possibly on another build node) is reduced to a
+# histogram file; histogram files are merged with an associative operation
+# and the result gives the same Common / Unique / Almost Common report that
+# palette_checker writes in its palette_log_*.txt files.
+#
+# File layout (little-endian):
+#   magic b'PSHG', version u16
+#   image count u32, then for each image: name length u16, UTF-8 name
+#   colour count u32, then four arrays of that layout:
+#     colors  u32[colours]   packed RGBA (0xRRGGBBAA), sorted ascending
+#     counts  u64[colours]   pixels of that colour over all images
+#     offsets u32[colours+1] where each colour's ids start in 'ids'
+#     ids     u32[offsets[-1]] ids of the images containing the colour, sorted
+#
+# Usage: python histogram_file.py build IMAGE_DIR OUT.hist [--root DIR]
+#        python histogram_file.py merge OUT.hist IN.hist [IN.hist ...]
+#        python histogram_file.py report IN.hist [IN.hist ...] [--output LOG.txt]
+
+MAGIC = b'PSHG'
+VERSION = 1
+_HEADER = struct.Struct('<4sH')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+
+def pack_color(color):
+    r, g, b, a = color
+    return (r << 24) | (g << 16) | (b << 8) | a
+
+def unpack_color(packed):
+    return (packed >> 24, (packed >> 16) & 255, (packed >> 8) & 255, packed & 255)
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+class ColorHistogram:
+    """Visible colours of a set of images, with pixel counts and the images using each colour."""
+
+    def __init__(self):
+        self.images = []
+        # packed colour -> [pixel count, list of image ids]
+        self.colors = {}
+
+    def add_image(self, name, counts):
+        """Add an image given as {(r, g, b, a): pixel count}."""
+        image_id = len(self.images)
+        self.images.append(name)
+        for color, count in counts.items():
+            entry = self.colors.setdefault(pack_color(color), [0, []])
+            entry[0] += count
+            entry[1].append(image_id)
+
+    def update(self, other):
+        """
+        Add the images of 'other' to this histogram in place. Their image ids
+        are shifted after this one's, so merging is associative. Image names
+        must not repeat between histograms.
+        """
+        repeated = set(self.images) & set(other.images)
+        if repeated:
+            raise ValueError(f"{len(repeated)} images appear in both histograms, e.g. {min(repeated)}")
+        shift = len(self.images)
+        self.images.extend(other.images)
+        for color, (count, ids) in other.colors.items():
+            entry = self.colors.setdefault(color, [0, []])
+            entry[0] += count
+            entry[1].extend(image_id + shift for image_id in ids)
+
+    def merge(self, other):
+        """Return a new histogram combining this one and 'other'."""
+        merged = ColorHistogram()
+        merged.update(self)
+        merged.update(other)
+        return merged
+
+    def census(self):
+        """
+        Return (common, almost, unique) like audit.color_census: the colours in
+        every image, {colour: [images]} for the colours in more than one image
+        but not all, and {image: colours} for those present in only one image.
+        """
+        num_images = len(self.images)
+        common = set()
+        almost = {}
+        unique = {name: set() for name in self.images}
+        for packed, (_, ids) in sorted(self.colors.items()):
+            color = unpack_color(packed)
+            if len(ids) == num_images:
+                common.add(color)
+            elif len(ids) > 1:
+                almost[color] = [self.images[image_id] for image_id in sorted(ids)]
+            if len(ids) == 1:
+                unique[self.images[ids[0]]].add(color)
+        return common, almost, unique
+
+    def to_bytes(self):
+        output = io.BytesIO()
+        output.write(_HEADER.pack(MAGIC, VERSION))
+        output.write(_U32.pack(len(self.images)))
+        for name in self.images:
+            encoded = name.encode('utf-8')
+            output.write(_U16.pack(len(encoded)))
+            output.write(encoded)
+        packed_colors = sorted(self.colors)
+        colors = array('I', packed_colors)
+        counts = array('Q')
+        offsets = array('I', [0])
+        ids = array('I')
+        for packed in packed_colors:
+            count, image_ids = self.colors[packed]
+            counts.append(count)
+            ids.extend(sorted(image_ids))
+            offsets.append(len(ids))
+        output.write(_U32.pack(len(colors)))
+        for values in (colors, counts, offsets, ids):
+            output.write(_little_endian(values).tobytes())
+        return output.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a colour histogram file, or an unsupported version.")
+        offset = _HEADER.size
+        histogram = cls()
+        (num_images,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        for _ in range(num_images):
+            (length,) = _U16.unpack_from(data, offset)
+            offset += _U16.size
+            histogram.images.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        (num_colors,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+
+        def read_array(typecode, count):
+            nonlocal offset
+            values = array(typecode)
+            size = values.itemsize * count
+            values.frombytes(data[offset:offset + size])
+            offset += size
+            return _little_endian(values)
+
+        colors = read_array('I', num_colors)
+        counts = read_array('Q', num_colors)
+        offsets = read_array('I', num_colors + 1)
+        ids = read_array('I', offsets[-1])
+        for i, packed in enumerate(colors):
+            histogram.colors[packed] = [counts[i], ids[offsets[i]:offsets[i + 1]].tolist()]
+        return histogram
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+def image_color_counts(image):
+    """Return {(r, g, b, a): pixel count} of the pixels that are not fully transparent."""
+    rgba = image.convert('RGBA')
+    return {color: count for count, color in rgba.getcolors(rgba.width * rgba.height) if color[3] > 0}
+
+def build_histogram(directory, root=None, **pipeline_options):
+    """
+    Build the histogram of every image below 'directory', naming each image
+    by its path relative to 'root' (defaults to 'directory'), so shards of the
+    same tree get distinct names. Returns (histogram, errors).
+    """
+    root = root or directory
+    counts = {}
+    errors = {}
+
+    def transform(data, source):
+        with Image.open(io.BytesIO(data)) as image:
+            return None, image_color_counts(image)
+
+    def collect(source, output, info, error):
+        if error is not None:
+            errors[source] = error
+        else:
+            counts[source] = info
+
+    paths = list_image_files(directory)
+    run_pipeline([(path, None) for path in paths], transform, collect, **pipeline_options)
+    histogram = ColorHistogram()
+    # Images are added in path order so a shard always produces the same file
+    for path in sorted(counts):
+        histogram.add_image(os.path.relpath(path, root).replace(os.sep, '/'), counts[path])
+    return histogram, errors
+
+def merge_histograms(histograms):
+    """Merge any number of histograms (in the given order)."""
+    merged = ColorHistogram()
+    for histogram in histograms:
+        merged.update(histogram)
+    return merged
+
+def format_census_log(histogram):
+    """Return the Common / Unique / Almost Common report of palette_checker's generate_log."""
+    common, almost, unique = histogram.census()
+    lines = ["Common Colors:"]
+    lines.extend(str(color) for color in sorted(common))
+    lines.append("\nUnique Colors by Image:")
+    for image_name, colors in unique.items():
+        if colors:
+            lines.append(f"\nImage: {image_name}")
+            lines.extend(str(color) for color in sorted(colors))
+    lines.append("\nAlmost Common Colors:")
+    lines.extend(f"{color}: appears in {len(images)} images" for color, images in almost.items())
+    lines.append("\nAlmost Common Colors Summary:")
+    lines.extend(f"{color}: appears in {len(images)} images ({', '.join(images)})" for color, images in almost.items())
+    return "\n".join(lines) + "\n"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build, merge and report binary colour histograms.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build the histogram of a directory of images")
+    build.add_argument('directory')
+    build.add_argument('output')
+    build.add_argument('--root', help="name images relative to this directory (defaults to DIRECTORY)")
+    merge = commands.add_parser('merge', help="merge histogram files into one")
+    merge.add_argument('output')
+    merge.add_argument('inputs', nargs='+')
+    report = commands.add_parser('report', help="write the colour report of one or more histogram files")
+    report.add_argument('inputs', nargs='+')
+    report.add_argument('--output', help="write the report to this file instead of the console")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        histogram, errors = build_histogram(args.directory, args.root)
+        for path, error in sorted(errors.items()):
+            print(f"Error reading {path}: {error}", file=sys.stderr)
+        histogram.save(args.output)
+        return 1 if errors else 0
+
+    histogram = merge_histograms(ColorHistogram.load(path) for path in args.inputs)
+    if args.command == 'merge':
+        histogram.save(args.output)
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(format_census_log(histogram))
+    else:
+        print(format_census_log(histogram), end="")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
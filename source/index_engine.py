@@ -0,0 +1,134 @@
+import io
+from launcher import lazy_import
+Image = lazy_import('PIL.Image')
+
+from color_match import PaletteMatcher
+from dither import dither_image, DITHER_FLOYD_STEINBERG
+
+# Conversion of RGB/RGBA images to a fixed indexed palette, used by
+# convert_to_index. Everything here is GUI-free so it can run on worker threads.
+
+# Alpha value -> mask value: only fully transparent pixels are selected
+_TRANSPARENT_MASK = [255] + [0] * 255
+
+class IndexPalette:
+    """The palette used for a conversion, with everything derived from it."""
+    def __init__(self, palette_img):
+        self.image = palette_img
+        # Transparency index of the palette, if it has one
+        self.trans_idx = palette_img.info.get('transparency')
+        self.palette = palette_img.getpalette()
+        self._update()
+
+    def _update(self):
+        self.allowed_colors = set()
+        for i in range(0, len(self.palette), 3):
+            self.allowed_colors.add((self.palette[i], self.palette[i+1], self.palette[i+2]))
+        # Opaque pixels should never land on the transparent entry
+        excluded = (self.trans_idx,) if self.trans_idx is not None else ()
+        self.matcher = PaletteMatcher(self.palette, excluded)
+
+    def reserve_transparency_slot(self):
+        """
+        Give a palette without transparency index one, without losing colours:
+        a free slot is appended if the palette has fewer than 256 entries,
+        otherwise a duplicated entry is reused. Returns the index, or None if
+        the palette is full of distinct colours.
+        """
+        if self.trans_idx is not None:
+            return self.trans_idx
+        entries = len(self.palette) // 3
+        if entries < 256:
+            index = entries
+            # The new entry repeats the first colour, so quantizing (which
+            # prefers the lowest index on ties) never picks it for opaque pixels
+            self.palette = self.palette + self.palette[:3]
+        else:
+            seen = set()
+            index = None
+            for i in range(entries):
+                color = tuple(self.palette[i * 3:i * 3 + 3])
+                if color in seen:
+                    index = i
+                    break
+                seen.add(color)
+            if index is None:
+                return None
+        self.trans_idx = index
+        self.image = self.image.copy()
+        self.image.putpalette(self.palette)
+        self.image.info['transparency'] = index
+        self._update()
+        return index
+
+def load_index_palette(palette_path):
+    """Load the palette image used for the conversion as an IndexPalette."""
+    palette_img = Image.open(palette_path).convert("P")
+    palette_img.load()
+    return IndexPalette(palette_img)
+
+def convert_image(img, palette, dither=DITHER_FLOYD_STEINBERG):
+    """
+    Analyse and convert one image to the palette.
+    Returns (quant_img, info) where info holds 'indexed' (the image already was
+    in P mode and was not converted), 'semitransparent', the sorted list of
+    'unknown_colors' (opaque colours missing from the palette) and 'nearest',
+    mapping each unknown colour to (palette_index, palette_color, delta_e).
+    """
+    info = {'indexed': img.mode == "P", 'semitransparent': False, 'unknown_colors': [], 'nearest': {}}
+    if info['indexed']:
+        return None, info
+
+    # Convert to RGBA to analyse transparency and colours. Everything works on
+    # the alpha histogram and the list of unique colours, never per pixel.
+    rgba_img = img.convert("RGBA")
+    alpha = rgba_img.getchannel("A")
+    info['semitransparent'] = any(alpha.histogram()[1:255])
+
+    unknown_colors = set()
+    for _, (r, g, b, a) in rgba_img.getcolors(rgba_img.width * rgba_img.height):
+        if a == 255 and (r, g, b) not in palette.allowed_colors:
+            unknown_colors.add((r, g, b))
+    info['unknown_colors'] = sorted(unknown_colors)
+    for color in info['unknown_colors']:
+        index, delta_e = palette.matcher.match(color)
+        info['nearest'][color] = (index, palette.matcher.colors[index], delta_e)
+
+    # Quantize to the palette
+    rgb_img = rgba_img.convert("RGB")
+    quant_img = dither_image(rgb_img, palette, dither)
+
+    trans_idx = palette.trans_idx
+    if trans_idx is not None:
+        apply_transparency(quant_img, alpha, trans_idx)
+    return quant_img, info
+
+def apply_transparency(quant_img, alpha, trans_idx):
+    """
+    Set every fully transparent pixel of 'quant_img' to the transparency index.
+    The mask is built once from the alpha channel and composited by Pillow.
+    """
+    mask = alpha.point(_TRANSPARENT_MASK)
+    quant_img.paste(trans_idx, mask=mask)
+    quant_img.info["transparency"] = trans_idx
+
+def convert_image_data(data, palette, dither=DITHER_FLOYD_STEINBERG):
+    """
+    Convert the bytes of an image file and return (quant_img, info); quant_img
+    is None if nothing was converted.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        return convert_image(img, palette, dither)
+
+def convert_image_bytes(data, palette, dither=DITHER_FLOYD_STEINBERG, **encode_options):
+    """
+    Pipeline variant of convert_image: takes the bytes of an image file and
+    returns (png_bytes, info); png_bytes is None if nothing was converted.
+    'encode_options' are passed to Pillow's PNG encoder.
+    """
+    quant_img, info = convert_image_data(data, palette, dither)
+    if quant_img is None:
+        return None, info
+    output = io.BytesIO()
+    quant_img.save(output, format="PNG", **encode_options)
+    return output.getvalue(), info
@@ -0,0 +1,492 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from batch_plan import plan_swap, plan_convert_to_index, record_throughput, format_size
+from swap_engine import load_palette, load_palette_with_transparency, swap_palette_image, encode_png, PaletteRemapper
+from index_engine import load_index_palette, convert_image_bytes
+from dither import DITHER_FLOYD_STEINBERG
+from atlas import AtlasWriter, check_fits
+from audit import list_image_files, audit_bytes, format_audit_report
+from conformance import PaletteConformance, load_palettes, DEFAULT_MAX_MISSING
+from results import BatchReport, FileResult
+from pipeline import write_file
+from dedup import OutputDeduplicator, MANIFEST_FILENAME
+from reproducible import (deterministic, HashRecorder, HashVerifier, OutputMismatch, load_hashes,
+                          HASHES_FILENAME)
+from palette_extract import (histogram_bytes, merge_histogram, reduce_colors, palette_image,
+                             save_palette_image, METHOD_MEDIAN_CUT)
+
+# Declarative batch jobs. A job file lists swap, convert_to_index,
+# extract_palette and audit jobs with their inputs, palettes, naming and
+# encode profile. Jobs run concurrently on one shared pool of worker threads:
+# a job starts as soon as the jobs it depends on have finished, and its
+# files are queued on the pool next to those of the other running jobs.
+#
+# Job files are JSON, or TOML (Python 3.11+) or YAML (with PyYAML installed):
+#
+#   {
+#     "workers": 8,
+#     "jobs": [
+#       {"name": "palette", "type": "extract_palette", "input": "sprites", "output": "sprites.png", "colors": 32},
+#       {"name": "index", "type": "convert_to_index", "folder": "sprites", "palette": "sprites.png",
+#        "suffix": "_indexed", "dither": "none", "encode": {"compress_level": 9}, "depends_on": ["palette"]}
+#     ]
+#   }
+#
+# Relative paths are relative to the job file.
+#
+# Swap and convert_to_index jobs with "deterministic": true write byte-stable
+# outputs and record their hashes; --verify runs them again without writing
+# and checks every output against those hashes.
+#
+# Usage: python jobs.py JOB_FILE [--workers N] [--summary SUMMARY.json] [--retry SUMMARY.json] [--verify]
+
+JOB_FIELDS = {
+    'swap': {
+        'required': ('directory', 'palette'),
+        'defaults': {'prefix': '', 'suffix': '_palette_swap', 'output_directory': None, 'remap': False,
+                     'atlas': False, 'dedup': None, 'deterministic': False},
+    },
+    'convert_to_index': {
+        'required': ('folder', 'palette'),
+        'defaults': {'prefix': '', 'suffix': '', 'dither': DITHER_FLOYD_STEINBERG,
+                     'reserve_transparency': False, 'deterministic': False},
+    },
+    'extract_palette': {
+        'required': ('input', 'output'),
+        'defaults': {'colors': 256, 'method': METHOD_MEDIAN_CUT, 'transparency': True},
+    },
+    'audit': {
+        'required': ('directory',),
+        'defaults': {'palettes': [], 'output': None, 'max_missing': DEFAULT_MAX_MISSING, 'recursive': True},
+    },
+}
+# Options every job accepts
+COMMON_DEFAULTS = {'depends_on': [], 'encode': {}}
+PATH_FIELDS = ('directory', 'folder', 'palette', 'input', 'output', 'output_directory')
+# Pillow PNG save options allowed in an encode profile
+ENCODE_OPTIONS = ('compress_level', 'optimize')
+SUMMARY_VERSION = 1
+
+# --- Job Files ---
+
+def _read_job_file(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("TOML job files need Python 3.11 or later.")
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAML job files need PyYAML (pip install pyyaml).")
+        with open(path, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _check_order(jobs):
+    """Raise ValueError for unknown dependencies or dependency cycles."""
+    names = {job['name'] for job in jobs}
+    for job in jobs:
+        for dependency in job['depends_on']:
+            if dependency not in names:
+                raise ValueError(f"Job {job['name']} depends on unknown job {dependency}.")
+    remaining = {job['name']: set(job['depends_on']) for job in jobs}
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies & remaining.keys()]
+        if not ready:
+            raise ValueError(f"Dependency cycle between jobs: {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+
+def load_job_file(path):
+    """
+    Load and validate a job file. Returns {'workers': int or None, 'jobs': [job]}
+    where every job has all of its options, with paths made absolute.
+    """
+    data = _read_job_file(path)
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list):
+        raise ValueError("A job file needs a 'jobs' list.")
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(value):
+        return value if value is None else os.path.normpath(os.path.join(base, value))
+
+    jobs = []
+    for number, raw in enumerate(data['jobs'], 1):
+        job_type = raw.get('type')
+        if job_type not in JOB_FIELDS:
+            raise ValueError(f"Job {number} has an unknown type: {job_type!r}")
+        fields = JOB_FIELDS[job_type]
+        for key in fields['required']:
+            if key not in raw:
+                raise ValueError(f"Job {number} ({job_type}) needs '{key}'.")
+        unknown = set(raw) - {'name', 'type'} - set(fields['required']) - set(fields['defaults']) - set(COMMON_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Job {number} ({job_type}) has unknown options: {', '.join(sorted(unknown))}")
+        job = {'name': str(raw.get('name', f"{job_type}-{number}")), 'type': job_type}
+        job.update(COMMON_DEFAULTS)
+        job.update(fields['defaults'])
+        job.update(raw)
+        for key in PATH_FIELDS:
+            if key in job:
+                job[key] = resolve(job[key])
+        if 'palettes' in job:
+            job['palettes'] = [resolve(palette) for palette in job['palettes']]
+        if job.get('deterministic') and job.get('atlas'):
+            raise ValueError(f"Job {job['name']} cannot record output hashes of an atlas.")
+        bad_options = set(job['encode']) - set(ENCODE_OPTIONS)
+        if bad_options:
+            raise ValueError(f"Job {job['name']} has unknown encode options: {', '.join(sorted(bad_options))}")
+        jobs.append(job)
+
+    if len({job['name'] for job in jobs}) != len(jobs):
+        raise ValueError("Job names must be unique.")
+    _check_order(jobs)
+    workers = data.get('workers')
+    return {'workers': int(workers) if workers else None, 'jobs': jobs}
+
+# --- Job Preparation ---
+# Each job type turns into (tool, items, process, finish, write): the
+# (source, output) pairs to run, process(data, source) -> (output_bytes or
+# None, info) run on the pool for each item, finish(infos) called once with
+# {source: info} of the files that succeeded, and write(output, data) used to
+# write the outputs. 'tool' names the throughput record, if any.
+
+def _prepare_swap(job):
+    output_directory = job['output_directory'] or job['directory']
+    plan = plan_swap(job['directory'], job['palette'], job['prefix'], job['suffix'],
+                     output_directory, job['remap'], job['atlas'], job['dedup'])
+    if job['remap']:
+        swap_image = PaletteRemapper(*load_palette_with_transparency(job['palette'])).remap_data
+    else:
+        new_palette = load_palette(job['palette'])
+        swap_image = lambda data: swap_palette_image(data, new_palette)
+    outputs = {entry['source']: entry['output'] for entry in plan['entries']}
+
+    if job['atlas']:
+        def process(data, source):
+            return None, check_fits(swap_image(data))
+
+        def finish(infos):
+            atlas = AtlasWriter(output_directory)
+            # Packed in path order so the same inputs always give the same sheets
+            for source in sorted(infos):
+                if infos[source] is not None:
+                    atlas.add(atlas.sprite_name(outputs[source]), infos[source])
+            return f"atlas written to {atlas.close()}"
+        return None, list(outputs.items()), process, finish, write_file
+
+    def process(data, source):
+        image = swap_image(data)
+        return (encode_png(image, **job['encode']) if image is not None else None), None
+
+    if job['dedup']:
+        deduplicator = OutputDeduplicator(job['dedup'], os.path.join(output_directory, MANIFEST_FILENAME))
+
+        def finish(infos):
+            deduplicator.close()
+            return deduplicator.summary()
+        return 'swap', list(outputs.items()), process, finish, deduplicator.write
+    return 'swap', list(outputs.items()), process, None, write_file
+
+def _prepare_convert_to_index(job):
+    plan = plan_convert_to_index(job['folder'], job['palette'], job['prefix'], job['suffix'],
+                                 job['dither'], job['reserve_transparency'])
+    palette = load_index_palette(job['palette'])
+    if job['reserve_transparency']:
+        palette.reserve_transparency_slot()
+
+    def process(data, source):
+        return convert_image_bytes(data, palette, job['dither'], **job['encode'])
+    return 'convert_to_index', [(entry['source'], entry['output']) for entry in plan['entries']], process, None, write_file
+
+def _prepare_extract_palette(job):
+    def finish(infos):
+        pooled = {}
+        has_transparency = False
+        for histogram, transparent in infos.values():
+            merge_histogram(pooled, histogram)
+            has_transparency |= transparent
+        transparent = job['transparency'] and has_transparency
+        colors = reduce_colors(pooled, job['colors'] - 1 if transparent else job['colors'], job['method'])
+        save_palette_image(palette_image(colors, transparent), job['output'])
+        return f"{len(colors)} colors written to {job['output']}"
+
+    items = [(path, None) for path in list_image_files(job['input'])]
+    return None, items, lambda data, source: (None, histogram_bytes(data)), finish, write_file
+
+def _prepare_audit(job):
+    conformance = PaletteConformance(load_palettes(job['palettes']))
+
+    def finish(infos):
+        report = format_audit_report(infos, {}, conformance.names, job['directory'])
+        if job['output']:
+            with open(job['output'], "w", encoding="utf-8") as f:
+                f.write(report)
+            return f"report written to {job['output']}"
+        return report
+
+    items = [(path, None) for path in list_image_files(job['directory'], job['recursive'])]
+    return None, items, lambda data, source: (None, audit_bytes(data, conformance, job['max_missing'])), finish, write_file
+
+def _hashes_file(job):
+    return os.path.join(job.get('output_directory') or job.get('directory') or job['folder'], HASHES_FILENAME)
+
+def _record_hashes(job, prepared):
+    """Make a prepared job write byte-stable outputs and record their hashes."""
+    tool, items, process, finish, write = prepared
+    recorder = HashRecorder(_hashes_file(job), write)
+
+    def finish_and_record(infos):
+        message = finish(infos) if finish else None
+        recorder.close()
+        return "; ".join(filter(None, [message, f"output hashes recorded in {recorder.path}"]))
+    return tool, items, deterministic(process), finish_and_record, recorder.write
+
+def _verify_outputs(job, prepared):
+    """Make a prepared job compare its outputs with the recorded hashes instead of writing them."""
+    _, items, process, _, _ = prepared
+    verifier = HashVerifier(load_hashes(_hashes_file(job)))
+    planned = {os.path.abspath(output) for _, output in items}
+
+    def finish(infos):
+        missing = planned & set(verifier.hashes) - verifier.checked
+        if missing:
+            raise OutputMismatch(f"{len(missing)} recorded outputs are no longer produced, e.g. {min(missing)}")
+        return f"{len(verifier.checked)} outputs checked against {_hashes_file(job)}"
+    # No throughput record: nothing is written
+    return None, items, deterministic(process), finish, verifier.write
+
+PREPARERS = {
+    'swap': _prepare_swap,
+    'convert_to_index': _prepare_convert_to_index,
+    'extract_palette': _prepare_extract_palette,
+    'audit': _prepare_audit,
+}
+
+# --- Scheduling ---
+
+def _run_file(process, write, source, output):
+    """Read, process and write one file on a pool thread; returns (info, FileResult)."""
+    start = time.perf_counter()
+    with open(source, 'rb') as f:
+        data = f.read()
+    output_bytes, info = process(data, source)
+    written = write(output, output_bytes) if output_bytes is not None else 0
+    return info, FileResult(source, output, seconds=time.perf_counter() - start, bytes_read=len(data),
+                            bytes_written=written)
+
+# Jobs whose result combines every file must be run whole again to be retried
+PER_FILE_JOBS = ('swap', 'convert_to_index')
+
+class JobScheduler:
+    """
+    Runs the jobs of a job file on a shared thread pool, respecting their
+    dependencies. With 'retry' (the summary of an earlier run, see
+    load_summary) jobs that completed are not run again, and per-file jobs
+    only retry the files that failed.
+    """
+
+    def __init__(self, jobs, workers=None, log=print, retry=None, verify=False):
+        self.jobs = jobs
+        self.workers = workers or os.cpu_count() or 1
+        self.log = log
+        self.retry = retry
+        self.verify = verify
+        self.results = {job['name']: {'name': job['name'], 'type': job['type'], 'status': 'pending',
+                                      'seconds': 0.0, 'message': None, 'report': BatchReport(job['type'])}
+                        for job in jobs}
+        self.wall_seconds = 0.0
+
+    def run(self):
+        """Run every job and return the list of job results."""
+        wall_start = time.perf_counter()
+        running = {}
+        futures = {}
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while True:
+                self._start_ready_jobs(pool, running, futures)
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, source, output = futures.pop(future)
+                    job_state = running[name]
+                    try:
+                        info, file_result = future.result()
+                    except Exception as e:
+                        file_result = FileResult.failure(source, output, e)
+                    else:
+                        job_state['infos'][source] = info
+                    self.results[name]['report'].add(file_result)
+                    job_state['remaining'] -= 1
+                    if job_state['remaining'] == 0:
+                        self._finish_job(running.pop(name))
+        finally:
+            pool.shutdown()
+        self.wall_seconds = time.perf_counter() - wall_start
+        return [self.results[job['name']] for job in self.jobs]
+
+    def _retry_filter(self, job):
+        """Return 'done' if the job needs no retry, a set of sources to retry, or None to run it whole."""
+        if self.retry is None or job['name'] not in self.retry:
+            return None
+        previous = self.retry[job['name']]
+        if previous['status'] == 'done' and not previous['failed']:
+            return 'done'
+        if previous['status'] == 'done' and job['type'] in PER_FILE_JOBS:
+            return set(previous['failed'])
+        return None
+
+    def _start_ready_jobs(self, pool, running, futures):
+        started = True
+        # Jobs without files finish immediately, which may make others ready
+        while started:
+            started = False
+            for job in self.jobs:
+                result = self.results[job['name']]
+                if result['status'] != 'pending':
+                    continue
+                statuses = [self.results[dependency]['status'] for dependency in job['depends_on']]
+                if any(status in ('failed', 'skipped') for status in statuses):
+                    result['status'] = 'skipped'
+                    self.log(f"[{job['name']}] skipped: a job it depends on did not finish")
+                    started = True
+                    continue
+                if any(status != 'done' for status in statuses):
+                    continue
+                started = True
+                only = self._retry_filter(job)
+                if only == 'done':
+                    result['status'] = 'done'
+                    result['message'] = "completed in the earlier run"
+                    continue
+                if self.verify and not job.get('deterministic'):
+                    result['status'] = 'done'
+                    result['message'] = "not verified: the job does not record output hashes"
+                    continue
+                result['status'] = 'running'
+                try:
+                    prepared = PREPARERS[job['type']](job)
+                    if self.verify:
+                        prepared = _verify_outputs(job, prepared)
+                    elif job.get('deterministic'):
+                        prepared = _record_hashes(job, prepared)
+                    tool, items, process, finish, write = prepared
+                except Exception as e:
+                    result['status'] = 'failed'
+                    result['message'] = f"{type(e).__name__}: {e}"
+                    self.log(f"[{job['name']}] failed: {result['message']}")
+                    continue
+                if only is not None:
+                    items = [(source, output) for source, output in items if source in only]
+                self.log(f"[{job['name']}] started: {len(items)} files")
+                job_state = {'job': job, 'tool': tool, 'finish': finish, 'infos': {},
+                             'remaining': len(items), 'start': time.perf_counter()}
+                if not items:
+                    self._finish_job(job_state)
+                    continue
+                running[job['name']] = job_state
+                for source, output in items:
+                    futures[pool.submit(_run_file, process, write, source, output)] = (job['name'], source, output)
+
+    def _finish_job(self, job_state):
+        job = job_state['job']
+        result = self.results[job['name']]
+        report = result['report']
+        try:
+            if job_state['finish']:
+                result['message'] = job_state['finish'](job_state['infos'])
+            result['status'] = 'done'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['message'] = f"{type(e).__name__}: {e}"
+        report.finish()
+        result['seconds'] = report.wall_seconds
+        totals = report.totals()
+        if job_state['tool']:
+            record_throughput(job_state['tool'], totals['bytes_read'] + totals['bytes_written'], result['seconds'])
+        self.log(f"[{job['name']}] {result['status']}: {totals['ok']} files, {totals['failed']} failed"
+                 f" in {result['seconds']:.2f} s")
+
+def format_job_report(results, wall_seconds):
+    """Build the throughput and error report of a scheduler run."""
+    def rate(files, num_bytes, seconds):
+        if seconds <= 0:
+            return "-"
+        return f"{files / seconds:.0f} files/s, {format_size(int(num_bytes / seconds))}/s"
+
+    lines = []
+    files = 0
+    num_bytes = 0
+    for result in results:
+        totals = result['report'].totals()
+        job_bytes = totals['bytes_read'] + totals['bytes_written']
+        files += totals['ok']
+        num_bytes += job_bytes
+        lines.append(f"{result['name']} ({result['type']}): {result['status']}, {totals['ok']} files, "
+                     f"{totals['failed']} failed, {result['seconds']:.2f} s, "
+                     f"{rate(totals['ok'], job_bytes, result['seconds'])}")
+        if result['message']:
+            lines.append(f"    {result['message']}")
+        if totals['failed']:
+            lines.extend("    " + line for line in result['report'].summary().splitlines()[1:])
+    lines.append(f"Total: {files} files, {format_size(num_bytes)} read and written in {wall_seconds:.2f} s, "
+                 f"{rate(files, num_bytes, wall_seconds)}")
+    return "\n".join(lines) + "\n"
+
+def save_summary(results, wall_seconds, path):
+    """Write the machine-readable summary of a run: every job with its full BatchReport."""
+    summary = {
+        'version': SUMMARY_VERSION,
+        'wall_seconds': wall_seconds,
+        'jobs': [{'name': result['name'], 'type': result['type'], 'status': result['status'],
+                  'message': result['message'], 'seconds': result['seconds'],
+                  'report': result['report'].to_dict()} for result in results],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=1)
+
+def load_summary(path):
+    """Load a run summary as {job name: {'status': ..., 'failed': [sources]}} for JobScheduler's retry."""
+    with open(path, "r", encoding="utf-8") as f:
+        summary = json.load(f)
+    if summary.get('version') != SUMMARY_VERSION:
+        raise ValueError("The file is not a job run summary.")
+    return {job['name']: {'status': job['status'], 'failed': job['report']['failed']} for job in summary['jobs']}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the batch jobs of a job file.")
+    parser.add_argument('job_file', help="JSON, TOML or YAML job file")
+    parser.add_argument('--workers', type=int, help="size of the shared worker pool (overrides the job file)")
+    parser.add_argument('--summary', help="write a JSON summary with the result of every file to this path")
+    parser.add_argument('--retry', metavar='SUMMARY', help="only redo what failed in the run of this summary")
+    parser.add_argument('--verify', action='store_true',
+                        help="write nothing; check the outputs of the deterministic jobs against their recorded hashes")
+    args = parser.parse_args(argv)
+    try:
+        job_file = load_job_file(args.job_file)
+        retry = load_summary(args.retry) if args.retry else None
+    except (OSError, ValueError) as e:
+        print(f"Invalid job file: {e}", file=sys.stderr)
+        return 2
+    scheduler = JobScheduler(job_file['jobs'], args.workers or job_file['workers'], retry=retry, verify=args.verify)
+    results = scheduler.run()
+    print(format_job_report(results, scheduler.wall_seconds), end="")
+    if args.summary:
+        save_summary(results, scheduler.wall_seconds, args.summary)
+    return 0 if all(result['status'] == 'done' and not result['report'].failed_sources() for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
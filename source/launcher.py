@@ -0,0 +1,98 @@
+import os
+import sys
+import importlib
+
+# Slim startup path shared by the GUI tools. Each tool calls
+# handle_info_options before importing tkinter, tkinterdnd2 or Pillow, so
+# '--version' and '--help' answer without loading them, and Pillow is
+# imported with lazy_import so it is only loaded by the first image
+# operation instead of at launch. Nothing here may import a heavy module.
+#
+# The tools can also be started through this launcher:
+#
+# Usage: python launcher.py TOOL [--version] [--help]
+#        python launcher.py --list
+
+VERSION = "1.1.0"
+
+# Tool name -> (module, description). The modules of the extras live in WIP/.
+TOOLS = {
+    'palette_swapper': ('palette_swapper', "Swap the palette of every indexed PNG in a folder."),
+    'convert_to_index': ('convert_to_index', "Convert images to a fixed indexed palette."),
+    'color_inverter': ('color_inverter', "Invert the colours of images and folders."),
+    'palette_checker': ('palette_checker', "Check and export the colours used by a set of images."),
+    'semitransparency_checker': ('semitransparency_checker', "Find images with semitransparent pixels."),
+}
+
+class _LazyModule:
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            # import_module holds the import lock, so concurrent first uses from
+            # worker threads all get the same, fully initialised module
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+def lazy_import(name):
+    """
+    Return a stand-in for module 'name' that imports it when first used,
+    e.g. Image = lazy_import('PIL.Image'). The module must not be needed at
+    import time (base classes, default arguments, module-level constants).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+def _print(text):
+    # Windowed builds have no console: sys.stdout is None
+    if sys.stdout is not None:
+        print(text)
+
+def handle_info_options(tool, argv=None):
+    """
+    Answer '--version' and '--help' for 'tool' and exit; do nothing for any
+    other arguments. Call it before the heavy imports of the tool.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if '--version' in argv:
+        _print(f"{tool} {VERSION}")
+        sys.exit(0)
+    if '-h' in argv or '--help' in argv:
+        _print(f"usage: {tool} [--version] [--help]\n\n{TOOLS[tool][1]}\n"
+               f"Starts the graphical interface when run without options.")
+        sys.exit(0)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        _print("usage: launcher.py TOOL [--version] [--help]\n       launcher.py --list")
+        return 0 if argv else 2
+    if argv[0] == '--list':
+        for name, (_, description) in TOOLS.items():
+            _print(f"{name}: {description}")
+        return 0
+    if argv[0] == '--version':
+        _print(VERSION)
+        return 0
+    tool = argv[0]
+    if tool not in TOOLS:
+        print(f"Unknown tool: {tool}", file=sys.stderr)
+        return 2
+    handle_info_options(tool, argv[1:])
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "WIP"))
+    sys.argv = [tool] + argv[1:]
+    importlib.import_module(TOOLS[tool][0]).main()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import io
+import sys
+import heapq
+import random
+import argparse
+
+from PIL import Image
+
+from audit import list_image_files
+from color_match import srgb_to_oklab, KDTree
+from pipeline import run_pipeline
+
+# Palette generation: builds an indexed palette of at most 256 entries from
+# a set of RGBA sprites. Only colour histograms are pooled across images, so
+# after decoding the work depends on the number of distinct colours, never
+# on the pixel count. The colours are reduced in OKLab, weighted by how many
+# pixels use them, by median cut and optionally refined by mini-batch k-means.
+# Every entry of the result is a colour that actually appears in the sprites.
+#
+# Usage: python palette_extract.py IMAGE_DIR OUTPUT.png|OUTPUT.gif [--colors 256]
+#                                  [--method median-cut|kmeans] [--no-transparency]
+
+METHOD_MEDIAN_CUT = "median-cut"
+METHOD_KMEANS = "kmeans"
+
+KMEANS_ITERATIONS = 30
+KMEANS_BATCH_SIZE = 1024
+
+def image_histogram(image):
+    """
+    Return (histogram, has_transparency) of an image: {(r, g, b): pixel count}
+    of its visible pixels, and whether it has fully transparent pixels.
+    """
+    rgba = image.convert('RGBA')
+    histogram = {}
+    has_transparency = False
+    for count, (r, g, b, a) in rgba.getcolors(rgba.width * rgba.height):
+        if a == 0:
+            has_transparency = True
+        else:
+            histogram[(r, g, b)] = histogram.get((r, g, b), 0) + count
+    return histogram, has_transparency
+
+def histogram_bytes(data):
+    """Pipeline variant of image_histogram taking the bytes of an image file."""
+    with Image.open(io.BytesIO(data)) as image:
+        return image_histogram(image)
+
+def merge_histogram(pooled, histogram):
+    """Add the counts of 'histogram' to 'pooled' in place."""
+    for color, count in histogram.items():
+        pooled[color] = pooled.get(color, 0) + count
+
+def pool_histograms(paths, **pipeline_options):
+    """
+    Decode the images at 'paths' and pool their histograms.
+    Returns (histogram, has_transparency, errors).
+    """
+    pooled = {}
+    has_transparency = False
+    errors = {}
+
+    def merge(source, output, info, error):
+        nonlocal has_transparency
+        if error is not None:
+            errors[source] = error
+            return
+        histogram, transparent = info
+        has_transparency |= transparent
+        merge_histogram(pooled, histogram)
+
+    run_pipeline([(path, None) for path in paths], lambda data, source: (None, histogram_bytes(data)),
+                 merge, **pipeline_options)
+    return pooled, has_transparency, errors
+
+def _box_stats(box, points, weights):
+    """Return (weighted squared error, axis of largest spread) of a box of colour indices."""
+    total = sum(weights[i] for i in box)
+    means = [sum(points[i][axis] * weights[i] for i in box) / total for axis in range(3)]
+    spreads = [sum(weights[i] * (points[i][axis] - means[axis]) ** 2 for i in box) for axis in range(3)]
+    axis = max(range(3), key=lambda a: spreads[a])
+    return sum(spreads), axis
+
+def median_cut(points, weights, max_colors):
+    """
+    Split the weighted points into at most 'max_colors' boxes, always cutting
+    the box with the largest weighted squared error at its weighted median.
+    Returns the boxes as lists of point indices.
+    """
+    boxes = []
+    done = []
+
+    def push(box):
+        if len(box) < 2:
+            done.append(box)
+            return
+        error, axis = _box_stats(box, points, weights)
+        heapq.heappush(boxes, (-error, len(boxes) + len(done), box, axis))
+
+    push(list(range(len(points))))
+    while boxes and len(boxes) + len(done) < max_colors:
+        _, _, box, axis = heapq.heappop(boxes)
+        box.sort(key=lambda i: points[i][axis])
+        half = sum(weights[i] for i in box) / 2
+        cumulative = 0
+        for cut, i in enumerate(box[:-1], 1):
+            cumulative += weights[i]
+            if cumulative >= half:
+                break
+        push(box[:cut])
+        push(box[cut:])
+    return done + [box for _, _, box, _ in boxes]
+
+def kmeans_refine(points, weights, centers, iterations=KMEANS_ITERATIONS, batch_size=KMEANS_BATCH_SIZE, seed=0):
+    """
+    Refine 'centers' with mini-batch k-means: each iteration samples
+    'batch_size' points by weight and moves their nearest centres towards
+    them with a per-centre decreasing learning rate.
+    """
+    rng = random.Random(seed)
+    centers = [list(center) for center in centers]
+    # Start with some inertia so the median-cut centres are not thrown away
+    counts = [batch_size / len(centers)] * len(centers)
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    for _ in range(iterations):
+        tree = KDTree(centers)
+        for point in rng.choices(points, cum_weights=cumulative, k=batch_size):
+            index, _ = tree.nearest(point)
+            counts[index] += 1
+            rate = 1 / counts[index]
+            center = centers[index]
+            for axis in range(3):
+                center[axis] += (point[axis] - center[axis]) * rate
+    return centers
+
+def _weighted_mean(box, points, weights):
+    total = sum(weights[i] for i in box)
+    return [sum(points[i][axis] * weights[i] for i in box) / total for axis in range(3)]
+
+def _representative(members, center, points):
+    """The member colour nearest to the cluster centre."""
+    return min(members, key=lambda i: sum((p - c) ** 2 for p, c in zip(points[i], center)))
+
+def reduce_colors(histogram, max_colors=256, method=METHOD_MEDIAN_CUT):
+    """
+    Reduce a {(r, g, b): weight} histogram to at most 'max_colors' colours.
+    Returns the colours sorted by lightness.
+    """
+    colors = list(histogram)
+    if max_colors <= 0 or not colors:
+        return []
+    points = [srgb_to_oklab(color) for color in colors]
+    if len(colors) <= max_colors:
+        chosen = range(len(colors))
+    else:
+        weights = [histogram[color] for color in colors]
+        boxes = median_cut(points, weights, max_colors)
+        centers = [_weighted_mean(box, points, weights) for box in boxes]
+        if method == METHOD_KMEANS:
+            centers = kmeans_refine(points, weights, centers)
+            # Final assignment of every colour to its nearest centre
+            tree = KDTree(centers)
+            clusters = [[] for _ in centers]
+            for i, point in enumerate(points):
+                clusters[tree.nearest(point)[0]].append(i)
+            boxes = clusters
+        elif method != METHOD_MEDIAN_CUT:
+            raise ValueError(f"Unknown palette reduction method: {method}")
+        chosen = {_representative(box, center, points) for box, center in zip(boxes, centers) if box}
+    return [colors[i] for i in sorted(chosen, key=lambda i: points[i])]
+
+def palette_image(colors, transparent=False):
+    """
+    Build an indexed palette image (one pixel per entry) from a list of
+    colours. With 'transparent', a last entry is reserved as transparency
+    index. It repeats the first colour, like
+    IndexPalette.reserve_transparency_slot, so quantizing (which prefers the
+    lowest index on ties) never turns opaque pixels transparent.
+    """
+    entries = list(colors)
+    if transparent:
+        entries.append(entries[0] if entries else (0, 0, 0))
+    if len(entries) > 256:
+        raise ValueError(f"A palette holds at most 256 colors, got {len(entries)}.")
+    image = Image.frombytes('P', (len(entries), 1), bytes(range(len(entries))))
+    image.putpalette([channel for color in entries for channel in color])
+    if transparent:
+        image.info['transparency'] = len(entries) - 1
+    return image
+
+def save_palette_image(image, path):
+    """Save a palette image as PNG or GIF (by extension), keeping its transparency index."""
+    if 'transparency' in image.info:
+        image.save(path, transparency=image.info['transparency'])
+    else:
+        image.save(path)
+
+def extract_palette(paths, max_colors=256, method=METHOD_MEDIAN_CUT, transparency=True):
+    """
+    Build a palette image for the images at 'paths'. Returns (image, errors).
+    A transparency index is reserved when 'transparency' is set and any image
+    has fully transparent pixels.
+    """
+    histogram, has_transparency, errors = pool_histograms(paths)
+    transparent = transparency and has_transparency
+    colors = reduce_colors(histogram, max_colors - 1 if transparent else max_colors, method)
+    return palette_image(colors, transparent), errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate an indexed palette of up to 256 colours from a set of sprites.")
+    parser.add_argument('directory', help="directory with the images (searched recursively)")
+    parser.add_argument('output', help="palette file to write (.png or .gif)")
+    parser.add_argument('--colors', type=int, default=256, help="maximum number of palette entries")
+    parser.add_argument('--method', choices=(METHOD_MEDIAN_CUT, METHOD_KMEANS), default=METHOD_MEDIAN_CUT)
+    parser.add_argument('--no-transparency', action='store_true', help="do not reserve a transparency index")
+    args = parser.parse_args(argv)
+    if not 1 <= args.colors <= 256:
+        parser.error("--colors must be between 1 and 256")
+
+    image, errors = extract_palette(list_image_files(args.directory), args.colors, args.method, not args.no_transparency)
+    for path, error in sorted(errors.items()):
+        print(f"Error reading {path}: {error}", file=sys.stderr)
+    save_palette_image(image, args.output)
+    print(f"Wrote {image.width} palette entries to {args.output}")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
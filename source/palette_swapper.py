@@ -1,8 +1,28 @@
 import os
+import queue
+import threading
+from launcher import handle_info_options
+
+if __name__ == "__main__":
+    # Answer --version / --help before loading Tk
+    handle_info_options('palette_swapper')
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, Label
 from tkinterdnd2 import DND_FILES, TkinterDnD
-from PIL import Image
+from preview import PreviewPane
+from batch_plan import plan_swap, load_plan, save_plan, plan_retry, execute_plan_pipelined, overwritten_outputs, show_plan_window
+from swap_engine import output_filename, load_palette, load_palette_with_transparency, swap_palette_image, encode_png, PaletteRemapper
+from atlas import AtlasWriter, check_fits
+from results import BatchReport, STATUS_FAILED, load_failed_sources
+from dedup import OutputDeduplicator, DEDUP_HARDLINK, DEDUP_SYMLINK, DEDUP_MANIFEST, MANIFEST_FILENAME
+from pipeline import write_file
+from reproducible import deterministic, HashRecorder, hashes_path, load_hashes, verify_plan
+from color_index import affected_sources
+
+# Labels of the choices for outputs identical to an earlier output of the batch
+DEDUP_CHOICES = {'Write every file': None, 'Hard link': DEDUP_HARDLINK,
+                 'Symbolic link': DEDUP_SYMLINK, 'List in manifest': DEDUP_MANIFEST}
 
 class PaletteReplacerApp:
     def __init__(self, root):
@@ -34,10 +54,42 @@ class PaletteReplacerApp:
         self.output_dir_entry.grid(row=4, column=1, sticky='we', padx=5)
         tk.Button(root, text='Browse', command=self.select_output_dir).grid(row=4, column=2, padx=5)
 
+        self.remap_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(root, text='Remap indices (new palette has the same colors in a different order)',
+                       variable=self.remap_var).grid(row=5, column=0, columnspan=3, sticky='w', padx=5)
+        self.atlas_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(root, text='Pack outputs into atlas sheets (with a JSON manifest)',
+                       variable=self.atlas_var).grid(row=5, column=3, sticky='w', padx=5)
+
+        dedup_frame = tk.Frame(root)
+        dedup_frame.grid(row=6, column=3, sticky='w', padx=5)
+        tk.Label(dedup_frame, text='Identical outputs:').pack(side='left')
+        self.dedup_var = tk.StringVar(value='Write every file')
+        tk.OptionMenu(dedup_frame, self.dedup_var, *DEDUP_CHOICES).pack(side='left')
+
         self.warning_label = Label(root, text="", fg='red')
-        self.warning_label.grid(row=5, column=0, columnspan=3)
+        self.warning_label.grid(row=6, column=0, columnspan=3)
+
+        self.apply_button = tk.Button(root, text='Apply Palette Swap', command=self.apply_palette_to_images)
+        self.apply_button.grid(row=7, column=0, columnspan=3, pady=10)
+        self.running = False
+        self.deterministic_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(root, text='Reproducible output (strip metadata, record hashes)',
+                       variable=self.deterministic_var).grid(row=7, column=3, sticky='w', padx=5)
+        tk.Button(root, text='Dry Run', command=self.dry_run).grid(row=8, column=0, pady=(0, 10))
+        tk.Button(root, text='Run Saved Plan...', command=self.run_saved_plan).grid(row=8, column=1, columnspan=2, pady=(0, 10))
+        tk.Button(root, text='Verify Outputs', command=self.verify_outputs).grid(row=8, column=3, pady=(0, 10))
 
-        tk.Button(root, text='Apply Palette Swap', command=self.apply_palette_to_images).grid(row=6, column=0, columnspan=3, pady=10)
+        # Preview of the selected sprites with the chosen palette
+        tk.Label(root, text='Preview:').grid(row=9, column=0, sticky='w', padx=5)
+        self.reswap_button = tk.Button(root, text='Re-swap Affected...', command=self.reswap_affected)
+        self.reswap_button.grid(row=9, column=3, pady=(0, 5))
+        tk.Button(root, text='Retry From Report...', command=self.retry_from_report).grid(row=9, column=1, columnspan=2, pady=(0, 5))
+        self.preview = PreviewPane(root)
+        self.preview_directory = None
+        self.preview.grid(row=10, column=0, columnspan=4, sticky='nsew', padx=5, pady=(0, 5))
+        root.grid_rowconfigure(10, weight=1)
+        root.grid_columnconfigure(1, weight=1)
 
         # Drag & Drop Setup
         self.images_dir_entry.drop_target_register(DND_FILES)
@@ -51,6 +103,10 @@ class PaletteReplacerApp:
 
         # Real-time warning update
         self.images_dir_entry.bind("<KeyRelease>", self.update_warning)
+        self.images_dir_entry.bind("<Return>", lambda event: self.update_preview_images())
+        self.images_dir_entry.bind("<FocusOut>", lambda event: self.update_preview_images())
+        self.palette_entry.bind("<Return>", lambda event: self.update_preview_palette())
+        self.palette_entry.bind("<FocusOut>", lambda event: self.update_preview_palette())
         self.prefix_entry.bind("<KeyRelease>", self.update_warning)
         self.suffix_entry.bind("<KeyRelease>", self.update_warning)
         self.output_dir_entry.bind("<KeyRelease>", self.update_warning)
@@ -70,6 +126,7 @@ class PaletteReplacerApp:
         if directory:
             self.images_dir_entry.delete(0, tk.END)
             self.images_dir_entry.insert(0, directory)
+            self.update_preview_images()
         self.update_warning()
 
     def select_palette_file(self):
@@ -77,6 +134,7 @@ class PaletteReplacerApp:
         if file_path:
             self.palette_entry.delete(0, tk.END)
             self.palette_entry.insert(0, file_path)
+            self.update_preview_palette()
     
     def select_output_dir(self):
         directory = filedialog.askdirectory()
@@ -91,6 +149,7 @@ class PaletteReplacerApp:
             if os.path.isdir(files[0]):
                 self.images_dir_entry.delete(0, tk.END)
                 self.images_dir_entry.insert(0, files[0])
+                self.update_preview_images()
         self.update_warning()
 
     def on_drop_palette(self, event):
@@ -99,6 +158,7 @@ class PaletteReplacerApp:
             if os.path.isfile(files[0]) and files[0].endswith('.png'):
                 self.palette_entry.delete(0, tk.END)
                 self.palette_entry.insert(0, files[0])
+                self.update_preview_palette()
 
     def on_drop_output_dir(self, event):
         if event.data:
@@ -108,6 +168,20 @@ class PaletteReplacerApp:
                 self.output_dir_entry.insert(0, files[0])
         self.update_warning()
 
+    def update_preview_images(self):
+        directory = self.images_dir_entry.get()
+        if directory != self.preview_directory:
+            self.preview_directory = directory
+            self.preview.set_directory(directory)
+
+    def update_preview_palette(self):
+        palette_path = self.palette_entry.get()
+        try:
+            palette = load_palette(palette_path) if os.path.isfile(palette_path) else None
+        except Exception:
+            palette = None
+        self.preview.set_palette(palette)
+
     def update_warning(self, event=None):
         directory = self.images_dir_entry.get()
         prefix = self.prefix_entry.get()
@@ -121,7 +195,7 @@ class PaletteReplacerApp:
         warning_text = ""
         for filename in os.listdir(directory):
             if filename.endswith('.png'):
-                new_filename = f"{prefix}{filename.replace('.png', '')}{suffix}.png"
+                new_filename = output_filename(filename, prefix, suffix)
                 output_path = os.path.join(output_directory, new_filename)
                 if os.path.exists(output_path):
                     warning_text = "Warning: Some files will be overwritten."
@@ -130,7 +204,8 @@ class PaletteReplacerApp:
         self.warning_label.config(text=warning_text)
         self.root.after(500, self.update_warning)  # Update warning every 500ms
 
-    def apply_palette_to_images(self):
+    def get_plan(self):
+        """Validate the form and return a swap plan for it, or None if invalid."""
         directory = self.images_dir_entry.get()
         palette_path = self.palette_entry.get()
         prefix = self.prefix_entry.get()
@@ -139,10 +214,24 @@ class PaletteReplacerApp:
 
         if not os.path.isdir(directory):
             messagebox.showerror("Error", "The specified image directory is invalid.")
-            return
+            return None
         
         if not os.path.isfile(palette_path):
             messagebox.showerror("Error", "The specified palette file is invalid.")
+            return None
+
+        return plan_swap(directory, palette_path, prefix, suffix, output_directory,
+                         self.remap_var.get(), self.atlas_var.get(), DEDUP_CHOICES[self.dedup_var.get()],
+                         self.deterministic_var.get())
+
+    def dry_run(self):
+        plan = self.get_plan()
+        if plan:
+            show_plan_window(self.root, plan)
+
+    def apply_palette_to_images(self):
+        plan = self.get_plan()
+        if not plan:
             return
         
         if self.warning_label.cget("text"):
@@ -150,27 +239,241 @@ class PaletteReplacerApp:
             if not confirm:
                 return
 
+        self.execute(plan)
+
+    def reswap_affected(self):
+        """Swap only the sprites whose pixels use palette entries that differ from a previous palette."""
+        plan = self.get_plan()
+        if not plan:
+            return
+        if plan['params'].get('remap') or plan['params'].get('atlas'):
+            messagebox.showerror("Error", "Only plain palette swaps to separate files can be limited to the affected sprites.")
+            return
+        old_palette = filedialog.askopenfilename(title="Previous palette", filetypes=[("PNG files", "*.png")])
+        if not old_palette:
+            return
+
+        # Updating the colour index decodes every new or changed sprite: keep the window responsive
+        results = queue.Queue()
+
+        def find_affected():
+            try:
+                # The swap only covers the top level of the directory, and so does the index update
+                results.put(affected_sources(plan['params']['directory'], old_palette, plan['params']['palette'],
+                                             recursive=False))
+            except Exception as e:
+                results.put(e)
+
+        threading.Thread(target=find_affected, daemon=True).start()
+        self.reswap_button.config(state="disabled")
+
+        def check():
+            try:
+                affected = results.get_nowait()
+            except queue.Empty:
+                self.root.after(100, check)
+                return
+            self.reswap_button.config(state="normal")
+            if isinstance(affected, Exception):
+                messagebox.showerror("Error", f"Could not find the affected sprites: {affected}")
+                return
+            self.reswap_plan(plan, affected)
+
+        self.root.after(100, check)
+
+    def reswap_plan(self, plan, affected):
+        """Limit a swap plan to the affected sources and execute it after confirmation."""
+        plan = plan_retry(plan, affected)
+        if not plan['entries']:
+            messagebox.showinfo("Nothing to do", "No sprite uses the palette entries that changed.")
+            return
+        if not messagebox.askyesno("Confirmation", f"{len(plan['entries'])} sprites use the changed palette entries. Swap them again?"):
+            return
+        self.execute(plan)
+
+    def retry_from_report(self):
+        """Swap again only the files that failed in a saved report."""
+        plan = self.get_plan()
+        if not plan:
+            return
+        report_path = filedialog.askopenfilename(title="Saved report", filetypes=[("Reports", "*.json")])
+        if not report_path:
+            return
         try:
-            new_palette_image = Image.open(palette_path)
-            if new_palette_image.mode != 'P':
-                messagebox.showerror("Error", "The palette image is not in indexed palette mode (P).")
+            failed = load_failed_sources(report_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not load the report: {e}")
+            return
+        plan = plan_retry(plan, failed)
+        if not plan['entries']:
+            messagebox.showinfo("Nothing to do", "None of the failed files of the report are part of this swap.")
+            return
+        if not messagebox.askyesno("Confirmation", f"{len(plan['entries'])} failed files will be swapped again. Continue?"):
+            return
+        self.execute(plan)
+
+    def run_saved_plan(self):
+        plan_path = filedialog.askopenfilename(filetypes=[("Plan files", "*.json")])
+        if not plan_path:
+            return
+        try:
+            plan = load_plan(plan_path, 'swap')
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not load the plan: {e}")
+            return
+
+        overwritten = overwritten_outputs(plan)
+        if overwritten:
+            confirm = messagebox.askyesno("Confirmation", f"{len(overwritten)} files will be overwritten. Do you want to continue?")
+            if not confirm:
+                return
+
+        self.execute(plan)
+
+    def execute(self, plan):
+        """Run a swap plan in a background thread, showing its progress, and report the outcome."""
+        if self.running:
+            messagebox.showinfo("Busy", "A palette swap is already running.")
+            return
+        params = plan['params']
+        report = BatchReport('swap')
+        total = len(plan['entries'])
+        # Finished files (None) and, last, the outcome of the batch, sent to the Tk thread
+        progress = queue.Queue()
+        atlas = None
+
+        def on_result(source, output, info, error):
+            if error is None and atlas is not None and info is not None:
+                atlas.add(atlas.sprite_name(output), info)
+            progress.put(None)
+
+        def run():
+            nonlocal atlas
+            deduplicator = None
+            recorder = None
+            try:
+                if params.get('remap'):
+                    swap_image = PaletteRemapper(*load_palette_with_transparency(params['palette'])).remap_data
+                else:
+                    new_palette = load_palette(params['palette'])
+                    swap_image = lambda data: swap_palette_image(data, new_palette)
+
+                if params.get('atlas'):
+                    # Swapped sprites are handed to the atlas instead of being written one by one
+                    atlas = AtlasWriter(params['output_directory'])
+                    transform = lambda data, source: (None, check_fits(swap_image(data)))
+                else:
+                    def transform(data, source):
+                        image = swap_image(data)
+                        return (encode_png(image) if image is not None else None), None
+                    if params.get('dedup'):
+                        deduplicator = OutputDeduplicator(
+                            params['dedup'], os.path.join(params['output_directory'], MANIFEST_FILENAME))
+
+                write_output = deduplicator.write if deduplicator else write_file
+                if params.get('deterministic') and atlas is None:
+                    transform = deterministic(transform)
+                    recorder = HashRecorder(hashes_path(plan), write_output)
+                    write_output = recorder.write
+                processed, changed, stats = execute_plan_pipelined(plan, transform, on_result, report=report,
+                                                                   write_output=write_output)
+                if atlas is not None:
+                    atlas.close()
+                if deduplicator is not None:
+                    deduplicator.close()
+                if recorder is not None:
+                    recorder.close()
+            except Exception as e:
+                progress.put(e)
                 return
-            new_palette = new_palette_image.getpalette()
-            
-            for filename in os.listdir(directory):
-                if filename.endswith('.png'):
-                    image_path = os.path.join(directory, filename)
-                    image = Image.open(image_path)
-                    if image.mode == 'P':
-                        image.putpalette(new_palette)
-                        new_filename = f"{prefix}{filename.replace('.png', '')}{suffix}.png"
-                        output_path = os.path.join(output_directory, new_filename)
-                        image.save(output_path)
-            messagebox.showinfo("Success", "Palette has been successfully applied to all images.")
+            progress.put((changed, stats, deduplicator, recorder))
+
+        threading.Thread(target=run, daemon=True).start()
+        self.running = True
+        self.apply_button.config(state="disabled")
+        done = 0
+
+        def check():
+            nonlocal done
+            outcome = None
+            try:
+                while outcome is None:
+                    item = progress.get_nowait()
+                    if item is None:
+                        done += 1
+                    else:
+                        outcome = item
+            except queue.Empty:
+                pass
+            if outcome is None:
+                self.apply_button.config(text=f"Swapping... {done}/{total}")
+                self.root.after(100, check)
+                return
+            self.running = False
+            self.apply_button.config(text="Apply Palette Swap", state="normal")
+            if isinstance(outcome, ValueError):
+                messagebox.showerror("Error", str(outcome))
+            elif isinstance(outcome, Exception):
+                messagebox.showerror("Error", f"An error occurred: {outcome}")
+            else:
+                self.show_outcome(plan, report, *outcome)
+
+        self.root.after(100, check)
+
+    def show_outcome(self, plan, report, changed, stats, deduplicator, recorder):
+        """Report the end of a swap: the failures if there were any, otherwise a summary."""
+        if report.by_status(STATUS_FAILED):
+            self.report_failures(plan, report)
+            return
+        message = "Palette has been successfully applied to all images."
+        if changed:
+            message += f"\n{len(changed)} files changed since the plan was made and were skipped."
+        if deduplicator is not None:
+            message += f"\n{deduplicator.summary()}."
+        if recorder is not None:
+            message += f"\nOutput hashes recorded in {recorder.path}."
+        message += f"\nStage utilization: {stats.summary()}"
+        messagebox.showinfo("Success", message)
+
+    def verify_outputs(self):
+        """Swap again without writing and compare every output with the hashes of a reproducible run."""
+        plan = self.get_plan()
+        if not plan:
+            return
+        try:
+            report, unchecked = verify_plan(plan, load_hashes(hashes_path(plan)))
+        except FileNotFoundError:
+            messagebox.showerror("Error", "No output hashes found. Run a reproducible swap into this output directory first.")
+            return
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {e}")
+            messagebox.showerror("Error", f"Could not verify the outputs: {e}")
+            return
+        if not report.failed_sources() and not unchecked:
+            messagebox.showinfo("Verified", f"All {report.totals()['ok']} outputs match their recorded hashes.")
+            return
+        message = report.summary(max_errors=10)
+        if unchecked:
+            message += f"\n{len(unchecked)} recorded outputs are no longer produced."
+        messagebox.showwarning("Outputs differ", message)
 
-if __name__ == "__main__":
+    def report_failures(self, plan, report):
+        """Show one summary of the failed files, save the full report and offer a plan to retry them."""
+        report_path = os.path.join(plan['params']['output_directory'], report.default_filename())
+        try:
+            report.save(report_path)
+            saved = f"The full report was saved to {report_path}."
+        except OSError as e:
+            saved = f"The full report could not be saved: {e}"
+        if messagebox.askyesno("Finished with errors",
+                               f"{report.summary(max_errors=10)}\n\n{saved}\n\nSave a plan to retry the failed files?"):
+            plan_file = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Plans", "*.json")])
+            if plan_file:
+                save_plan(plan_retry(plan, report.failed_sources()), plan_file)
+
+def main():
     root = TkinterDnD.Tk()
     app = PaletteReplacerApp(root)
     root.mainloop()
+
+if __name__ == "__main__":
+    main()
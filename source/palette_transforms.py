@@ -0,0 +1,178 @@
+import os
+import sys
+import colorsys
+import argparse
+
+from launcher import lazy_import
+Image = lazy_import('PIL.Image')
+
+from png_header import load_directory_index
+from swap_engine import output_filename, list_png_files, load_palette_with_transparency, swap_palette_variants
+from batch_plan import record_throughput, format_size
+from pipeline import run_pipeline
+from results import BatchReport
+
+# Palette variants computed from one base palette: hue rotation, brightness
+# ramps and colour cycling, applied to a range of palette entries. Every
+# variant only changes the 256 palette entries, never the pixels, so a set
+# of sprites is swapped into all the variants in one pass: each source is
+# read once and every variant is written by replacing the PLTE chunk of its
+# PNG, without decoding or compressing the image again.
+#
+# Usage: python palette_transforms.py BASE.png hue|brightness|cycle [--count 64]
+#            [--first 0] [--last 255] [--amount X] [--palettes-dir DIR]
+#            [--swap IMAGE_DIR [--output-directory DIR] [--prefix P] [--suffix S]]
+
+OPERATION_HUE = "hue"
+OPERATION_BRIGHTNESS = "brightness"
+OPERATION_CYCLE = "cycle"
+OPERATIONS = (OPERATION_HUE, OPERATION_BRIGHTNESS, OPERATION_CYCLE)
+
+# Default 'amount' of each operation: a full turn of the hue wheel, a ramp up
+# to white, and one entry per frame
+DEFAULT_AMOUNTS = {OPERATION_HUE: 360.0, OPERATION_BRIGHTNESS: 1.0, OPERATION_CYCLE: 1}
+
+def _entries(palette, first, last):
+    return range(first, min(last, len(palette) // 3 - 1) + 1)
+
+def rotate_hue(palette, degrees, first=0, last=255):
+    """Return a copy of a flat RGB palette with the hue of entries first..last rotated by 'degrees'."""
+    result = list(palette)
+    shift = degrees / 360
+    for i in _entries(palette, first, last):
+        r, g, b = (channel / 255 for channel in palette[i * 3:i * 3 + 3])
+        h, l, s = colorsys.rgb_to_hls(r, g, b)
+        result[i * 3:i * 3 + 3] = (round(channel * 255) for channel in colorsys.hls_to_rgb((h + shift) % 1, l, s))
+    return result
+
+def adjust_brightness(palette, amount, first=0, last=255):
+    """
+    Return a copy of a flat RGB palette with entries first..last brightened
+    towards white (amount > 0) or darkened towards black (amount < 0);
+    amount 1 gives white and -1 black.
+    """
+    amount = max(-1.0, min(1.0, amount))
+    if amount >= 0:
+        table = [round(c + (255 - c) * amount) for c in range(256)]
+    else:
+        table = [round(c * (1 + amount)) for c in range(256)]
+    result = list(palette)
+    for i in _entries(palette, first, last):
+        result[i * 3:i * 3 + 3] = (table[c] for c in palette[i * 3:i * 3 + 3])
+    return result
+
+def cycle_entries(palette, steps, first=0, last=255):
+    """Return a copy of a flat RGB palette with entries first..last rotated 'steps' places forward."""
+    entries = _entries(palette, first, last)
+    if not entries:
+        return list(palette)
+    colors = [palette[i * 3:i * 3 + 3] for i in entries]
+    steps %= len(colors)
+    colors = colors[-steps:] + colors[:-steps] if steps else colors
+    result = list(palette)
+    result[entries.start * 3:entries.stop * 3] = [channel for color in colors for channel in color]
+    return result
+
+def variant_palettes(palette, operation, count, first=0, last=255, amount=None):
+    """
+    Return 'count' variants of a flat RGB palette. Variant k applies the
+    fraction k / count of 'amount' for hue (degrees, so a full turn loops
+    back to the base), k / (count - 1) of it for brightness (a ramp from the
+    base to 'amount'), and k * amount steps for colour cycling.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown palette operation: {operation}")
+    amount = DEFAULT_AMOUNTS[operation] if amount is None else amount
+    variants = []
+    for k in range(count):
+        if operation == OPERATION_HUE:
+            variants.append(rotate_hue(palette, amount * k / count, first, last))
+        elif operation == OPERATION_BRIGHTNESS:
+            variants.append(adjust_brightness(palette, amount * k / max(count - 1, 1), first, last))
+        else:
+            variants.append(cycle_entries(palette, int(amount) * k, first, last))
+    return variants
+
+def save_palette(palette, path, transparency=None):
+    """Save a flat RGB palette as an indexed palette image with one pixel per entry."""
+    entries = len(palette) // 3
+    image = Image.frombytes('P', (entries, 1), bytes(range(entries)))
+    image.putpalette(palette)
+    if transparency is not None:
+        image.save(path, transparency=transparency)
+    else:
+        image.save(path)
+
+def variant_suffixes(suffix, count):
+    """Suffix of each variant's outputs, e.g. '_variant_07'."""
+    width = len(str(count - 1))
+    return [f"{suffix}_{k:0{width}d}" for k in range(count)]
+
+def swap_variants(directory, palettes, output_directory, prefix="", suffix="_variant", **pipeline_options):
+    """
+    Swap every indexed PNG in 'directory' into each of 'palettes' in one
+    pass, naming the outputs with variant_suffixes. Returns the BatchReport.
+    """
+    suffixes = variant_suffixes(suffix, len(palettes))
+    indexed = load_directory_index(directory).query(mode='P')
+    items = []
+    for filename in sorted(set(list_png_files(directory)) & set(indexed)):
+        outputs = [os.path.join(output_directory, output_filename(filename, prefix, variant_suffix))
+                   for variant_suffix in suffixes]
+        items.append((os.path.join(directory, filename), outputs))
+    report = BatchReport('palette_variants')
+    stats = run_pipeline(items, lambda data, source: (swap_palette_variants(data, palettes), None),
+                         report=report, **pipeline_options)
+    report.finish()
+    totals = report.totals()
+    record_throughput('palette_variants', totals['bytes_read'] + totals['bytes_written'], stats.wall_seconds)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate palette variants of a base palette and optionally swap sprites into all of them.")
+    parser.add_argument('palette', help="base palette (indexed PNG)")
+    parser.add_argument('operation', choices=OPERATIONS)
+    parser.add_argument('--count', type=int, default=8, help="number of variants (frames)")
+    parser.add_argument('--first', type=int, default=0, help="first palette entry to change")
+    parser.add_argument('--last', type=int, default=255, help="last palette entry to change")
+    parser.add_argument('--amount', type=float,
+                        help="hue: total degrees (360); brightness: final amount from -1 to 1 (1); cycle: entries per frame (1)")
+    parser.add_argument('--palettes-dir', help="write every variant palette to this directory")
+    parser.add_argument('--swap', metavar='IMAGE_DIR', help="swap the indexed PNGs of this directory into every variant")
+    parser.add_argument('--output-directory', help="where the swapped sprites go (defaults to IMAGE_DIR)")
+    parser.add_argument('--prefix', default="")
+    parser.add_argument('--suffix', default="_variant")
+    args = parser.parse_args(argv)
+    if args.count < 1:
+        parser.error("--count must be at least 1")
+    if not (args.palettes_dir or args.swap):
+        parser.error("nothing to do: give --palettes-dir and/or --swap")
+
+    try:
+        base, transparency = load_palette_with_transparency(args.palette)
+    except (OSError, ValueError) as e:
+        print(f"Invalid palette: {e}", file=sys.stderr)
+        return 2
+    palettes = variant_palettes(base, args.operation, args.count, args.first, args.last, args.amount)
+
+    if args.palettes_dir:
+        os.makedirs(args.palettes_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(args.palette))[0]
+        for variant_suffix, palette in zip(variant_suffixes(args.suffix, len(palettes)), palettes):
+            save_palette(palette, os.path.join(args.palettes_dir, f"{name}{variant_suffix}.png"), transparency)
+        print(f"Wrote {len(palettes)} palettes to {args.palettes_dir}")
+
+    if args.swap:
+        output_directory = args.output_directory or args.swap
+        os.makedirs(output_directory, exist_ok=True)
+        report = swap_variants(args.swap, palettes, output_directory, args.prefix, args.suffix)
+        totals = report.totals()
+        print(f"{totals['ok']} sprites x {len(palettes)} variants written "
+              f"({format_size(totals['bytes_written'])}) in {report.wall_seconds:.2f} s")
+        if totals['failed']:
+            print(report.summary(), file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import os
+import stat
+import time
+import queue
+import threading
+
+from results import FileResult
+
+# Staged batch pipeline: file bytes are read ahead by a pool of reader
+# threads, decoded/transformed/encoded by a CPU pool and written behind by
+# writer threads. The stages are connected by bounded queues so slow disks
+# (e.g. network shares) and the CPU work overlap instead of alternating.
+# Pillow releases the GIL while decoding and encoding, so threads are enough
+# to keep several cores busy.
+
+_DONE = object()
+
+DEFAULT_READ_WORKERS = 4
+DEFAULT_WRITE_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 32
+
+def write_file(output, data):
+    """Write 'data' to 'output'; returns the number of bytes written."""
+    try:
+        st = os.lstat(output)
+    except FileNotFoundError:
+        pass
+    else:
+        # Outputs deduplicated by an earlier run may be links: writing through
+        # them would also change the files they share their content with
+        if stat.S_ISLNK(st.st_mode) or st.st_nlink > 1:
+            os.remove(output)
+    with open(output, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+class PipelineStats:
+    """Busy time per stage, used to report how well each stage was utilized."""
+    STAGES = ('read', 'transform', 'write')
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.busy = {stage: 0.0 for stage in self.STAGES}
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.busy[stage] += seconds
+
+    def utilization(self, stage):
+        """Fraction of the run during which the workers of 'stage' were busy."""
+        capacity = self.wall_seconds * self.workers[stage]
+        return self.busy[stage] / capacity if capacity else 0.0
+
+    def summary(self):
+        return ", ".join(
+            f"{stage}: {self.utilization(stage):.0%} of {self.workers[stage]} workers"
+            for stage in self.STAGES
+        )
+
+def run_pipeline(items, transform, on_result=None, read_workers=DEFAULT_READ_WORKERS,
+                 cpu_workers=None, write_workers=DEFAULT_WRITE_WORKERS,
+                 queue_depth=DEFAULT_QUEUE_DEPTH, report=None, write_output=write_file):
+    """
+    Process (source, output) pairs through the read, transform and write stages.
+
+    transform(data, source) receives the bytes of the source file and returns
+    (output_bytes, info); output_bytes may be None to skip writing. An output
+    may also be a list of paths, one source giving several files: transform
+    then returns a list of bytes, one per path. If given,
+    on_result(source, output, info, error) is called on the calling thread as
+    each file finishes, so it may safely update a GUI. Errors are reported
+    per file and never stop the batch; if a BatchReport is given, a
+    FileResult is added to it for every file. write_output(output, data)
+    writes one output and returns the bytes actually written, e.g. a
+    dedup.OutputDeduplicator's write. At most 'queue_depth' items wait
+    between two stages, including finished results waiting for on_result.
+    If on_result raises, the workers stop taking new files and the exception
+    is raised once they have all exited. Returns the PipelineStats.
+    """
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+    stats = PipelineStats({'read': read_workers, 'transform': cpu_workers, 'write': write_workers})
+    pending = queue.Queue()
+    read_queue = queue.Queue(maxsize=queue_depth)
+    write_queue = queue.Queue(maxsize=queue_depth)
+    # Bounded too: when on_result is slower than the workers (e.g. a serial
+    # aggregation of large per-file infos), the stages wait instead of
+    # piling results up in memory
+    results = queue.Queue(maxsize=queue_depth)
+    # Set when the batch is abandoned: the workers then drop their jobs
+    # until the stages are shut down
+    stop = threading.Event()
+    for item in items:
+        pending.put(item)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                source, output = pending.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            try:
+                with open(source, 'rb') as f:
+                    data = f.read()
+            except Exception as e:
+                seconds = time.perf_counter() - start
+                results.put((source, output, None, e, FileResult.failure(source, output, e, seconds)))
+                continue
+            finally:
+                stats.add('read', time.perf_counter() - start)
+            read_queue.put((source, output, data, time.perf_counter() - start))
+
+    def transformer():
+        while True:
+            job = read_queue.get()
+            if job is _DONE:
+                return
+            if stop.is_set():
+                continue
+            source, output, data, seconds = job
+            start = time.perf_counter()
+            try:
+                output_bytes, info = transform(data, source)
+            except Exception as e:
+                seconds += time.perf_counter() - start
+                results.put((source, output, None, e, FileResult.failure(source, output, e, seconds, len(data))))
+                continue
+            finally:
+                stats.add('transform', time.perf_counter() - start)
+            seconds += time.perf_counter() - start
+            write_queue.put((source, output, output_bytes, info, seconds, len(data)))
+
+    def writer():
+        while True:
+            job = write_queue.get()
+            if job is _DONE:
+                return
+            if stop.is_set():
+                continue
+            source, output, output_bytes, info, seconds, bytes_read = job
+            start = time.perf_counter()
+            try:
+                if output_bytes is None:
+                    written = 0
+                elif isinstance(output, (list, tuple)):
+                    written = sum(write_output(path, data) for path, data in zip(output, output_bytes))
+                else:
+                    written = write_output(output, output_bytes)
+                seconds += time.perf_counter() - start
+                results.put((source, output, info, None,
+                             FileResult(source, output, seconds=seconds, bytes_read=bytes_read, bytes_written=written)))
+            except Exception as e:
+                seconds += time.perf_counter() - start
+                results.put((source, output, info, e, FileResult.failure(source, output, e, seconds, bytes_read)))
+            finally:
+                stats.add('write', time.perf_counter() - start)
+
+    def start(target, count):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def shutdown():
+        # Each stage is told to stop once every worker of the previous one is done
+        for thread in readers:
+            thread.join()
+        for _ in transformers:
+            read_queue.put(_DONE)
+        for thread in transformers:
+            thread.join()
+        for _ in writers:
+            write_queue.put(_DONE)
+        for thread in writers:
+            thread.join()
+        results.put(_DONE)
+
+    wall_start = time.perf_counter()
+    readers = start(reader, read_workers)
+    transformers = start(transformer, cpu_workers)
+    writers = start(writer, write_workers)
+    threading.Thread(target=shutdown, daemon=True).start()
+
+    finished = False
+    try:
+        while True:
+            result = results.get()
+            if result is _DONE:
+                finished = True
+                break
+            if report is not None:
+                report.add(result[4])
+            if on_result:
+                on_result(*result[:4])
+    finally:
+        if not finished:
+            # Drain the results so no worker stays blocked on a full queue
+            stop.set()
+            while results.get() is not _DONE:
+                pass
+    stats.wall_seconds = time.perf_counter() - wall_start
+    return stats
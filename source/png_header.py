@@ -0,0 +1,199 @@
+import os
+import json
+import zlib
+import hashlib
+import struct
+
+# Header-only PNG reader: parses the chunks that precede the image data so
+# that tools can classify files without decoding any pixels.
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG colour type -> Pillow mode (for 8-bit samples)
+COLOR_TYPE_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+
+def read_png_header(path):
+    """
+    Read the IHDR, PLTE and tRNS chunks of a PNG file.
+    Returns a dict with width, height, bit_depth, color_type, mode,
+    palette_size and has_trns, or None if the file is not a PNG.
+    """
+    with open(path, 'rb') as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None
+        header = None
+        palette_size = 0
+        has_trns = False
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', chunk_header)
+            if chunk_type == b'IHDR':
+                width, height, bit_depth, color_type = struct.unpack('>IIBB', f.read(10))
+                header = {
+                    'width': width,
+                    'height': height,
+                    'bit_depth': bit_depth,
+                    'color_type': color_type,
+                    'mode': COLOR_TYPE_MODES.get(color_type),
+                }
+                f.seek(length - 10 + 4, 1)
+            elif chunk_type == b'PLTE':
+                palette_size = length // 3
+                f.seek(length + 4, 1)
+            elif chunk_type == b'tRNS':
+                has_trns = True
+                f.seek(length + 4, 1)
+            elif chunk_type in (b'IDAT', b'IEND'):
+                # Everything we need comes before the image data
+                break
+            else:
+                f.seek(length + 4, 1)
+    if header is None:
+        return None
+    header['palette_size'] = palette_size
+    header['has_trns'] = has_trns
+    return header
+
+def iter_chunks(data):
+    """Yield (chunk_type, start, end) for the chunks of PNG bytes; start and end span length, type, data and CRC."""
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, offset)
+        end = offset + 12 + length
+        yield chunk_type, offset, end
+        if chunk_type == b'IEND':
+            return
+        offset = end
+
+def replace_palette(data, palette):
+    """
+    Return the bytes of an indexed PNG with its PLTE chunk replaced by the
+    entries of 'palette' (a flat RGB list such as Image.getpalette()), keeping
+    the entry count of the original. The image data is copied untouched, so
+    no pixel is decoded or compressed again. Returns None if the PNG is not
+    indexed.
+    """
+    if data[:8] != PNG_SIGNATURE:
+        return None
+    for chunk_type, start, end in iter_chunks(data):
+        if chunk_type == b'IHDR' and data[start + 17] != 3:
+            return None
+        if chunk_type == b'PLTE':
+            size = end - start - 12
+            entries = bytes(palette[:size]).ljust(size, b'\0')
+            chunk = b'PLTE' + entries
+            return (data[:start] + struct.pack('>I', size) + chunk
+                    + struct.pack('>I', zlib.crc32(chunk)) + data[end:])
+    return None
+
+# --- Directory Index ---
+
+# Persistent per-directory cache of PNG headers, keyed by file name and
+# validated against size and modification time. Once warm, classifying a
+# directory only costs a directory listing. The caches live in the user's
+# cache directory, one file per image directory, so planning or previewing
+# never writes anything into the asset folders.
+
+INDEX_VERSION = 2
+
+def index_cache_directory():
+    """Where the header indexes are kept (e.g. ~/.cache/PaletteSwapper/png_index)."""
+    base = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'PaletteSwapper', 'png_index')
+
+def index_path(directory):
+    """Cache file of the header index of 'directory'."""
+    key = os.path.normcase(os.path.abspath(directory))
+    return os.path.join(index_cache_directory(), hashlib.sha1(key.encode('utf-8')).hexdigest() + ".json")
+HEADER_FIELDS = ('width', 'height', 'bit_depth', 'color_type', 'palette_size', 'has_trns')
+
+class PngIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = index_path(directory)
+        self.files = {}
+        self.modified = False
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            # The directory is stored too, in case two directories ever share a cache file
+            if data.get('version') == INDEX_VERSION and data.get('directory') == os.path.abspath(directory):
+                self.files = data['files']
+        except Exception:
+            self.files = {}
+
+    def refresh(self):
+        """Re-read the headers of new or changed PNG files and forget removed ones."""
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith('.png') or not entry.is_file():
+                    continue
+                st = entry.stat()
+                record = self.files.get(entry.name)
+                if record is None or record[0] != st.st_size or record[1] != st.st_mtime_ns:
+                    try:
+                        header = read_png_header(entry.path)
+                    except OSError:
+                        header = None
+                    fields = [header[field] for field in HEADER_FIELDS] if header else None
+                    record = [st.st_size, st.st_mtime_ns, fields]
+                    self.modified = True
+                current[entry.name] = record
+        if len(current) != len(self.files):
+            self.modified = True
+        self.files = current
+        return self
+
+    def save(self):
+        """Write the index to the cache directory; if it cannot be written the index is just not cached."""
+        if not self.modified:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump({'version': INDEX_VERSION, 'directory': os.path.abspath(self.directory), 'files': self.files},
+                          f, separators=(',', ':'))
+            self.modified = False
+        except OSError:
+            pass
+
+    def header(self, name):
+        """Return the header dict of an indexed file, or None if it is not a valid PNG."""
+        record = self.files.get(name)
+        if record is None or record[2] is None:
+            return None
+        header = dict(zip(HEADER_FIELDS, record[2]))
+        header['mode'] = COLOR_TYPE_MODES.get(header['color_type'])
+        return header
+
+    def query(self, mode=None, max_colors=None, has_trns=None):
+        """
+        Return the names of the files matching every given criterion, e.g.
+        query(mode='P', max_colors=16, has_trns=True) for indexed images with
+        at most 16 palette entries and a transparency chunk.
+        """
+        color_type = None
+        if mode is not None:
+            color_type = next((ct for ct, m in COLOR_TYPE_MODES.items() if m == mode), -1)
+        names = []
+        for name, (_, _, fields) in self.files.items():
+            if fields is None:
+                continue
+            if color_type is not None and fields[3] != color_type:
+                continue
+            if max_colors is not None and fields[4] > max_colors:
+                continue
+            if has_trns is not None and fields[5] != has_trns:
+                continue
+            names.append(name)
+        return names
+
+def load_directory_index(directory):
+    """Return an up-to-date PngIndex for 'directory', saving it if anything changed."""
+    index = PngIndex(directory).refresh()
+    index.save()
+    return index
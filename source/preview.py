@@ -0,0 +1,126 @@
+import os
+import tkinter as tk
+from launcher import lazy_import
+Image = lazy_import('PIL.Image')
+ImageTk = lazy_import('PIL.ImageTk')
+
+from png_header import load_directory_index
+
+# Preview pane for the palette swapper. Every sprite is decoded once into a
+# small indexed thumbnail (cached until its file changes); applying another
+# palette only replaces the 256 palette entries of the cached thumbnails.
+# Only the tiles currently scrolled into view are turned into Tk images,
+# so folders with thousands of sprites stay responsive.
+
+THUMBNAIL_SIZE = 64
+TILE_PADDING = 6
+TILE_SIZE = THUMBNAIL_SIZE + TILE_PADDING
+
+class ThumbnailCache:
+    """Indexed thumbnails keyed by path and validated by modification time."""
+
+    def __init__(self):
+        self.thumbnails = {}
+
+    def get(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.thumbnails.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with Image.open(path) as image:
+            image.load()
+            width, height = image.size
+            if max(width, height) > THUMBNAIL_SIZE:
+                thumbnail = image.copy()
+                # NEAREST keeps the thumbnail indexed (and the pixel art crisp)
+                thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.NEAREST)
+            else:
+                factor = THUMBNAIL_SIZE // max(width, height, 1)
+                thumbnail = image.resize((width * factor, height * factor), Image.NEAREST)
+        self.thumbnails[path] = (mtime, thumbnail)
+        return thumbnail
+
+class PreviewPane(tk.Frame):
+    """Scrollable grid of sprite thumbnails with a palette applied."""
+
+    def __init__(self, master, height=220, **kwargs):
+        super().__init__(master, **kwargs)
+        self.canvas = tk.Canvas(self, height=height, background='#808080', highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self, orient='vertical', command=self.on_scroll)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+        self.canvas.bind('<Configure>', lambda event: self.layout())
+        self.canvas.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.canvas.bind('<Button-4>', lambda event: self.on_scroll('scroll', -1, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.on_scroll('scroll', 1, 'units'))
+
+        self.cache = ThumbnailCache()
+        self.paths = []
+        self.palette = None
+        self.columns = 1
+        # tile number -> (canvas item, PhotoImage); Tk needs the PhotoImage kept alive
+        self.visible = {}
+
+    def set_directory(self, directory):
+        """Show the indexed PNG files of 'directory'."""
+        if os.path.isdir(directory):
+            names = load_directory_index(directory).query(mode='P')
+            self.paths = [os.path.join(directory, name) for name in sorted(names)]
+        else:
+            self.paths = []
+        self.canvas.yview_moveto(0)
+        self.layout()
+
+    def set_palette(self, palette):
+        """Re-render the visible tiles with another palette (None shows the originals)."""
+        self.palette = palette
+        self.clear()
+        self.render_visible()
+
+    def clear(self):
+        for item, _ in self.visible.values():
+            self.canvas.delete(item)
+        self.visible = {}
+
+    def layout(self):
+        width = max(self.canvas.winfo_width(), TILE_SIZE)
+        self.columns = max(1, width // TILE_SIZE)
+        rows = -(-len(self.paths) // self.columns)
+        self.canvas.configure(scrollregion=(0, 0, self.columns * TILE_SIZE, rows * TILE_SIZE))
+        self.clear()
+        self.render_visible()
+
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.render_visible()
+
+    def on_mouse_wheel(self, event):
+        self.on_scroll('scroll', -1 if event.delta > 0 else 1, 'units')
+
+    def render_visible(self):
+        """Create the tiles in view and drop the ones scrolled out of it."""
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = int(top // TILE_SIZE) * self.columns
+        last = min(len(self.paths), (int(bottom // TILE_SIZE) + 1) * self.columns)
+        wanted = range(first, last)
+
+        for number in [n for n in self.visible if n not in wanted]:
+            self.canvas.delete(self.visible.pop(number)[0])
+        for number in wanted:
+            if number not in self.visible:
+                self.render_tile(number)
+
+    def render_tile(self, number):
+        try:
+            tile = self.cache.get(self.paths[number]).copy()
+        except Exception:
+            return
+        if self.palette is not None:
+            tile.putpalette(self.palette)
+        photo = ImageTk.PhotoImage(tile.convert('RGBA'))
+        row, column = divmod(number, self.columns)
+        item = self.canvas.create_image(
+            column * TILE_SIZE + TILE_SIZE // 2, row * TILE_SIZE + TILE_SIZE // 2, image=photo)
+        self.visible[number] = (item, photo)
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+
+from png_header import PNG_SIGNATURE, iter_chunks
+from pipeline import run_pipeline, write_file
+from batch_plan import load_plan
+from swap_engine import load_palette, load_palette_with_transparency, swap_palette_bytes, PaletteRemapper
+from index_engine import load_index_palette, convert_image_bytes
+from results import BatchReport
+
+# Reproducible batch outputs. In deterministic mode the PNG outputs keep the
+# chunk order of the encoder but lose the chunks that change from run to run
+# (timestamps, text and EXIF metadata), so the same sources, palette and
+# options give byte-identical files, and the SHA-256 of every output is
+# recorded in output_hashes.json. A batch can later be verified: it is run
+# again without writing anything, and each output is compared with its
+# recorded hash on the writer threads of the pipeline. This is much faster
+# than rebuilding to a scratch directory and diffing. Outputs are only
+# byte-stable for the same Pillow and zlib versions.
+#
+# Usage: python reproducible.py verify PLAN.json [--hashes output_hashes.json]
+
+VOLATILE_CHUNKS = (b'tIME', b'tEXt', b'zTXt', b'iTXt', b'eXIf')
+HASHES_FILENAME = "output_hashes.json"
+HASHES_VERSION = 1
+
+def strip_volatile_chunks(data):
+    """Return PNG bytes without the chunks that vary between runs; other data is returned unchanged."""
+    if data[:8] != PNG_SIGNATURE:
+        return data
+    parts = [PNG_SIGNATURE]
+    for chunk_type, start, end in iter_chunks(data):
+        if chunk_type not in VOLATILE_CHUNKS:
+            parts.append(data[start:end])
+    return b''.join(parts)
+
+def deterministic(transform):
+    """Wrap a pipeline transform so the PNG bytes it returns are stripped of volatile chunks."""
+    def stripped(data, source):
+        output_bytes, info = transform(data, source)
+        if isinstance(output_bytes, list):
+            output_bytes = [strip_volatile_chunks(output) for output in output_bytes]
+        elif output_bytes is not None:
+            output_bytes = strip_volatile_chunks(output_bytes)
+        return output_bytes, info
+    return stripped
+
+def output_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hashes_path(plan):
+    """Where the hashes of a swap or convert_to_index plan's outputs are recorded."""
+    params = plan['params']
+    return os.path.join(params.get('output_directory') or params['folder'], HASHES_FILENAME)
+
+class HashRecorder:
+    """
+    Pipeline writer that writes each output with 'write' and records its
+    hash; close() saves the hashes, keyed by path relative to the file.
+    """
+
+    def __init__(self, path, write=write_file):
+        self.path = path
+        self._write = write
+        self.hashes = {}
+        self._lock = threading.Lock()
+
+    def write(self, output, data):
+        written = self._write(output, data)
+        digest = output_hash(data)
+        with self._lock:
+            self.hashes[os.path.abspath(output)] = digest
+        return written
+
+    def close(self):
+        base = os.path.dirname(os.path.abspath(self.path))
+        recorded = {}
+        # Keep the hashes of outputs not produced this time (e.g. a retry of failed files)
+        if os.path.exists(self.path):
+            recorded = load_hashes(self.path)
+        recorded.update(self.hashes)
+        data = {
+            'version': HASHES_VERSION,
+            'algorithm': 'sha256',
+            'files': {os.path.relpath(path, base).replace(os.sep, '/'): digest
+                      for path, digest in sorted(recorded.items())},
+        }
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        return self.path
+
+def load_hashes(path):
+    """Return {absolute output path: sha256} of a hashes file."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get('version') != HASHES_VERSION:
+        raise ValueError("The file is not an output hashes file.")
+    base = os.path.dirname(os.path.abspath(path))
+    return {os.path.normpath(os.path.join(base, name)): digest for name, digest in data['files'].items()}
+
+class OutputMismatch(Exception):
+    """An output of a verified batch differs from its recorded hash."""
+
+class HashVerifier:
+    """
+    Pipeline writer that writes nothing: it compares each output with its
+    recorded hash and raises OutputMismatch, so differences show up as failed
+    files in the BatchReport.
+    """
+
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.checked = set()
+        self._lock = threading.Lock()
+
+    def write(self, output, data):
+        path = os.path.abspath(output)
+        with self._lock:
+            self.checked.add(path)
+        expected = self.hashes.get(path)
+        if expected is None:
+            raise OutputMismatch("no hash was recorded for this output")
+        if output_hash(data) != expected:
+            raise OutputMismatch("the output differs from the recorded one")
+        return 0
+
+def plan_transform(plan):
+    """Build the deterministic pipeline transform of a swap or convert_to_index plan."""
+    params = plan['params']
+    if params.get('atlas'):
+        raise ValueError("Atlas outputs are not verified file by file.")
+    if plan['tool'] == 'swap':
+        if params.get('remap'):
+            remapper = PaletteRemapper(*load_palette_with_transparency(params['palette']))
+            return deterministic(lambda data, source: (remapper.remap_bytes(data), None))
+        palette = load_palette(params['palette'])
+        return deterministic(lambda data, source: (swap_palette_bytes(data, palette), None))
+    if plan['tool'] == 'convert_to_index':
+        palette = load_index_palette(params['palette'])
+        if params.get('reserve_transparency') and palette.trans_idx is None:
+            palette.reserve_transparency_slot()
+        return deterministic(lambda data, source: convert_image_bytes(data, palette, params['dither']))
+    raise ValueError(f"Plans of {plan['tool']} cannot be verified.")
+
+def verify_plan(plan, hashes, **pipeline_options):
+    """
+    Run a plan again without writing, checking every output against 'hashes'
+    ({path: sha256}). Returns (report, unchecked) where the report's failures
+    are the mismatches and 'unchecked' lists the planned outputs with a
+    recorded hash that the batch no longer produces.
+    """
+    verifier = HashVerifier(hashes)
+    planned = {os.path.abspath(entry['output']) for entry in plan['entries']}
+    report = BatchReport(f"verify_{plan['tool']}")
+    # Sources are verified as they are now, even if they changed since planned
+    run_pipeline([(entry['source'], entry['output']) for entry in plan['entries']], plan_transform(plan),
+                 report=report, write_output=verifier.write, **pipeline_options)
+    report.finish()
+    return report, sorted(planned & set(hashes) - verifier.checked)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the outputs of a saved plan against their recorded hashes.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    verify = commands.add_parser('verify', help="re-run a plan without writing and compare every output")
+    verify.add_argument('plan')
+    verify.add_argument('--hashes', help=f"hashes file (defaults to {HASHES_FILENAME} in the output folder)")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.plan, "r", encoding="utf-8") as f:
+            tool = json.load(f).get('tool')
+        plan = load_plan(args.plan, tool)
+        hashes = load_hashes(args.hashes or hashes_path(plan))
+        report, unchecked = verify_plan(plan, hashes)
+    except (OSError, ValueError) as e:
+        print(f"Cannot verify: {e}", file=sys.stderr)
+        return 2
+    print(report.summary())
+    for path in unchecked:
+        print(f"Not produced: {path}")
+    return 1 if report.failed_sources() or unchecked else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
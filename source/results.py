@@ -0,0 +1,119 @@
+import json
+import time
+from datetime import datetime
+
+# Structured per-file results shared by the batch engines. Every file of a
+# batch ends as one FileResult, whether it succeeded or not, so a failure
+# never stops the batch. A BatchReport aggregates them into a text summary
+# for people and a JSON summary for tools; the JSON lists the failed sources
+# so they can be retried in bulk.
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+# Not processed on purpose, e.g. the source changed since the plan was made
+STATUS_SKIPPED = "skipped"
+
+REPORT_VERSION = 1
+
+class FileResult:
+    """Outcome of processing one file."""
+    __slots__ = ('source', 'output', 'status', 'seconds', 'bytes_read', 'bytes_written', 'error_class', 'error')
+
+    def __init__(self, source, output=None, status=STATUS_OK, seconds=0.0, bytes_read=0, bytes_written=0,
+                 error_class=None, error=None):
+        self.source = source
+        self.output = output
+        self.status = status
+        self.seconds = seconds
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.error_class = error_class
+        self.error = error
+
+    @classmethod
+    def failure(cls, source, output, exception, seconds=0.0, bytes_read=0):
+        return cls(source, output, STATUS_FAILED, seconds, bytes_read, 0, type(exception).__name__, str(exception))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class BatchReport:
+    """The FileResults of one batch, with aggregation helpers."""
+
+    def __init__(self, tool):
+        self.tool = tool
+        self.results = []
+        self.started = datetime.now()
+        self._start = time.perf_counter()
+        self.wall_seconds = 0.0
+
+    def add(self, result):
+        self.results.append(result)
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def by_status(self, status):
+        return [result for result in self.results if result.status == status]
+
+    def failed_sources(self):
+        return [result.source for result in self.by_status(STATUS_FAILED)]
+
+    def error_counts(self):
+        """Number of failures per error class."""
+        counts = {}
+        for result in self.by_status(STATUS_FAILED):
+            counts[result.error_class] = counts.get(result.error_class, 0) + 1
+        return counts
+
+    def totals(self):
+        return {
+            'files': len(self.results),
+            'ok': len(self.by_status(STATUS_OK)),
+            'failed': len(self.by_status(STATUS_FAILED)),
+            'skipped': len(self.by_status(STATUS_SKIPPED)),
+            'bytes_read': sum(result.bytes_read for result in self.results),
+            'bytes_written': sum(result.bytes_written for result in self.results),
+            'busy_seconds': sum(result.seconds for result in self.results),
+            'wall_seconds': self.wall_seconds,
+        }
+
+    def summary(self, max_errors=20):
+        """Short text summary: counts, failures per error class and the first failed files."""
+        totals = self.totals()
+        lines = [f"{totals['ok']} of {totals['files']} files processed, {totals['failed']} failed, "
+                 f"{totals['skipped']} skipped."]
+        for error_class, count in sorted(self.error_counts().items(), key=lambda item: -item[1]):
+            lines.append(f"{error_class}: {count}")
+        failed = self.by_status(STATUS_FAILED)
+        for result in failed[:max_errors]:
+            lines.append(f"{result.source}: {result.error}")
+        if len(failed) > max_errors:
+            lines.append(f"... and {len(failed) - max_errors} more")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            'version': REPORT_VERSION,
+            'tool': self.tool,
+            'started': self.started.isoformat(timespec='seconds'),
+            'totals': self.totals(),
+            'errors': self.error_counts(),
+            'failed': self.failed_sources(),
+            'results': [result.to_dict() for result in self.results],
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def default_filename(self):
+        return f"{self.tool}_report_{self.started.strftime('%Y%m%d_%H%M%S')}.json"
+
+def load_failed_sources(path):
+    """Return the failed sources listed in a saved report."""
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if report.get('version') != REPORT_VERSION:
+        raise ValueError("The file is not a batch report.")
+    return report['failed']
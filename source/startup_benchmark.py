@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+from launcher import TOOLS
+
+# Measures the cold start of the GUI tools. For every tool it times, in
+# fresh processes, the '--version' path and the import of the tool module
+# (everything done before the window is created, without the Tk main loop),
+# and reports whether the import loaded Pillow. With --executable it times
+# '--version' of built executables instead, e.g. to compare the one-file and
+# one-folder PyInstaller builds.
+#
+# Usage: python startup_benchmark.py [--runs 10] [--tool NAME]
+#        python startup_benchmark.py --executable dist/palette_swapper/palette_swapper.exe
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+WIP_DIRECTORY = os.path.join(SOURCE_DIRECTORY, os.pardir, "WIP")
+
+# Run in a fresh interpreter: prints the import time and whether Pillow was loaded
+_IMPORT_PROBE = """
+import sys, time
+sys.path[:0] = [{source!r}, {wip!r}]
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, 'PIL.Image' in sys.modules)
+"""
+
+def script_path(tool):
+    module = TOOLS[tool][0]
+    for directory in (SOURCE_DIRECTORY, WIP_DIRECTORY):
+        path = os.path.join(directory, module + ".py")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No script found for {tool}")
+
+def time_command(command, runs):
+    """Median wall time in seconds of running 'command' 'runs' times."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def time_import(tool, runs):
+    """Return (median import seconds, Pillow loaded) of the tool module in fresh interpreters."""
+    probe = _IMPORT_PROBE.format(source=SOURCE_DIRECTORY, wip=WIP_DIRECTORY, module=TOOLS[tool][0])
+    times = []
+    loaded_pillow = False
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+        seconds, pillow = output.split()
+        times.append(float(seconds))
+        loaded_pillow = pillow == 'True'
+    return statistics.median(times), loaded_pillow
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the cold start of the GUI tools.")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--tool', choices=sorted(TOOLS), action='append', help="only these tools (repeatable)")
+    parser.add_argument('--executable', action='append', help="time '--version' of this built executable (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.executable:
+        for path in args.executable:
+            seconds = time_command([path, "--version"], args.runs)
+            print(f"{os.path.basename(path)}: --version {seconds * 1000:.0f} ms")
+        return 0
+
+    baseline = time_command([sys.executable, "-c", "pass"], args.runs)
+    print(f"interpreter start: {baseline * 1000:.0f} ms")
+    failed = False
+    for tool in args.tool or TOOLS:
+        seconds = time_command([sys.executable, script_path(tool), "--version"], args.runs)
+        line = f"{tool}: --version {seconds * 1000:.0f} ms"
+        try:
+            import_seconds, pillow = time_import(tool, args.runs)
+        except subprocess.CalledProcessError as e:
+            failed = True
+            error = e.stderr.strip().splitlines()[-1] if e.stderr.strip() else str(e)
+            print(f"{line}, import failed: {error}")
+            continue
+        print(f"{line}, import {import_seconds * 1000:.0f} ms, Pillow {'loaded' if pillow else 'deferred'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import io
+import os
+from launcher import lazy_import
+Image = lazy_import('PIL.Image')
+
+from png_header import replace_palette
+
+# Palette swapping logic shared by the GUI and the batch tools.
+
+def output_filename(filename, prefix, suffix):
+    """Return the name used for the swapped copy of 'filename'."""
+    return f"{prefix}{filename.replace('.png', '')}{suffix}.png"
+
+def list_png_files(directory):
+    """Return the names of the PNG files directly inside 'directory'."""
+    return [filename for filename in os.listdir(directory) if filename.endswith('.png')]
+
+def load_palette(palette_path):
+    """
+    Return the palette of an indexed (P) image.
+    Raises ValueError if the image is not in indexed palette mode.
+    """
+    with Image.open(palette_path) as palette_image:
+        if palette_image.mode != 'P':
+            raise ValueError("The palette image is not in indexed palette mode (P).")
+        return palette_image.getpalette()
+
+def load_palette_with_transparency(palette_path):
+    """
+    Like load_palette, but returns (palette, transparency) where transparency
+    is the transparent index, the bytes of a tRNS chunk with one alpha per
+    entry, or None.
+    """
+    with Image.open(palette_path) as palette_image:
+        if palette_image.mode != 'P':
+            raise ValueError("The palette image is not in indexed palette mode (P).")
+        transparency = palette_image.info.get('transparency')
+        if not isinstance(transparency, (int, bytes)):
+            transparency = None
+        return palette_image.getpalette(), transparency
+
+def swap_palette(image_path, output_path, palette):
+    """
+    Replace the palette of an indexed image and save it to 'output_path'.
+    Returns False without writing anything if the image is not indexed.
+    """
+    with Image.open(image_path) as image:
+        if image.mode != 'P':
+            return False
+        image.putpalette(palette)
+        image.save(output_path)
+    return True
+
+def encode_png(image, **options):
+    """Encode an image as PNG bytes; 'options' are Pillow PNG save options such as compress_level."""
+    output = io.BytesIO()
+    image.save(output, format='PNG', **options)
+    return output.getvalue()
+
+def swap_palette_image(data, palette):
+    """Decode PNG bytes and return the image with the new palette, or None if not indexed."""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode != 'P':
+            return None
+        image.load()
+        image.putpalette(palette)
+        return image
+
+def swap_palette_bytes(data, palette):
+    """
+    In-memory variant of swap_palette for the batch pipeline: takes the bytes
+    of a PNG file and returns the swapped PNG bytes, or None if not indexed.
+    """
+    image = swap_palette_image(data, palette)
+    return encode_png(image) if image is not None else None
+
+def swap_palette_variants(data, palettes):
+    """
+    Return the PNG bytes of an indexed image once per palette of 'palettes',
+    or None if it is not indexed. Only the PLTE chunk differs between the
+    outputs, so the image is neither decoded nor compressed again.
+    """
+    outputs = []
+    for palette in palettes:
+        output = replace_palette(data, palette)
+        if output is None:
+            return None
+        outputs.append(output)
+    return outputs
+
+# --- Index Remapping ---
+
+# When the new palette holds the same colours as the image's palette in a
+# different order (or with duplicates merged), the pixel indices are
+# translated instead of recolouring the entries in place. The translation
+# table is computed once per distinct source palette and applied to the
+# index buffer with a 256-entry lookup table, so the output stays exact.
+
+def entry_alpha(transparency, index):
+    """Alpha of palette entry 'index' given an image's transparency (index, tRNS bytes or None)."""
+    if isinstance(transparency, int):
+        return 0 if index == transparency else 255
+    if isinstance(transparency, bytes) and index < len(transparency):
+        return transparency[index]
+    return 255
+
+def _entry_key(palette, transparency, index):
+    alpha = entry_alpha(transparency, index)
+    # Fully transparent entries look the same whatever their colour
+    if alpha == 0:
+        return (0,)
+    return tuple(palette[index * 3:index * 3 + 3]) + (alpha,)
+
+def build_remap_table(source_palette, target_palette,
+                      source_transparency=None, target_transparency=None):
+    """
+    Map every source index to the target index holding the same colour and
+    alpha; transparencies are a transparent index, tRNS bytes or None.
+    Duplicated target colours map to their first entry. Returns (table,
+    missing) where table has 256 entries and missing is the set of source
+    indices whose colour (or transparency) is not in the target palette.
+    """
+    target_index = {}
+    for i in range(len(target_palette) // 3):
+        target_index.setdefault(_entry_key(target_palette, target_transparency, i), i)
+
+    table = list(range(256))
+    missing = set()
+    for i in range(len(source_palette) // 3):
+        key = _entry_key(source_palette, source_transparency, i)
+        if key in target_index:
+            table[i] = target_index[key]
+        else:
+            missing.add(i)
+    return table, missing
+
+class PaletteRemapper:
+    """Remaps indexed images to a target palette, caching one table per source palette."""
+    def __init__(self, target_palette, target_transparency=None):
+        self.target_palette = target_palette
+        self.target_transparency = target_transparency
+        self.tables = {}
+
+    def remap(self, image):
+        """
+        Return a copy of an indexed image using the target palette.
+        Raises ValueError if the image uses a colour, or a transparent or
+        translucent entry, that the target palette lacks.
+        """
+        source_palette = image.getpalette()
+        source_transparency = image.info.get('transparency')
+        if not isinstance(source_transparency, (int, bytes)):
+            source_transparency = None
+        key = (bytes(source_palette), source_transparency)
+        if key not in self.tables:
+            self.tables[key] = build_remap_table(source_palette, self.target_palette,
+                                                 source_transparency, self.target_transparency)
+        table, missing = self.tables[key]
+        if missing:
+            used_missing = missing.intersection(index for _, index in image.getcolors(256))
+            if used_missing:
+                colors = sorted(tuple(source_palette[i * 3:i * 3 + 3]) for i in used_missing
+                                if entry_alpha(source_transparency, i) == 255)
+                alphas = sorted({entry_alpha(source_transparency, i) for i in used_missing} - {255})
+                problems = []
+                if colors:
+                    problems.append(f"Colors missing from the new palette: {colors}")
+                if alphas:
+                    problems.append(f"The new palette has no entry with transparency (alpha {alphas})")
+                raise ValueError("; ".join(problems))
+
+        remapped = image.point(table)
+        remapped.putpalette(self.target_palette)
+        remapped.info.pop('transparency', None)
+        if self.target_transparency is not None:
+            remapped.info['transparency'] = self.target_transparency
+        return remapped
+
+    def remap_data(self, data):
+        """Decode PNG bytes and return the remapped image, or None if not indexed."""
+        with Image.open(io.BytesIO(data)) as image:
+            if image.mode != 'P':
+                return None
+            return self.remap(image)
+
+    def remap_bytes(self, data):
+        """Pipeline variant: PNG bytes in, remapped PNG bytes out (None if not indexed)."""
+        image = self.remap_data(data)
+        return encode_png(image) if image is not None else None
@@ -0,0 +1,225 @@
+import io
+import os
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+from swap_engine import load_palette_with_transparency, PaletteRemapper
+
+# Local HTTP service returning palette-swapped previews for the level editor
+# and other in-house tools, so they avoid starting a new Python process (and
+# importing Pillow) for every preview. Parsed palettes and recently decoded
+# images are kept in LRU caches. The server only listens on localhost.
+#
+# Usage: python swap_service.py PALETTE_DIR [--port 8765]
+#
+#   POST /swap?palette=ID[&path=IMAGE][&remap=1]   body: PNG bytes if no path
+#   GET  /palettes                                  ids of the available palettes
+#   GET  /metrics                                   latency and cache statistics
+
+DEFAULT_PORT = 8765
+PALETTE_CACHE_SIZE = 64
+IMAGE_CACHE_SIZE = 256
+# Number of recent requests used for the latency percentiles
+LATENCY_WINDOW = 1000
+
+class LRUCache:
+    """Thread-safe least-recently-used cache that counts hits and misses."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+class SwapService:
+    """Swaps palettes on request, keeping palettes and decoded images warm."""
+
+    def __init__(self, palette_directory, palette_cache_size=PALETTE_CACHE_SIZE, image_cache_size=IMAGE_CACHE_SIZE):
+        self.palette_directory = palette_directory
+        self.palettes = LRUCache(palette_cache_size)
+        self.images = LRUCache(image_cache_size)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def palette_ids(self):
+        return sorted(os.path.splitext(f)[0] for f in os.listdir(self.palette_directory) if f.endswith('.png'))
+
+    def palette(self, palette_id):
+        """Return (palette, remapper) for a palette id, reloading it if the file changed."""
+        if not palette_id or os.path.basename(palette_id) != palette_id:
+            raise ValueError(f"Invalid palette id: {palette_id!r}")
+        path = os.path.join(self.palette_directory, palette_id + '.png')
+        if not os.path.isfile(path):
+            raise ValueError(f"Unknown palette: {palette_id}")
+        key = (path, os.stat(path).st_mtime_ns)
+        entry = self.palettes.get(key)
+        if entry is None:
+            palette, transparency = load_palette_with_transparency(path)
+            entry = (palette, PaletteRemapper(palette, transparency))
+            self.palettes.put(key, entry)
+        return entry
+
+    def decoded_image(self, path):
+        """Return the decoded image at 'path', from the cache while the file is unchanged."""
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        image = self.images.get(key)
+        if image is None:
+            with Image.open(path) as opened:
+                opened.load()
+                image = opened.copy()
+            self.images.put(key, image)
+        return image
+
+    def swap(self, palette_id, path=None, data=None, remap=False):
+        """Return the PNG bytes of the image (file path or bytes) with the palette applied."""
+        palette, remapper = self.palette(palette_id)
+        if path is not None:
+            image = self.decoded_image(path)
+        else:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        if image.mode != 'P':
+            raise ValueError("The image is not in indexed palette mode (P).")
+        if remap:
+            swapped = remapper.remap(image)
+        else:
+            # Cached images are shared between requests, so work on a copy
+            swapped = image.copy()
+            swapped.putpalette(palette)
+        output = io.BytesIO()
+        swapped.save(output, format='PNG')
+        return output.getvalue()
+
+    def record(self, seconds, failed):
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+            self.latencies.append(seconds)
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            requests, errors = self.requests, self.errors
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            'requests': requests,
+            'errors': errors,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+            },
+            'palette_cache': self.palettes.stats(),
+            'image_cache': self.images.stats(),
+        }
+
+class SwapRequestHandler(BaseHTTPRequestHandler):
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, value):
+        self.send_body(status, json.dumps(value).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        service = self.server.service
+        route = urlparse(self.path).path
+        if route == '/metrics':
+            self.send_json(200, service.metrics())
+        elif route == '/palettes':
+            self.send_json(200, service.palette_ids())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path != '/swap':
+            self.send_json(404, {'error': 'not found'})
+            return
+        start = time.perf_counter()
+        query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length) if length else None
+        try:
+            png = service.swap(
+                query.get('palette', [None])[0],
+                path=query.get('path', [None])[0],
+                data=data,
+                remap=query.get('remap', ['0'])[0] == '1',
+            )
+        except Exception as e:
+            service.record(time.perf_counter() - start, True)
+            self.send_json(400, {'error': str(e)})
+            return
+        service.record(time.perf_counter() - start, False)
+        self.send_body(200, png, 'image/png')
+
+    def log_message(self, format, *args):
+        # Previews are requested constantly; keep the console quiet
+        pass
+
+def create_server(palette_directory, port=DEFAULT_PORT):
+    """Create (without starting) a swap server bound to localhost."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), SwapRequestHandler)
+    server.service = SwapService(palette_directory)
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve palette-swapped PNG previews on localhost.")
+    parser.add_argument('palettes', help="directory with the indexed PNG palettes; their file names are the ids")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    server = create_server(args.palettes, args.port)
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import select
+import struct
+import argparse
+
+from swap_engine import output_filename, list_png_files, load_palette, load_palette_with_transparency, swap_palette, PaletteRemapper
+
+# Watch mode: keeps running and re-swaps sprites as soon as artists save
+# them, or every sprite when the palette itself changes. On Linux changes
+# are received from inotify, so an idle watcher uses no CPU; elsewhere the
+# directories are polled. Bursts of saves are debounced into a single batch
+# and the parsed palette is kept in memory between batches.
+#
+# Usage: python watch_mode.py IMAGE_DIR PALETTE.png [--prefix P] [--suffix S] [--output DIR] [--remap]
+
+# Quiet time after the last event before a batch is processed
+DEBOUNCE_SECONDS = 0.05
+POLL_INTERVAL_SECONDS = 1.0
+
+class InotifyWatcher:
+    """Reports changed files in a set of directories using Linux inotify."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directories):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.directories = {}
+        # New files are reported when closed after writing, or when moved into place
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        for directory in directories:
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            self.directories[wd] = directory
+
+    def wait(self, timeout=None):
+        """Block up to 'timeout' seconds (forever if None) and return the set of changed paths."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name and wd in self.directories:
+                changed.add(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return changed
+
+class PollingWatcher:
+    """Fallback watcher comparing file sizes and modification times periodically."""
+
+    def __init__(self, directories, interval=POLL_INTERVAL_SECONDS):
+        self.directories = list(directories)
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for directory in self.directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        st = entry.stat()
+                        snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._scan()
+            changed = {path for path, signature in current.items() if self.snapshot.get(path) != signature}
+            self.snapshot = current
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else min(self.interval, max(0, deadline - time.monotonic())))
+
+def create_watcher(directories):
+    """Return an inotify watcher when available, a polling one otherwise."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directories)
+
+class SwapWatcher:
+    """Re-applies a palette to the sprites of a directory whenever they change."""
+
+    def __init__(self, directory, palette_path, prefix='', suffix='_palette_swap', output_directory=None,
+                 remap=False, log=print):
+        self.directory = os.path.abspath(directory)
+        self.palette_path = os.path.abspath(palette_path)
+        self.prefix = prefix
+        self.suffix = suffix
+        self.output_directory = os.path.abspath(output_directory or directory)
+        self.remap = remap
+        self.log = log
+        # Files we write ourselves must not be swapped. The palette is kept
+        # apart: its changes have to reach handle()
+        self.outputs = set()
+        self.load_palette()
+
+    def load_palette(self):
+        if self.remap:
+            self.remapper = PaletteRemapper(*load_palette_with_transparency(self.palette_path))
+        else:
+            self.palette = load_palette(self.palette_path)
+
+    def output_path(self, image_path):
+        return os.path.join(self.output_directory, output_filename(os.path.basename(image_path), self.prefix, self.suffix))
+
+    def swap(self, image_path):
+        output_path = self.output_path(image_path)
+        self.outputs.add(output_path)
+        start = time.perf_counter()
+        try:
+            if self.remap:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+                output_bytes = self.remapper.remap_bytes(data)
+                if output_bytes is None:
+                    return
+                with open(output_path, 'wb') as f:
+                    f.write(output_bytes)
+            elif not swap_palette(image_path, output_path, self.palette):
+                return
+        except Exception as e:
+            self.log(f"Error swapping {image_path}: {e}")
+            return
+        self.log(f"Swapped {os.path.basename(image_path)} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def swap_all(self):
+        sources = [os.path.join(self.directory, filename) for filename in list_png_files(self.directory)]
+        # Outputs of earlier runs may sit next to the sources; never swap them again
+        self.outputs.update(self.output_path(source) for source in sources)
+        for source in sources:
+            if source not in self.outputs and source != self.palette_path:
+                self.swap(source)
+
+    def handle(self, changed):
+        """Process one debounced batch of changed paths."""
+        if self.palette_path in changed:
+            try:
+                self.load_palette()
+            except Exception as e:
+                self.log(f"Error loading palette: {e}")
+                return
+            self.log("Palette changed, swapping every sprite")
+            self.swap_all()
+            return
+        for path in sorted(changed):
+            if (os.path.dirname(path) == self.directory and path.endswith('.png')
+                    and path not in self.outputs and path != self.palette_path and os.path.isfile(path)):
+                self.swap(path)
+
+    def run(self, watcher=None):
+        """Swap everything once, then process changes until interrupted."""
+        self.swap_all()
+        directories = {self.directory, os.path.dirname(self.palette_path)}
+        watcher = watcher or create_watcher(directories)
+        self.log(f"Watching {', '.join(sorted(directories))} ({type(watcher).__name__})")
+        while True:
+            changed = watcher.wait()
+            # Debounce: keep collecting until saves stop arriving
+            while True:
+                more = watcher.wait(DEBOUNCE_SECONDS)
+                if not more:
+                    break
+                changed |= more
+            self.handle(changed - self.outputs)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-apply a palette to sprites whenever they or the palette change.")
+    parser.add_argument('directory', help="directory with the indexed PNG sprites")
+    parser.add_argument('palette', help="indexed PNG whose palette is applied")
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--suffix', default='_palette_swap')
+    parser.add_argument('--output', help="output directory (defaults to the image directory)")
+    parser.add_argument('--remap', action='store_true', help="translate indices instead of recolouring entries")
+    args = parser.parse_args(argv)
+    watcher = SwapWatcher(args.directory, args.palette, args.prefix, args.suffix, args.output, args.remap)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
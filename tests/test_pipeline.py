@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "source"))
+
+from pipeline import run_pipeline
+
+class RunPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.items = []
+        for i in range(50):
+            source = os.path.join(self.directory, f"{i}.bin")
+            with open(source, 'wb') as f:
+                f.write(bytes([i]) * 10)
+            self.items.append((source, source + ".out"))
+
+    def test_every_file_reaches_on_result(self):
+        finished = []
+        run_pipeline(self.items, lambda data, source: (data, None),
+                     lambda source, output, info, error: finished.append(source), queue_depth=2)
+        self.assertEqual(sorted(finished), sorted(source for source, _ in self.items))
+
+    def test_failing_on_result_stops_the_workers(self):
+        threads = threading.active_count()
+
+        def on_result(source, output, info, error):
+            raise RuntimeError("on_result failed")
+
+        with self.assertRaises(RuntimeError):
+            run_pipeline(self.items, lambda data, source: (data, None), on_result, queue_depth=2)
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread():
+                thread.join(timeout=5)
+        self.assertEqual(threading.active_count(), threads)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "source"))
+
+from PIL import Image
+
+from watch_mode import SwapWatcher
+
+class StopWatching(Exception):
+    pass
+
+class StubWatcher:
+    """Reports one batch of changes per call of the given functions, then stops the watch loop."""
+
+    def __init__(self, *batches):
+        self.batches = list(batches)
+
+    def wait(self, timeout=None):
+        if timeout is not None:
+            # Debounce wait: nothing else arrives
+            return set()
+        if not self.batches:
+            raise StopWatching()
+        return set(self.batches.pop(0)())
+
+def save_indexed(path, palette, pixels):
+    image = Image.new('P', (len(pixels), 1))
+    image.putpalette(palette + [0] * (768 - len(palette)))
+    image.putdata(pixels)
+    image.save(path)
+
+class SwapWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.palette_path = os.path.join(self.directory, "palette.png")
+        self.sprite_path = os.path.join(self.directory, "sprite.png")
+        self.output_path = os.path.join(self.directory, "sprite_palette_swap.png")
+        save_indexed(self.palette_path, [0, 0, 0, 255, 0, 0], [0, 1])
+        save_indexed(self.sprite_path, [9, 9, 9, 8, 8, 8], [0, 1, 1])
+        self.messages = []
+
+    def run_watcher(self, *batches):
+        watcher = SwapWatcher(self.directory, self.palette_path, log=self.messages.append)
+        with self.assertRaises(StopWatching):
+            watcher.run(StubWatcher(*batches))
+        return watcher
+
+    def swapped(self):
+        return [message for message in self.messages if message.startswith("Swapped")]
+
+    def test_palette_change_reswaps_every_sprite(self):
+        def edit_palette():
+            save_indexed(self.palette_path, [0, 0, 0, 0, 0, 255], [0, 1])
+            return [self.palette_path]
+        watcher = self.run_watcher(edit_palette)
+
+        self.assertIn("Palette changed, swapping every sprite", self.messages)
+        with Image.open(self.output_path) as image:
+            self.assertEqual(image.getpalette()[:6], [0, 0, 0, 0, 0, 255])
+        # The palette sits next to the sprites but is never swapped itself
+        self.assertFalse(os.path.exists(watcher.output_path(self.palette_path)))
+        self.assertEqual(len(self.swapped()), 2)
+
+    def test_own_outputs_are_not_swapped_again(self):
+        self.run_watcher(lambda: [self.output_path])
+        self.assertEqual(len(self.swapped()), 1)
+
+if __name__ == "__main__":
+    unittest.main()